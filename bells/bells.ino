@@ -4,9 +4,31 @@
 #define CLICKY_FOUR 11
 #define NUM_CLICKYS 4
 #define NUM_PARAMS 2
+// Binary frames are a type byte, a payload and a checksum (sum of the others)
+//   'B' relay bitmask u8, sets every relay
+//   'T' relay bitmask u8, duration ms u16 little endian, turns the relays set
+//       on and off again duration ms later
+#define BINARY_BELLS 'B'
+#define BINARY_PULSE 'T'
+#define BINARY_FRAME_LENGTH 3
+#define PULSE_FRAME_LENGTH 5
+// The host asks with READY_QUERY and waits for READY before sending
+#define READY_QUERY '?'
+#define READY '!'
+// Sent FLOW_CONTROL, the sketch answers FLOW_CONTROL and RX_WINDOW (u16 little
+// endian) then writes ACK once done with each frame, good or bad. The host
+// never has more than RX_WINDOW bytes unacknowledged, so the receive buffer
+// can't overflow while the sketch is busy.
+#define FLOW_CONTROL '$'
+#define ACK '+'
+// The Uno's serial receive buffer
+#define RX_WINDOW 64
 
 boolean newData = false;
 int indexRead = 0;
+byte binaryFrame[PULSE_FRAME_LENGTH];
+int binaryIndex = 0;
+boolean acking = false;
 
 boolean params[NUM_CLICKYS] = {
   false,
@@ -15,6 +37,10 @@ boolean params[NUM_CLICKYS] = {
   false
 };
 
+// millis() each pulse started and how long it lasts, 0 when not pulsing
+unsigned long pulseStart[NUM_CLICKYS];
+unsigned int pulseLength[NUM_CLICKYS];
+
 byte keys[NUM_CLICKYS] = {
   CLICKY_ONE,
   CLICKY_TWO,
@@ -22,6 +48,19 @@ byte keys[NUM_CLICKYS] = {
   CLICKY_FOUR
 };
 
+void grantCredits() {
+  acking = true;
+  Serial.write(FLOW_CONTROL);
+  Serial.write(RX_WINDOW & 0xFF);
+  Serial.write(RX_WINDOW >> 8);
+}
+
+void acknowledge() {
+  if (acking) {
+    Serial.write(ACK);
+  }
+}
+
 void setup()
 {
   pinMode(CLICKY_ONE, OUTPUT);
@@ -30,6 +69,7 @@ void setup()
   pinMode(CLICKY_FOUR, OUTPUT);
   Serial.begin(9600);
   delay(2000);
+  Serial.write(READY);
 }
 
 void writeKey(int index, boolean state) {
@@ -39,6 +79,19 @@ void writeKey(int index, boolean state) {
 void loop() {
   getData();
   execute();
+  endPulses();
+}
+
+void endPulses() {
+  unsigned long now = millis();
+  for (int i = 0; i < NUM_CLICKYS; i++) {
+    // Unsigned subtraction, so still right when millis() wraps
+    if (pulseLength[i] > 0 && now - pulseStart[i] >= pulseLength[i]) {
+      pulseLength[i] = 0;
+      params[i] = false;
+      writeKey(i, false);
+    }
+  }
 }
 
 void writeKeys() {
@@ -53,7 +106,20 @@ void getData() {
 
   while (Serial.available() > 0 && newData == false) {
     recievedChar = Serial.read();
+    if (binaryIndex == 0 && recievedChar == READY_QUERY) {
+      Serial.write(READY);
+      continue;
+    }
+    if (binaryIndex == 0 && recievedChar == FLOW_CONTROL) {
+      grantCredits();
+      continue;
+    }
+    if (binaryIndex > 0 || recievedChar == BINARY_BELLS || recievedChar == BINARY_PULSE) {
+      readBinary(recievedChar);
+      continue;
+    }
     params[indexRead] = recievedChar == '1';
+    pulseLength[indexRead] = 0;
     indexRead += 1;
     if (indexRead == 4) {
       newData = true;
@@ -61,10 +127,46 @@ void getData() {
   }
 }
 
+void readBinary(byte recievedByte) {
+  binaryFrame[binaryIndex] = recievedByte;
+  binaryIndex += 1;
+  byte frameLength = binaryFrame[0] == BINARY_PULSE ? PULSE_FRAME_LENGTH : BINARY_FRAME_LENGTH;
+  if (binaryIndex < frameLength) {
+    return;
+  }
+  binaryIndex = 0;
+  byte checksum = 0;
+  for (byte i = 0; i < frameLength - 1; i++) {
+    checksum += binaryFrame[i];
+  }
+  // A bad checksum throws the whole frame away
+  if (checksum != binaryFrame[frameLength - 1]) {
+    acknowledge();
+    return;
+  }
+  if (binaryFrame[0] == BINARY_PULSE) {
+    unsigned int length = binaryFrame[2] | binaryFrame[3] << 8;
+    for (int i = 0; i < NUM_CLICKYS; i++) {
+      if (binaryFrame[1] & (1 << i)) {
+        params[i] = true;
+        pulseStart[i] = millis();
+        pulseLength[i] = length;
+      }
+    }
+  } else {
+    for (int i = 0; i < NUM_CLICKYS; i++) {
+      params[i] = binaryFrame[1] & (1 << i);
+      pulseLength[i] = 0;
+    }
+  }
+  newData = true;
+}
+
 void execute() {
   if (newData) {
     writeKeys();
     newData = false;
     indexRead = 0;
+    acknowledge();
   }
 }
@@ -18,6 +18,39 @@ String percentParam;
 int parameterIndex;
 boolean newData;
 
+// Binary frames are a type byte, a fixed little endian payload and a checksum
+// byte (the sum of the others).
+//   'C' percent tenths u8, combo u32
+//   'W' percent tenths u8, wpm u16
+//   'E' percent tenths u8, max combo u32, max wpm u16
+//   'R' x u8, y u8, w u8, h u8, run count u8, then (count u8, color u8) runs
+//       filling the rect row by row, colors RGB 3-3-2. The host renders the
+//       frames, these just blit them.
+#define BINARY_COMBO 'C'
+#define BINARY_WPM 'W'
+#define BINARY_GAME_OVER 'E'
+#define BINARY_RECT 'R'
+#define RECT_HEADER_LENGTH 6
+#define MAX_BINARY_FRAME_LENGTH (RECT_HEADER_LENGTH + 2 * 255 + 1)
+// The host asks with READY_QUERY and waits for READY before sending
+#define READY_QUERY '?'
+#define READY '!'
+// Sent FLOW_CONTROL, the sketch answers FLOW_CONTROL and RX_WINDOW (u16 little
+// endian) then writes ACK once done with each frame, good or bad. The host
+// never has more than RX_WINDOW bytes unacknowledged, so the receive buffer
+// can't overflow while the sketch is busy.
+#define FLOW_CONTROL '$'
+#define ACK '+'
+// The Metro M4's serial receive buffer
+#define RX_WINDOW 350
+
+boolean newBinaryData;
+byte binaryFrame[MAX_BINARY_FRAME_LENGTH];
+uint16_t binaryIndex;
+uint16_t binaryFrameLength;
+char binaryDisplayValue[24];
+boolean acking = false;
+
 char* wpm = "WPM";
 char* combo = "COMBO";
 char* stopped = "MAXC MAXW";
@@ -28,6 +61,116 @@ void resetState() {
   modeParam = 's';
   percentParam = String("");
   parameterIndex = 0;
+  newBinaryData = false;
+  binaryIndex = 0;
+  binaryFrameLength = 0;
+}
+
+void grantCredits() {
+  acking = true;
+  Serial.write(FLOW_CONTROL);
+  Serial.write(RX_WINDOW & 0xFF);
+  Serial.write(RX_WINDOW >> 8);
+}
+
+void acknowledge() {
+  if (acking) {
+    Serial.write(ACK);
+  }
+}
+
+byte frameLengthFor(char frameType) {
+  if (frameType == BINARY_COMBO) {
+    return 7;
+  } else if (frameType == BINARY_WPM) {
+    return 5;
+  } else if (frameType == BINARY_GAME_OVER) {
+    return 9;
+  } else if (frameType == BINARY_RECT) {
+    // Until the run count arrives
+    return RECT_HEADER_LENGTH + 1;
+  }
+  return 0;
+}
+
+uint32_t readUint(byte start, byte numBytes) {
+  uint32_t value = 0;
+  for (byte i = 0; i < numBytes; i++) {
+    value |= ((uint32_t)binaryFrame[start + i]) << (8 * i);
+  }
+  return value;
+}
+
+void readBinary(byte recievedByte) {
+  if (binaryIndex == 0) {
+    binaryFrameLength = frameLengthFor(recievedByte);
+  }
+  binaryFrame[binaryIndex] = recievedByte;
+  binaryIndex += 1;
+  if (binaryFrame[0] == BINARY_RECT && binaryIndex == RECT_HEADER_LENGTH) {
+    binaryFrameLength = RECT_HEADER_LENGTH + 2 * binaryFrame[5] + 1;
+  }
+  if (binaryIndex < binaryFrameLength) {
+    return;
+  }
+  byte checksum = 0;
+  for (uint16_t i = 0; i < binaryFrameLength - 1; i++) {
+    checksum += binaryFrame[i];
+  }
+  binaryIndex = 0;
+  // A bad checksum throws the whole frame away
+  newBinaryData = checksum == binaryFrame[binaryFrameLength - 1];
+  if (!newBinaryData) {
+    acknowledge();
+  }
+}
+
+void blitRect() {
+  byte x = binaryFrame[1];
+  byte y = binaryFrame[2];
+  byte w = binaryFrame[3];
+  uint16_t pixel = 0;
+  if (w == 0) {
+    resetState();
+    return;
+  }
+  for (uint16_t run = 0; run < binaryFrame[5]; run++) {
+    byte count = binaryFrame[RECT_HEADER_LENGTH + 2 * run];
+    byte color = binaryFrame[RECT_HEADER_LENGTH + 2 * run + 1];
+    byte blue = color & 3;
+    uint16_t color333 = matrix.Color333(
+      color >> 5, (color >> 2) & 7, (blue << 1) | (blue >> 1)
+    );
+    for (byte i = 0; i < count; i++, pixel++) {
+      matrix.drawPixel(x + pixel % w, y + pixel / w, color333);
+    }
+  }
+  resetState();
+}
+
+void executeBinary() {
+  if (binaryFrame[0] == BINARY_RECT) {
+    blitRect();
+    return;
+  }
+  const char* mode;
+  if (binaryFrame[0] == BINARY_COMBO) {
+    mode = combo;
+    sprintf(binaryDisplayValue, "%lu", (unsigned long)readUint(2, 4));
+  } else if (binaryFrame[0] == BINARY_WPM) {
+    mode = wpm;
+    sprintf(binaryDisplayValue, "%lu", (unsigned long)readUint(2, 2));
+  } else {
+    mode = stopped;
+    sprintf(
+      binaryDisplayValue,
+      "%lu  %lu",
+      (unsigned long)readUint(2, 4),
+      (unsigned long)readUint(6, 2)
+    );
+  }
+  drawPage(mode, binaryDisplayValue, binaryFrame[1] / 10.0);
+  resetState();
 }
 
 void clearScreen() {
@@ -121,8 +264,11 @@ void setup() {
   matrix.begin();
   drawPage(combo, "0", 1);
   resetState();
+  // USB serial on the Metro M4 goes as fast as the host opens it, eg. at
+  // 115200 for host rendered frames, whatever rate is given here
   Serial.begin(9600);
   delay(2000);
+  Serial.write(READY);
 }
 
 
@@ -134,9 +280,19 @@ void loop() {
 void getData() {
   static byte index = 0;
   char recievedChar;
-  while (Serial.available() > 0 && newData == false) {
+  while (Serial.available() > 0 && newData == false && newBinaryData == false) {
     recievedChar = Serial.read();
-    if (recievedChar == ';') {
+    if (binaryIndex == 0 && recievedChar == READY_QUERY) {
+      Serial.write(READY);
+      continue;
+    }
+    if (binaryIndex == 0 && recievedChar == FLOW_CONTROL) {
+      grantCredits();
+      continue;
+    }
+    if (binaryIndex > 0 || frameLengthFor(recievedChar) > 0) {
+      readBinary(recievedChar);
+    } else if (recievedChar == ';') {
       newData = true;
     } else if (recievedChar == ',') {
       parameterIndex += 1;
@@ -153,7 +309,10 @@ void getData() {
 }
 
 void execute() {
-  if (newData) {
+  if (newBinaryData) {
+    executeBinary();
+    acknowledge();
+  } else if (newData) {
     const char* mode;
     if (modeParam == 'c') {
       mode = combo;
@@ -164,6 +323,7 @@ void execute() {
     }
     drawPage(mode, displayValueParam.c_str(), percentParam.toFloat());
     resetState();
+    acknowledge();
   }
 
 }
@@ -0,0 +1,174 @@
+"""
+Host side animation for the LED strip.
+
+The strip is drawn into a framebuffer on the host, a bytearray holding a
+colour table index (or STRIP_OFF) per pixel, and only what changed since the
+last frame sent goes down the wire, as runs of one colour. An effect costs the
+link what it changes, not what it draws. See AnimatedStripController for the
+frame rate.
+"""
+from __future__ import annotations
+
+import math
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from power_mode.core import GameState
+from power_mode.protocol import STRIP_OFF, StripPixels
+
+# Indexes into the strip firmware's colour table
+GREEN = 0
+RED = 1
+ORANGE = 2
+YELLOW = 3
+BLUE = 4
+INDIGO = 5
+VIOLET = 6
+SPRING_GREEN = 7
+OFF = STRIP_OFF
+
+
+def blank(size: int) -> bytearray:
+    return bytearray([OFF]) * size
+
+
+def diff(shown: bytearray, frame: bytearray) -> List[StripPixels]:
+    """
+    Runs of one colour that take the strip from shown to frame. A run covers
+    every changed pixel of a stretch of frame in that colour, and so may
+    rewrite pixels in between that were already right.
+    """
+    runs = []
+    size = len(frame)
+    i = 0
+    while i < size:
+        if shown[i] == frame[i]:
+            i += 1
+            continue
+        color = frame[i]
+        start = end = i
+        i += 1
+        while i < size and frame[i] == color:
+            if shown[i] != color:
+                end = i
+            i += 1
+        runs.append(StripPixels(start, end, color))
+    return runs
+
+
+class StripAnimation:
+    """
+    What the strip shows at a given time: the pixels keys have lit, with a
+    trail fading through TRAIL_COLORS behind the newest, a blinking flash
+    every MILESTONE of combo and, once less than BAR_FROM of the time is left,
+    a bar counting down the rest over the end of the strip.
+
+    Keys only update the model, frames are drawn by render().
+    """
+
+    TRAIL_COLORS = (YELLOW, ORANGE, RED)
+    # Seconds a lit pixel spends on each trail colour
+    TRAIL_STEP = 0.08
+    MILESTONE = 100
+    FLASH_COLOR = VIOLET
+    FLASH_TIME = 0.6
+    FLASH_BLINK = 0.15
+    BAR_PIXELS = 16
+    BAR_FROM = 0.5
+    BAR_COLOR = RED
+    # Wake just after a step, not on the edge
+    STEP_SLACK = 0.001
+
+    def __init__(self, size: int):
+        self.size = size
+        # Pixels lit by keys
+        self.base = blank(size)
+        # (pixel, time lit) of pixels still in the trail, oldest first. A
+        # pixel lit a whole pass ago has been lit again since.
+        self._trail: Deque[Tuple[int, float]] = deque(maxlen=size)
+        self._milestones = 0
+        self._flash_start = -math.inf
+
+    @property
+    def is_blank(self) -> bool:
+        return not self._trail and self.base.count(OFF) == self.size
+
+    def light(self, start: int, end: int, color: int, now: float) -> None:
+        self.base[start : end + 1] = bytes([color]) * (end + 1 - start)
+        trail = self._trail
+        for pixel in range(start, end + 1):
+            trail.append((pixel, now))
+
+    def combo(self, combo: int, now: float) -> None:
+        milestones = combo // self.MILESTONE
+        if milestones > self._milestones:
+            self._flash_start = now
+        self._milestones = milestones
+
+    def clear(self) -> None:
+        self.base = blank(self.size)
+        self._trail.clear()
+        self._milestones = 0
+        self._flash_start = -math.inf
+
+    def render(self, state: GameState, now: float) -> bytearray:
+        since_flash = now - self._flash_start
+        if since_flash < self.FLASH_TIME and not (
+            int(since_flash / self.FLASH_BLINK) % 2
+        ):
+            return bytearray([self.FLASH_COLOR]) * self.size
+        frame = bytearray(self.base)
+        self._draw_trail(frame, now)
+        if state.current_combo:
+            self._draw_bar(frame, state.percent_time_left_at(now))
+        return frame
+
+    def next_change(self, state: GameState, now: float) -> Optional[float]:
+        """
+        When render() next draws something different, with no more keys
+        """
+        changes = []
+        since_flash = now - self._flash_start
+        if since_flash < self.FLASH_TIME:
+            blink = self.FLASH_BLINK
+            changes.append(self._flash_start + (since_flash // blink + 1) * blink)
+        step = self.TRAIL_STEP
+        for _, lit_at in self._trail:
+            changes.append(lit_at + ((now - lit_at) // step + 1) * step)
+        if state.current_combo:
+            bar_step = self._next_bar_step(state, now)
+            if bar_step is not None:
+                changes.append(bar_step)
+        if not changes:
+            return None
+        return min(changes) + self.STEP_SLACK
+
+    def _draw_trail(self, frame: bytearray, now: float) -> None:
+        trail = self._trail
+        fade_time = self.TRAIL_STEP * len(self.TRAIL_COLORS)
+        while trail and now - trail[0][1] >= fade_time:
+            trail.popleft()
+        last = len(self.TRAIL_COLORS) - 1
+        for pixel, lit_at in trail:
+            step = int((now - lit_at) / self.TRAIL_STEP)
+            frame[pixel] = self.TRAIL_COLORS[min(step, last)]
+
+    def _draw_bar(self, frame: bytearray, percent_left: float) -> None:
+        if percent_left >= self.BAR_FROM:
+            return
+        lit = math.ceil(self.BAR_PIXELS * percent_left / self.BAR_FROM)
+        bar_start = self.size - self.BAR_PIXELS
+        frame[bar_start : bar_start + lit] = bytes([self.BAR_COLOR]) * lit
+        frame[bar_start + lit :] = blank(self.BAR_PIXELS - lit)
+
+    def _next_bar_step(self, state: GameState, now: float) -> Optional[float]:
+        """
+        The bar appears at BAR_FROM and loses a pixel each time the time left
+        drops past a multiple of BAR_FROM / BAR_PIXELS
+        """
+        timeout_at = state.time_of_last_key + state.combo_timeout
+        step = state.combo_timeout * self.BAR_FROM / self.BAR_PIXELS
+        steps_left = math.ceil((timeout_at - now) / step) - 1
+        if steps_left < 0:
+            return None
+        return timeout_at - min(steps_left, self.BAR_PIXELS) * step
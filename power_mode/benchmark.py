@@ -0,0 +1,444 @@
+"""
+End to end benchmark of the key and tick paths.
+
+Runs typing profiles through a real GameManager, GameState and every
+controller, writing to in-memory serial ports, and reports per event latency,
+memory allocated per event and bytes written per device.
+
+    python -m power_mode.benchmark --save baseline.json
+    python -m power_mode.benchmark --compare baseline.json
+
+--sessions N plays the profile on N keyboards at once through a SessionManager,
+to see how the per event cost holds up with more players. --coalesce 0.01
+batches keys as GameManager's coalesce_window does.
+
+Cold start is measured too: how long importing the game takes in a fresh
+interpreter and how many modules it loads, including any of the hardware and
+asyncio stacks that should only load when used.
+"""
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import statistics
+import subprocess
+import sys
+import tracemalloc
+from functools import partial
+from time import perf_counter
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    cast,
+)
+
+from power_mode.clock import VirtualClock
+from power_mode.controllers import (
+    BalloonFanController,
+    BellController,
+    ScreenController,
+    SerialOutputController,
+    StripController,
+)
+from power_mode.core import GameManager
+from power_mode.keys import Key
+from power_mode.memory_serial import MemorySerial
+from power_mode.protocol import ASCII, BINARY, Codec
+from power_mode.scheduler import TickScheduler
+from power_mode.sessions import SessionManager
+
+LETTER = Key.OTHER
+
+
+class Profile(NamedTuple):
+    name: str
+    description: str
+    # (seconds since the previous key, key) pairs
+    keys: Callable[[], Iterator[Tuple[float, Key]]]
+
+
+def _steady() -> Iterator[Tuple[float, Key]]:
+    # 120 words a minute is 10 keys a second, with the odd typo fixed
+    for i in range(600):
+        yield 0.1, Key.BACKSPACE if i % 20 == 19 else LETTER
+
+
+def _bursts() -> Iterator[Tuple[float, Key]]:
+    for _ in range(10):
+        yield 2.0, LETTER
+        for _ in range(29):
+            yield 0.015, LETTER
+
+
+def _autorepeat() -> Iterator[Tuple[float, Key]]:
+    for _ in range(1000):
+        yield 0.005, LETTER
+
+
+# Players start this far apart so their keys don't all land at once
+SESSION_STAGGER = 0.0037
+
+PROFILES = [
+    Profile("steady", "steady 120 WPM for a minute", _steady),
+    Profile("bursts", "ten 30 key bursts two seconds apart", _bursts),
+    Profile("autorepeat", "1000 keys at 200 keys/s", _autorepeat),
+]
+
+
+# Modules that importing the game shouldn't load, they come in lazily
+HEAVY_MODULES = ("pynput", "serial", "asyncio")
+STARTUP_MODULES = {"core": "power_mode.core", "main": "power_mode.main"}
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = set(sys.modules) - before
+heavy = {{name.split(".")[0] for name in loaded}} & set({heavy!r})
+print(json.dumps([elapsed, len(loaded), sorted(heavy)]))
+"""
+
+
+def measure_startup(runs: int = 5) -> Dict[str, Dict[str, float]]:
+    """
+    Median import time of each of STARTUP_MODULES over runs fresh
+    interpreters, with the modules it loaded
+    """
+    results: Dict[str, Dict[str, float]] = {}
+    for name, module in STARTUP_MODULES.items():
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    _STARTUP_SCRIPT.format(module=module, heavy=HEAVY_MODULES),
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            samples.append(json.loads(output))
+        results[name] = {
+            "import_ms": statistics.median(sample[0] for sample in samples) * 1e3,
+            "modules": samples[-1][1],
+            "heavy_modules": len(samples[-1][2]),
+        }
+    return results
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"p50": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    return {
+        "p50": ordered[len(ordered) // 2],
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        "max": ordered[-1],
+    }
+
+
+def _controllers(codec: Codec) -> List[SerialOutputController]:
+    controllers: List[SerialOutputController] = [
+        ScreenController(MemorySerial(), codec),
+        BellController(MemorySerial(), codec),
+        StripController(MemorySerial(), codec),
+        BalloonFanController(MemorySerial(), codec),
+    ]
+    for controller in controllers:
+        # Pacing protects the real device and runs on the writer thread in
+        # production, it isn't part of the pipeline being measured
+        controller.WRITE_PACING = 0.0
+    return controllers
+
+
+class _Run(NamedTuple):
+    controllers: List[SerialOutputController]
+    key_latencies: List[float]
+    tick_latencies: List[float]
+    allocations: List[int]
+
+
+def _timeline(
+    profile: Profile, start: float, trigger: Callable[[Key], None]
+) -> Iterator[Tuple[float, Key, Callable[[Key], None]]]:
+    now = start
+    for delay, key in profile.keys():
+        now += delay
+        yield now, key, trigger
+
+
+def _play(
+    profile: Profile,
+    codec: Codec,
+    trace_allocations: bool,
+    sessions: int = 1,
+    coalesce_window: float = 0.0,
+) -> _Run:
+    """
+    Ticks happen at the deadlines the manager asks for, the same as the real
+    scheduler, on a virtual clock so the profile runs as fast as the code allows
+    """
+    clock = VirtualClock()
+    run = _Run([], [], [], [])
+    manager: Union[GameManager, SessionManager]
+    if sessions == 1:
+        run.controllers.extend(_controllers(codec))
+        manager = GameManager(list(run.controllers), clock, coalesce_window)
+        triggers = [manager.trigger_key_down]
+    else:
+        manager = SessionManager(clock)
+        triggers = []
+        for source in range(sessions):
+            controllers = _controllers(codec)
+            run.controllers.extend(controllers)
+            session = manager.add_session(source, controllers)
+            session.coalesce_window = coalesce_window
+            triggers.append(partial(manager.trigger_key_down, source))
+
+    def measure(event: Callable[[], None], latencies: List[float]) -> None:
+        if trace_allocations:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            event()
+            _, peak = tracemalloc.get_traced_memory()
+            run.allocations.append(peak - before)
+        else:
+            start = perf_counter()
+            event()
+            latencies.append(perf_counter() - start)
+
+    last_tick = clock.now
+
+    def tick_until(until: float) -> None:
+        nonlocal last_tick
+        while True:
+            deadline = manager.next_deadline()
+            if deadline is None:
+                break
+            deadline = max(deadline, last_tick + TickScheduler.MIN_TICK_INTERVAL)
+            if deadline > until:
+                break
+            clock.now = last_tick = max(clock.now, deadline)
+            measure(manager.trigger_tick, run.tick_latencies)
+
+    measure(manager.trigger_tick, run.tick_latencies)
+    timelines = [
+        _timeline(profile, clock.now + i * SESSION_STAGGER, trigger)
+        for i, trigger in enumerate(triggers)
+    ]
+    for at, key, trigger in heapq.merge(*timelines, key=lambda event: event[0]):
+        tick_until(at)
+        clock.now = at
+        measure(lambda: trigger(key), run.key_latencies)
+    # Let the combo run out
+    tick_until(clock.now + 60)
+    return run
+
+
+def run_profile(
+    profile: Profile,
+    codec: Codec = ASCII,
+    sessions: int = 1,
+    coalesce_window: float = 0.0,
+) -> Dict[str, object]:
+    """
+    Play a profile against fresh controllers, once for timings and once more
+    with tracemalloc on to count memory allocated, as tracing skews the timings.
+    Bytes and frames written are totals over every session.
+    """
+    timed = _play(profile, codec, False, sessions, coalesce_window)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        traced = _play(profile, codec, True, sessions, coalesce_window)
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+
+    return {
+        "keys": len(timed.key_latencies),
+        "ticks": len(timed.tick_latencies),
+        "key_latency_us": {
+            name: value * 1e6
+            for name, value in _percentiles(timed.key_latencies).items()
+        },
+        "tick_latency_us": {
+            name: value * 1e6
+            for name, value in _percentiles(timed.tick_latencies).items()
+        },
+        # Key and tick time together over the keys, the cost of a key all in,
+        # so a thousand keys a second at 1000us would take a whole core
+        "us_per_key": (sum(timed.key_latencies) + sum(timed.tick_latencies))
+        * 1e6
+        / max(len(timed.key_latencies), 1),
+        "alloc_bytes_per_event": sum(traced.allocations) / len(traced.allocations),
+        "bytes_written": _per_device(timed.controllers, "bytes"),
+        "frames_written": _per_device(timed.controllers, "frames"),
+    }
+
+
+def _per_device(
+    controllers: List[SerialOutputController], counter: str
+) -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    for controller in controllers:
+        name = type(controller).__name__
+        count = getattr(controller.serial_connection, counter)
+        totals[name] = totals.get(name, 0) + count
+    return totals
+
+
+def run(
+    profiles: List[Profile],
+    codec: Codec = ASCII,
+    sessions: Sequence[int] = (1,),
+    coalesce_window: float = 0.0,
+) -> Dict[str, Dict[str, object]]:
+    return {
+        profile.name
+        if count == 1
+        else f"{profile.name}x{count}": run_profile(
+            profile, codec, count, coalesce_window
+        )
+        for profile in profiles
+        for count in sessions
+    }
+
+
+def _flatten(results: Dict[str, object], prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def compare(
+    results: Dict[str, Dict[str, object]],
+    baseline: Dict[str, Dict[str, object]],
+    tolerance: float = 0.2,
+) -> List[str]:
+    """
+    Metrics that got more than tolerance worse than the baseline. Every metric
+    reported is a cost, so bigger is worse. Max latencies are left out, a single
+    scheduling hiccup decides them.
+    """
+    current = _flatten(results)  # type: ignore
+    previous = _flatten(baseline)  # type: ignore
+    regressions = []
+    for name, old in sorted(previous.items()):
+        new = current.get(name)
+        if name.endswith(".max"):
+            continue
+        # Tiny absolute values (eg. sub microsecond latency) are all noise
+        if new is None or new <= old * (1 + tolerance) or new - old < 1:
+            continue
+        regressions.append(f"{name}: {old:.1f} -> {new:.1f}")
+    return regressions
+
+
+def _report(results: Dict[str, Dict[str, object]]) -> str:
+    lines = []
+    for profile_name, result in results.items():
+        lines.append(f"{profile_name}: {result['keys']} keys, {result['ticks']} ticks")
+        for event in ("key", "tick"):
+            latency = result[f"{event}_latency_us"]
+            assert isinstance(latency, dict)
+            lines.append(
+                f"  {event:<5} p50 {latency['p50']:8.1f}us"
+                f"  p99 {latency['p99']:8.1f}us  max {latency['max']:8.1f}us"
+            )
+        lines.append(f"  {result['us_per_key']:.1f}us a key all in")
+        lines.append(f"  allocated {result['alloc_bytes_per_event']:.0f} bytes/event")
+        bytes_written = result["bytes_written"]
+        assert isinstance(bytes_written, dict)
+        for device, count in bytes_written.items():
+            lines.append(f"  {device:<22}{count:8d} bytes")
+    return "\n".join(lines)
+
+
+def _startup_report(startup: Dict[str, Dict[str, float]]) -> str:
+    lines = ["startup:"]
+    for name, result in startup.items():
+        lines.append(
+            f"  import {name:<6}{result['import_ms']:8.1f}ms"
+            f"  {result['modules']:4.0f} modules, {result['heavy_modules']:.0f} heavy"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--profile",
+        action="append",
+        choices=[profile.name for profile in PROFILES],
+        help="profile to run, can be repeated (default: all)",
+    )
+    parser.add_argument("--codec", choices=["ascii", "binary"], default="ascii")
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        action="append",
+        help="players typing at once, can be repeated (default: 1)",
+    )
+    parser.add_argument(
+        "--coalesce",
+        type=float,
+        default=0.0,
+        help="batch keys within this many seconds (default: off)",
+    )
+    parser.add_argument(
+        "--skip-startup", action="store_true", help="don't measure import time"
+    )
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--compare", help="json file from an earlier --save")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    profiles = [
+        profile
+        for profile in PROFILES
+        if not args.profile or profile.name in args.profile
+    ]
+    results = run(
+        profiles,
+        BINARY if args.codec == "binary" else ASCII,
+        args.sessions or [1],
+        args.coalesce,
+    )
+    print(_report(results))
+    if not args.skip_startup:
+        startup = measure_startup()
+        print(_startup_report(startup))
+        results["startup"] = cast(Dict[str, object], startup)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:")
+            print("\n".join(f"  {regression}" for regression in regressions))
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
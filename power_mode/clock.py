@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+from typing import Callable
+
+# Anything that returns the current time in seconds. The game only ever
+# compares times from the same clock, so it needn't be the wall clock and
+# defaults to time.monotonic.
+Clock = Callable[[], float]
+
+
+class VirtualClock:
+    """
+    A clock that only moves when told to, for replays, benchmarks and tests
+    that play through hours of typing in milliseconds.
+    """
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> float:
+        self.now += seconds
+        return self.now
@@ -0,0 +1,679 @@
+"""
+Controllers for the microcontrollers on the desk, each sending protocol
+messages down a serial port.
+"""
+from __future__ import annotations
+
+import math
+import random
+from abc import ABC
+from time import monotonic, perf_counter, sleep
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from power_mode.animation import StripAnimation, blank, diff
+from power_mode.core import Changed, Controller, GameState
+from power_mode.flow_control import Credits
+from power_mode.matrix import dirty_rects, render_page
+from power_mode.protocol import (
+    ASCII,
+    BINARY,
+    BalloonFanMessage,
+    BellMessage,
+    BellPulse,
+    Codec,
+    Message,
+    ScreenMessage,
+    StripClear,
+    StripPixels,
+    percent_tenths,
+)
+from power_mode.serial_writer import SerialWriter
+
+if TYPE_CHECKING:
+    from serial import Serial
+
+    from power_mode.instrumentation import ControllerHistograms
+
+
+class SerialOutputController(Controller, ABC):
+    # Only the newest message matters, so a queued one can be replaced
+    COALESCE_WRITES = True
+    # Seconds to give the device after each write before sending another
+    WRITE_PACING = 0.0
+
+    def __init__(self, serial_connection: Serial, codec: Codec = ASCII):
+        self.serial_connection = serial_connection
+        self.codec = codec
+        self.last_message: Optional[Message] = None
+        self.writer: Optional[SerialWriter] = None
+        # The writer's frames_dropped when _frames_dropped() last looked
+        self._drops_seen = 0
+        # Set by enable_flow_control(), writes then wait for credit
+        self.credits: Optional[Credits] = None
+        self.connected = True
+        self.messages_written = 0
+        self.bytes_written = 0
+        # write() calls skipped as the message was already sent
+        self.dedup_hits = 0
+        # Set by Instrumentation the first time it sees this controller
+        self.histograms: Optional[ControllerHistograms] = None
+
+    @property
+    def write_pacing(self) -> float:
+        # Credits pace the writes instead
+        return 0.0 if self.credits else self.WRITE_PACING
+
+    def enable_flow_control(self, window: int) -> Credits:
+        """
+        Pace writes on credits granted by the device, which acknowledges
+        frames, see power_mode.flow_control. Before any writes.
+        """
+        self.credits = Credits(self.serial_connection, window)
+        return self.credits
+
+    def start_background_writer(self) -> SerialWriter:
+        """
+        Send messages from a background thread instead of the caller's
+        """
+        self.writer = SerialWriter(
+            self.serial_connection,
+            name=type(self).__name__,
+            coalesce=self.COALESCE_WRITES,
+            pacing=self.write_pacing,
+            on_error=self._lost_connection,
+            credits=self.credits,
+        )
+        self._drops_seen = 0
+        return self.writer
+
+    def _frames_dropped(self) -> bool:
+        """
+        Whether the background writer has dropped a frame since this was last
+        asked, so the device may not be showing everything that was sent
+        """
+        writer = self.writer
+        if writer is None or writer.frames_dropped == self._drops_seen:
+            return False
+        self._drops_seen = writer.frames_dropped
+        return True
+
+    def close(self) -> None:
+        self.connected = False
+        if self.writer:
+            self.writer.stop()
+        try:
+            self.serial_connection.close()
+        except OSError:
+            pass
+
+    def write_stats(self) -> Dict[str, int]:
+        return {
+            "messages_written": self.messages_written,
+            "bytes_written": self.bytes_written,
+            "dedup_hits": self.dedup_hits,
+        }
+
+    def write(self, message: Message) -> bool:
+        if message != self.last_message and self.connected:
+            if not self.send(self.codec.encode(message)):
+                return False
+            self.last_message = message
+            return True
+        else:
+            if self.connected:
+                self.dedup_hits += 1
+            return False
+
+    def send(self, frame: bytes, frames: int = 1) -> bool:
+        """
+        Write an already encoded frame, or frames frames one after the other,
+        without write()'s check against the last message
+        """
+        if not self.connected:
+            return False
+        if self.writer:
+            self.writer.submit(frame, frames)
+        else:
+            histograms = self.histograms
+            started = perf_counter() if histograms else 0.0
+            try:
+                if self.credits:
+                    self.credits.acquire(len(frame), frames)
+                self.serial_connection.write(frame)
+            except OSError as e:
+                self._lost_connection(e)
+                return False
+            if histograms:
+                histograms.serial_write.lap(started)
+            if self.write_pacing:
+                sleep(self.write_pacing)
+        self.messages_written += 1
+        self.bytes_written += len(frame)
+        return True
+
+    def needs_tick(self, changes: int, now: float) -> bool:
+        return (
+            changes & self.TICK_DEPENDS_ON != 0
+            # Nothing has been sent yet, eg. just (re)connected
+            or self.last_message is None
+            or self.timer_due(now)
+        )
+
+    def timer_due(self, now: float) -> bool:
+        """
+        Whether a timer of the controller's own (not the game state's) has
+        gone off since its last tick
+        """
+        return False
+
+    def _lost_connection(self, error: Exception) -> None:
+        # Until the device registry reconnects it, writes are skipped
+        if self.connected:
+            print(f"{type(self).__name__} lost its connection: {error}")
+            self.connected = False
+
+
+class ScreenController(SerialOutputController):
+    MODE_CHANGE_TIME = 2
+    REDRAW_INTERVAL = 0.05
+    # Wake just after the percent left rounds to its next tenth, not on the edge
+    PERCENT_STEP_SLACK = 0.001
+    TICK_DEPENDS_ON = (
+        Changed.COMBO
+        | Changed.MAX
+        | Changed.WPM
+        | Changed.LAST_TIMEOUT
+        | Changed.TIME_LEFT
+    )
+
+    def __init__(self, serial_connection: Serial, codec: Codec = ASCII):
+        super().__init__(serial_connection, codec)
+        # Starts from the first tick, as only the GameManager knows the time
+        self.last_mode_change: Optional[float] = None
+        self.last_write = 0.0
+        self.display_combo = True
+
+    def timer_due(self, now: float) -> bool:
+        return (
+            self.last_mode_change is None
+            or now - self.last_mode_change >= self.MODE_CHANGE_TIME
+        )
+
+    def tick(self, state: GameState, now: Optional[float] = None) -> None:
+        cur_time = monotonic() if now is None else now
+        self._check_for_mode_change(cur_time)
+        self._write_state(state, cur_time)
+
+    def next_deadline(self, state: GameState, now: float) -> Optional[float]:
+        if self._message(state, now) != self.last_message:
+            return max(now, self._redraw_at())
+        deadlines = []
+        if (
+            state.current_combo
+            and state.median_wpm
+            and self.last_mode_change is not None
+        ):
+            deadlines.append(self.last_mode_change + self.MODE_CHANGE_TIME)
+        percent_step = self._next_percent_step(state, now)
+        if percent_step is not None:
+            deadlines.append(percent_step)
+        return min(deadlines, default=None)
+
+    def _next_percent_step(self, state: GameState, now: float) -> Optional[float]:
+        """
+        The percent left is shown to one decimal place, so the display changes
+        each time the time left passes halfway between two tenths of the timeout
+        """
+        timeout_at = state.time_of_last_key + state.combo_timeout
+        step = state.combo_timeout / 10
+        steps_left = math.ceil((timeout_at - now) / step - 0.5) - 1
+        if steps_left < 0:
+            return None
+        return timeout_at - (steps_left + 0.5) * step + self.PERCENT_STEP_SLACK
+
+    def _redraw_at(self) -> float:
+        return self.last_write + self.REDRAW_INTERVAL
+
+    def _check_for_mode_change(self, cur_time: float) -> None:
+        if self.last_mode_change is None:
+            self.last_mode_change = cur_time
+        elif cur_time - self.last_mode_change >= self.MODE_CHANGE_TIME:
+            self.display_combo = not self.display_combo
+            self.last_mode_change = cur_time
+
+    def _write_state(self, state: GameState, cur_time: float) -> None:
+        if self.write(self._message(state, cur_time)):
+            self.last_write = cur_time
+
+    def _message(self, state: GameState, now: float) -> ScreenMessage:
+        tenths_left = percent_tenths(state.percent_time_left_at(now))
+        if state.current_combo:
+            if self.display_combo or not state.median_wpm:
+                return ScreenMessage("c", tenths_left, state.current_combo)
+            return ScreenMessage("w", tenths_left, state.median_wpm)
+        return ScreenMessage("e", tenths_left, state.max_combo, state.max_median_wpm)
+
+
+class RenderedScreenController(ScreenController):
+    """
+    Lays the pages out on the host instead, see power_mode.matrix, and sends
+    only the rows that changed as MatrixRect frames for the firmware to blit.
+    MatrixRect is binary only so the codec is always BINARY.
+
+    Each page goes out as one write, in order, as every frame is a diff
+    against the one before. Redraws come no faster than the link carries the
+    last one.
+    """
+
+    COALESCE_WRITES = False
+    # For a port that doesn't say its baud rate, 115200 at 10 bits a byte
+    LINK_BYTES_PER_SECOND = 11520
+
+    def __init__(self, serial_connection: Serial, codec: Codec = BINARY):
+        super().__init__(serial_connection, BINARY)
+        # The frame on the screen, None until the first covers all of it
+        self.shown: Optional[bytearray] = None
+        # Seconds the last frame took on the wire
+        self.last_frame_time = 0.0
+        # A page was held back as the last one was still on the wire
+        self._page_pending = False
+
+    def timer_due(self, now: float) -> bool:
+        return super().timer_due(now) or (
+            self._page_pending and now >= self._redraw_at()
+        )
+
+    def _redraw_at(self) -> float:
+        return self.last_write + max(self.REDRAW_INTERVAL, self.last_frame_time)
+
+    def _write_state(self, state: GameState, cur_time: float) -> None:
+        message = self._message(state, cur_time)
+        if message == self.last_message or not self.connected:
+            if self.connected:
+                self.dedup_hits += 1
+            return
+        # Ticks for other controllers come sooner, next_deadline brings one
+        # back for this page once the link has carried the last
+        if self.last_message is not None and cur_time < self._redraw_at():
+            self._page_pending = True
+            return
+        self._page_pending = False
+        frame = render_page(
+            message.mode, message.display_value, message.percent_tenths / 10
+        )
+        rects = dirty_rects(self.shown, frame)
+        data = b"".join(self.codec.encode(rect) for rect in rects)
+        if data and not self.send(data, len(rects)):
+            # Maybe partly written, the next page covers the whole screen
+            self.shown = None
+            return
+        # Rects only apply on top of the page before, so after any are lost
+        # the next page covers the whole screen
+        self.shown = None if self._frames_dropped() else frame
+        self.last_message = message
+        self.last_write = cur_time
+        self.last_frame_time = len(data) / self._link_bytes_per_second()
+
+    def _link_bytes_per_second(self) -> float:
+        baudrate = getattr(self.serial_connection, "baudrate", None)
+        if isinstance(baudrate, int):
+            return baudrate / 10
+        return self.LINK_BYTES_PER_SECOND
+
+
+class BellController(SerialOutputController):
+    BELL_TIME = 0.1
+    # Every on and off has to reach the relays
+    COALESCE_WRITES = False
+    # Only rings on key presses, ticks just turn bells off
+    TICK_DEPENDS_ON = 0
+
+    def __init__(self, serial_connection: Serial, codec: Codec = ASCII):
+        super().__init__(serial_connection, codec)
+        self.bell_click_times = [1.0, 1.0, 1.0, 1.0]
+        self.current_index = 0
+        # When the next ringing bell turns off, None when they're all off
+        self.next_off: Optional[float] = None
+
+    def timer_due(self, now: float) -> bool:
+        return self.next_off is not None and now >= self.next_off
+
+    def key_down(self, key, state: GameState, now: Optional[float] = None) -> None:
+        if now is None:
+            now = monotonic()
+        self.bell_click_times[self.current_index] = now
+        self._increment_index()
+        self._send(now)
+
+    def keys_down(
+        self, count: int, state: GameState, now: Optional[float] = None
+    ) -> None:
+        if now is None:
+            now = monotonic()
+        bells = len(self.bell_click_times)
+        # The bells the last count keys would have rung, one message for all
+        rung = min(count, bells)
+        self.current_index = (self.current_index + count - rung) % bells
+        for _ in range(rung):
+            self.bell_click_times[self.current_index] = now
+            self._increment_index()
+        self._send(now)
+
+    def tick(self, _: GameState, now: Optional[float] = None):
+        self._send(monotonic() if now is None else now)
+
+    def next_deadline(self, state: GameState, now: float) -> Optional[float]:
+        if self._message(now) != self.last_message:
+            return now
+        return self._next_off(now)
+
+    def _increment_index(self):
+        self.current_index += 1
+        if self.current_index == len(self.bell_click_times):
+            self.current_index = 0
+
+    def _send(self, now: float):
+        self.write(self._message(now))
+        # A bell rung since can only turn off later than the one already due
+        if self.next_off is None or now >= self.next_off:
+            self.next_off = self._next_off(now)
+
+    def _next_off(self, now: float) -> Optional[float]:
+        next_off = None
+        for bell_clicked_time in self.bell_click_times:
+            off = bell_clicked_time + self.BELL_TIME
+            if now < off and (next_off is None or off < next_off):
+                next_off = off
+        return next_off
+
+    def _message(self, curr_time: float) -> BellMessage:
+        """
+        Any bell that was triggered over .1 seconds ago is flipped to 0
+        """
+        return BellMessage(
+            tuple(
+                [
+                    curr_time < bell_clicked_time + self.BELL_TIME
+                    for bell_clicked_time in self.bell_click_times
+                ]
+            )
+        )
+
+
+class PulsedBellController(BellController):
+    """
+    Rings each bell with a BellPulse instead, the firmware turning the relay
+    off after BELL_TIME. A ring is a single frame, every pulse is exactly
+    BELL_TIME long whenever ticks happen, and there is nothing to do on
+    ticks. Needs the bells firmware with pulses. BellPulse is binary only so
+    the codec is always BINARY.
+
+    Keys ring the next bell round that hasn't rung for MIN_INTERVAL, a key
+    with none free doesn't ring.
+    """
+
+    # Seconds between rings of one bell, the pulse and the clapper dropping back
+    MIN_INTERVAL = 0.15
+
+    def __init__(self, serial_connection: Serial, codec: Codec = BINARY):
+        super().__init__(serial_connection, BINARY)
+        self.bell_click_times = [-math.inf] * len(self.bell_click_times)
+        # Keys that found every bell still ringing
+        self.rings_skipped = 0
+
+    def timer_due(self, now: float) -> bool:
+        return False
+
+    def tick(self, _: GameState, now: Optional[float] = None):
+        # The only write a tick makes, all relays off after (re)connecting
+        if self.last_message is None:
+            self.write(BellMessage((False,) * len(self.bell_click_times)))
+
+    def next_deadline(self, state: GameState, now: float) -> Optional[float]:
+        return now if self.last_message is None else None
+
+    def key_down(self, key, state: GameState, now: Optional[float] = None) -> None:
+        self.keys_down(1, state, now)
+
+    def keys_down(
+        self, count: int, state: GameState, now: Optional[float] = None
+    ) -> None:
+        if now is None:
+            now = monotonic()
+        click_times = self.bell_click_times
+        relays = [False] * len(click_times)
+        # Each bell is looked at once, so a flood rings each free bell once
+        for _ in range(len(click_times)):
+            if not count:
+                break
+            index = self.current_index
+            self._increment_index()
+            if now - click_times[index] >= self.MIN_INTERVAL:
+                click_times[index] = now
+                relays[index] = True
+                count -= 1
+        self.rings_skipped += count
+        if not any(relays):
+            return
+        message = BellPulse(tuple(relays), round(self.BELL_TIME * 1000))
+        # Not write(), the same bells ringing again is a new pulse
+        if self.send(self.codec.encode(message)):
+            self.last_message = message
+
+
+class StripController(SerialOutputController):
+    NUM_COLORS = 8
+    NUM_PIXELS = 144
+    COALESCE_WRITES = False
+    WRITE_PACING = 0.01
+    # Key presses are collected and sent at most this often
+    FLUSH_INTERVAL = 0.05
+    TICK_DEPENDS_ON = Changed.COMBO
+
+    def __init__(self, serial_connection: Serial, codec: Codec = ASCII):
+        super().__init__(serial_connection, codec)
+        self.colors: List[int] = []
+        self.color = 0
+        self.index = 0
+        # [start, end, color] runs of pixels lit since the last flush
+        self.pending_runs: List[List[int]] = []
+        # So the first keys go straight out
+        self.last_flush = -math.inf
+        self._reset_colors()
+
+    def tick(self, state: GameState, now: Optional[float] = None) -> None:
+        now = monotonic() if now is None else now
+        # Ticks for other controllers come sooner than FLUSH_INTERVAL, keys
+        # keep collecting until it's up
+        if not state.current_combo or self.timer_due(now):
+            self._flush(now)
+        if not state.current_combo:
+            self.color = 0
+            self.index = 0
+            self.write(StripClear(self.index))
+
+    def key_down(self, key, state: GameState, now: Optional[float] = None) -> None:
+        last_run = self.pending_runs[-1] if self.pending_runs else None
+        if last_run and last_run[2] == self.color and last_run[1] == self.index - 1:
+            last_run[1] = self.index
+        else:
+            self.pending_runs.append([self.index, self.index, self.color])
+        self.index += 1
+        if self.index >= self.NUM_PIXELS:
+            self._change_color()
+
+    def keys_down(
+        self, count: int, state: GameState, now: Optional[float] = None
+    ) -> None:
+        # A run per trip along the strip rather than a pixel per key
+        while count > 0:
+            lit = min(count, self.NUM_PIXELS - self.index)
+            start, end = self.index, self.index + lit - 1
+            last_run = self.pending_runs[-1] if self.pending_runs else None
+            if last_run and last_run[2] == self.color and last_run[1] == start - 1:
+                last_run[1] = end
+            else:
+                self.pending_runs.append([start, end, self.color])
+            self.index += lit
+            count -= lit
+            if self.index >= self.NUM_PIXELS:
+                self._change_color()
+
+    def timer_due(self, now: float) -> bool:
+        return bool(self.pending_runs) and now >= self.last_flush + self.FLUSH_INTERVAL
+
+    def next_deadline(self, state: GameState, now: float) -> Optional[float]:
+        if not self.pending_runs:
+            return None
+        return max(now, self.last_flush + self.FLUSH_INTERVAL)
+
+    def _flush(self, now: float):
+        """
+        Each key lights the next pixel, so everything typed since the last
+        flush is usually one run and goes out as a single message. The strip
+        is refreshed once per message.
+        """
+        if not self.pending_runs:
+            return
+        for start, end, color in self.pending_runs:
+            self.write(StripPixels(start, end, color))
+        self.pending_runs.clear()
+        self.last_flush = now
+
+    def _change_color(self):
+        if not self.colors:
+            self._reset_colors()
+        self.index = 0
+        self.color = self.colors.pop()
+
+    def _reset_colors(self):
+        self.colors = list(range(0, self.NUM_COLORS))
+        random.shuffle(self.colors)
+        if self.colors[-1] == self.color:
+            first_color = self.colors.pop()
+            self.colors.insert(0, first_color)
+
+
+class AnimatedStripController(StripController):
+    """
+    Draws the strip on the host instead, see power_mode.animation: keys light
+    pixels as for StripController, with a trail, milestone flashes and a
+    timeout bar over them. Needs the strip firmware with the off colour.
+
+    Keys only update the animation. Frames are drawn on ticks, at most
+    FRAME_RATE a second and slower if the last frame's runs take longer than
+    that to get down the link, and only while something is changing.
+    """
+
+    FRAME_RATE = 30
+    # 9600 baud at 10 bits a byte
+    LINK_BYTES_PER_SECOND = 960
+    TICK_DEPENDS_ON = Changed.COMBO
+
+    def __init__(self, serial_connection: Serial, codec: Codec = ASCII):
+        super().__init__(serial_connection, codec)
+        self.animation = StripAnimation(self.NUM_PIXELS)
+        # What the strip is showing, None until the first frame clears it
+        self.shown: Optional[bytearray] = None
+        self.next_frame = 0.0
+        self.frames = 0
+        # A key since the last frame, or a combo ending
+        self._dirty = True
+        # When the animation next changes by itself
+        self._change_at: Optional[float] = None
+
+    def tick(self, state: GameState, now: Optional[float] = None) -> None:
+        now = monotonic() if now is None else now
+        if not state.current_combo and not self.animation.is_blank:
+            self.animation.clear()
+            self.color = 0
+            self.index = 0
+            self._dirty = True
+        if self.timer_due(now):
+            self._send_frame(state, now)
+
+    def key_down(self, key, state: GameState, now: Optional[float] = None) -> None:
+        self.keys_down(1, state, now)
+
+    def keys_down(
+        self, count: int, state: GameState, now: Optional[float] = None
+    ) -> None:
+        now = monotonic() if now is None else now
+        animation = self.animation
+        while count > 0:
+            lit = min(count, self.NUM_PIXELS - self.index)
+            animation.light(self.index, self.index + lit - 1, self.color, now)
+            self.index += lit
+            count -= lit
+            if self.index >= self.NUM_PIXELS:
+                self._change_color()
+        animation.combo(state.current_combo, now)
+        self._dirty = True
+
+    def timer_due(self, now: float) -> bool:
+        due = self._frame_due()
+        return due is not None and now >= due
+
+    def next_deadline(self, state: GameState, now: float) -> Optional[float]:
+        due = self._frame_due()
+        return None if due is None else max(now, due)
+
+    def _frame_due(self) -> Optional[float]:
+        if self._dirty:
+            return self.next_frame
+        if self._change_at is None:
+            return None
+        return max(self._change_at, self.next_frame)
+
+    def _send_frame(self, state: GameState, now: float) -> None:
+        frame = self.animation.render(state, now)
+        runs: List[Message] = []
+        if self.shown is not None:
+            runs.extend(diff(self.shown, frame))
+        redraw: List[Message] = [StripClear()]
+        redraw.extend(diff(blank(self.NUM_PIXELS), frame))
+        # Lots turning off is cheaper as a clear and what's left lit
+        if self.shown is None or self._cost(redraw) < self._cost(runs):
+            runs = redraw
+        sent = True
+        for message in runs:
+            # Not write(), a frame never repeats what's showing, even when
+            # its first message matches the last one sent
+            if not self.send(self.codec.encode(message)):
+                sent = False
+                break
+            self.last_message = message
+        # Runs only apply on top of what came before, after any are lost the
+        # strip isn't known and the next frame redraws all of it
+        dropped = self._frames_dropped()
+        self.shown = frame if sent and not dropped else None
+        self.frames += 1
+        self.next_frame = now + max(1 / self.FRAME_RATE, self._cost(runs))
+        self._change_at = self.animation.next_change(state, now)
+        self._dirty = False
+
+    def _cost(self, messages: List[Message]) -> float:
+        """
+        Seconds the messages take to go out, on the wire and paced for show()
+        """
+        sent = sum(len(self.codec.encode(message)) for message in messages)
+        return sent / self.LINK_BYTES_PER_SECOND + len(messages) * self.write_pacing
+
+
+class BalloonFanController(SerialOutputController):
+    FAN_THRESHOLD = 100
+    TICK_DEPENDS_ON = Changed.COMBO
+
+    def __init__(self, serial_connection: Serial, codec: Codec = ASCII):
+        super().__init__(serial_connection, codec)
+
+    def tick(self, state: GameState, now: Optional[float] = None) -> None:
+        self.write(self._message(state))
+
+    def next_deadline(self, state: GameState, now: float) -> Optional[float]:
+        return now if self._message(state) != self.last_message else None
+
+    def _message(self, state: GameState) -> BalloonFanMessage:
+        return BalloonFanMessage(
+            bool(state.current_combo), state.current_combo >= self.FAN_THRESHOLD
+        )
@@ -0,0 +1,694 @@
+"""
+The game itself: the state, the rules and the controller interface.
+
+Nothing here needs hardware or an input backend, importing it doesn't pull in
+pynput or pyserial, so tests, tools and the benchmark can use the game
+without a display server or serial ports. Devices are driven by
+power_mode.controllers and the keyboard is read by power_mode.main.
+"""
+from __future__ import annotations
+
+import math
+import threading
+from abc import ABC
+from dataclasses import FrozenInstanceError, dataclass
+from time import monotonic, perf_counter
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    cast,
+)
+
+from power_mode.clock import Clock
+from power_mode.keys import Key, as_key, is_backspace
+from power_mode.protocol import percent_tenths
+from power_mode.rolling_median import RollingMedian
+
+if TYPE_CHECKING:
+    from power_mode.controllers import SerialOutputController
+    from power_mode.history import SessionHistory
+    from power_mode.instrumentation import Instrumentation
+    from power_mode.recording import SessionRecorder
+    from power_mode.streaming import StateSubscription
+    from power_mode.timeseries import WpmTimeSeries
+
+T = TypeVar("T")
+
+
+class Changed:
+    """
+    Bits for the parts of the game state an event changed, so GameManager can
+    skip ticking controllers that don't read them. See Controller.needs_tick.
+    """
+
+    COMBO = 1  # current_combo and num_backspaces
+    MAX = 2  # max_combo and max_median_wpm
+    WPM = 4  # recorded_wpms, and so median_wpm
+    LAST_TIMEOUT = 8  # combo_at_last_timeout and median_wpm_at_last_timeout
+    TIME_LEFT = 16  # percent_time_left moved to another tenth
+    ALL = COMBO | MAX | WPM | LAST_TIMEOUT | TIME_LEFT
+
+
+@dataclass(eq=False)
+class GameState:
+    """
+    The live game state. GameManager mutates it in place through the
+    *_in_place methods and hands controllers read-only snapshots of it.
+
+    The original functional methods (increment_combo, combo_stopped,
+    record_wpm, copy) are kept and return new states.
+
+    Methods that depend on the time take it as now, GameManager reads its
+    clock once per event and passes the same time to everything. Left out,
+    they read time.monotonic.
+    """
+
+    CHARS_IN_WORD = 5
+    MIN_WORDS_FOR_WPM = 5
+    MAX_RECORDED_WPMS = 100
+
+    __slots__ = (
+        "current_combo",
+        "max_combo",
+        "max_median_wpm",
+        "combo_at_last_timeout",
+        "median_wpm_at_last_timeout",
+        "combo_timeout",
+        "time_of_last_key",
+        "combo_start",
+        "recorded_wpms",
+        "num_backspaces",
+        "_snapshot",
+        "_wpms_shared",
+        "_changes",
+        "max_wpm",
+    )
+
+    current_combo: int
+    max_combo: int
+    max_median_wpm: int
+    combo_at_last_timeout: int
+    median_wpm_at_last_timeout: int
+    combo_timeout: int
+    time_of_last_key: float
+    combo_start: float
+    recorded_wpms: Sequence[int]
+    num_backspaces: int
+
+    def __post_init__(self) -> None:
+        if not isinstance(self.recorded_wpms, RollingMedian):
+            self.recorded_wpms = RollingMedian(
+                self.recorded_wpms, maxlen=GameState.MAX_RECORDED_WPMS
+            )
+        self._snapshot: Optional[GameStateView] = None
+        # Set once recorded_wpms is referenced by another state or snapshot,
+        # the window is then copied before it is next written to
+        self._wpms_shared = False
+        # Changed bits since take_changes() was last called
+        self._changes = Changed.ALL
+        # Highest WPM recorded this combo, recorded_wpms only keeps the last
+        # MAX_RECORDED_WPMS of them
+        self.max_wpm = max(self.recorded_wpms, default=0)
+
+    @staticmethod
+    def start(now: Optional[float] = None) -> GameState:
+        if now is None:
+            now = monotonic()
+        return GameState(
+            current_combo=0,
+            max_combo=0,
+            max_median_wpm=0,
+            combo_at_last_timeout=0,
+            median_wpm_at_last_timeout=0,
+            combo_timeout=10,
+            time_of_last_key=now - 10,  # want to start 'timed out'
+            combo_start=now,
+            recorded_wpms=[],
+            num_backspaces=0,
+        )
+
+    @property
+    def percent_time_left(self) -> float:
+        return self.percent_time_left_at(monotonic())
+
+    def percent_time_left_at(self, now: float) -> float:
+        seconds_past = now - self.time_of_last_key
+        time_left = (self.combo_timeout - seconds_past) / self.combo_timeout
+        return time_left if time_left >= 0 else 0
+
+    @property
+    def current_wpm(self) -> int:
+        return self.current_wpm_at(monotonic())
+
+    def current_wpm_at(self, now: float) -> int:
+        words_typed = (
+            self.current_combo - self.num_backspaces
+        ) / GameState.CHARS_IN_WORD
+        if words_typed < GameState.MIN_WORDS_FOR_WPM:
+            return 0
+        minutes_passed = (now - self.combo_start) / 60
+        return math.floor(words_typed / minutes_passed)
+
+    @property
+    def median_wpm(self) -> int:
+        return cast(RollingMedian, self.recorded_wpms).median
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        When the running combo times out, None while there is no combo
+        """
+        if not self.current_combo:
+            return None
+        return self.time_of_last_key + self.combo_timeout
+
+    def take_changes(self) -> int:
+        """
+        The Changed bits set by the *_in_place methods since this was last
+        called. A new state counts as entirely changed.
+        """
+        changes = self._changes
+        self._changes = 0
+        return changes
+
+    def snapshot(self) -> GameStateView:
+        """
+        Read-only view of the current state. The same view is returned until
+        the state changes, so asking for one when nothing happened is free.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self._snapshot = GameStateView(self)
+            # At most one copy a recorded word, the next write makes it
+            self._wpms_shared = True
+        return snapshot
+
+    @staticmethod
+    def _new_if_exists(new: Optional[T], original: T) -> T:
+        return original if new is None else new
+
+    def copy(
+        self,
+        current_combo: Optional[int] = None,
+        max_combo: Optional[int] = None,
+        max_median_wpm: Optional[int] = None,
+        combo_at_last_timeout: Optional[int] = None,
+        median_wpm_at_last_timeout: Optional[int] = None,
+        combo_timeout: Optional[int] = None,
+        time_of_last_key: Optional[float] = None,
+        combo_start: Optional[float] = None,
+        recorded_wpms: Optional[Sequence[int]] = None,
+        num_backspaces: Optional[int] = None,
+    ) -> GameState:
+        state = GameState(
+            current_combo=self._new_if_exists(current_combo, self.current_combo),
+            max_combo=self._new_if_exists(max_combo, self.max_combo),
+            max_median_wpm=self._new_if_exists(max_median_wpm, self.max_median_wpm),
+            combo_at_last_timeout=self._new_if_exists(
+                combo_at_last_timeout, self.combo_at_last_timeout
+            ),
+            median_wpm_at_last_timeout=self._new_if_exists(
+                median_wpm_at_last_timeout, self.median_wpm_at_last_timeout
+            ),
+            combo_timeout=self._new_if_exists(combo_timeout, self.combo_timeout),
+            time_of_last_key=self._new_if_exists(
+                time_of_last_key, self.time_of_last_key
+            ),
+            combo_start=self._new_if_exists(combo_start, self.combo_start),
+            recorded_wpms=self._new_if_exists(recorded_wpms, self.recorded_wpms),
+            num_backspaces=self._new_if_exists(num_backspaces, self.num_backspaces),
+        )
+        if recorded_wpms is None:
+            # Both states now point at the same window
+            if not isinstance(self, GameStateView):
+                self._wpms_shared = True
+            state._wpms_shared = True
+            state.max_wpm = self.max_wpm
+        return state
+
+    def increment_combo(self, key: Key, now: Optional[float] = None) -> GameState:
+        state = self.copy()
+        state.increment_combo_in_place(key, now)
+        return state
+
+    def increment_by(
+        self, count: int, backspaces: int = 0, now: Optional[float] = None
+    ) -> GameState:
+        state = self.copy()
+        state.increment_by_in_place(count, backspaces, now)
+        return state
+
+    def combo_stopped(self, now: Optional[float] = None) -> GameState:
+        state = self.copy()
+        state.combo_stopped_in_place(now)
+        return state
+
+    def record_wpm(self, now: Optional[float] = None) -> GameState:
+        state = self.copy()
+        state.record_wpm_in_place(now)
+        return state
+
+    def increment_combo_in_place(self, key: Key, now: Optional[float] = None) -> None:
+        if now is None:
+            now = monotonic()
+        changes = Changed.COMBO
+        if self.current_combo == 0:
+            self._clear_recorded_wpms()
+            self.combo_start = now
+            changes |= Changed.WPM
+        self.current_combo += 1
+        if is_backspace(key):
+            self.num_backspaces += 1
+        self.time_of_last_key = now
+        if self.max_combo < self.current_combo:
+            self.max_combo = self.current_combo
+            changes |= Changed.MAX
+        self._changes |= changes
+        self._snapshot = None
+
+    def increment_by_in_place(
+        self, count: int, backspaces: int = 0, now: Optional[float] = None
+    ) -> None:
+        """
+        count keys at once, backspaces of them backspaces. The same as that
+        many increment_combo_in_place calls at now, WPMs aside: the caller
+        records those, see GameManager's batching.
+        """
+        if count <= 0:
+            return
+        if now is None:
+            now = monotonic()
+        changes = Changed.COMBO
+        if self.current_combo == 0:
+            self._clear_recorded_wpms()
+            self.combo_start = now
+            changes |= Changed.WPM
+        self.current_combo += count
+        self.num_backspaces += backspaces
+        self.time_of_last_key = now
+        if self.max_combo < self.current_combo:
+            self.max_combo = self.current_combo
+            changes |= Changed.MAX
+        self._changes |= changes
+        self._snapshot = None
+
+    def combo_stopped_in_place(self, now: Optional[float] = None) -> None:
+        median_wpm = self.median_wpm
+        if self.current_combo:
+            self.combo_at_last_timeout = self.current_combo
+        if median_wpm:
+            self.median_wpm_at_last_timeout = median_wpm
+        self.current_combo = 0
+        self.num_backspaces = 0
+        self.combo_start = monotonic() if now is None else now
+        self._clear_recorded_wpms()
+        self._changes |= Changed.COMBO | Changed.WPM | Changed.LAST_TIMEOUT
+        self._snapshot = None
+
+    def record_wpm_in_place(self, now: Optional[float] = None) -> None:
+        current_wpm = self.current_wpm_at(monotonic() if now is None else now)
+        median_wpm = self.median_wpm
+        if current_wpm:
+            self._writable_recorded_wpms().append(current_wpm)
+            if current_wpm > self.max_wpm:
+                self.max_wpm = current_wpm
+            self._changes |= Changed.WPM
+        if median_wpm > self.max_median_wpm:
+            self.max_median_wpm = median_wpm
+            self._changes |= Changed.MAX
+        self._snapshot = None
+
+    def _writable_recorded_wpms(self) -> RollingMedian:
+        if self._wpms_shared:
+            self.recorded_wpms = cast(RollingMedian, self.recorded_wpms).copy()
+            self._wpms_shared = False
+        return cast(RollingMedian, self.recorded_wpms)
+
+    def _clear_recorded_wpms(self) -> None:
+        self.max_wpm = 0
+        if self._wpms_shared:
+            self.recorded_wpms = RollingMedian(maxlen=GameState.MAX_RECORDED_WPMS)
+            self._wpms_shared = False
+        else:
+            cast(RollingMedian, self.recorded_wpms).clear()
+
+    def _values(self) -> tuple:
+        return (
+            self.current_combo,
+            self.max_combo,
+            self.max_median_wpm,
+            self.combo_at_last_timeout,
+            self.median_wpm_at_last_timeout,
+            self.combo_timeout,
+            self.time_of_last_key,
+            self.combo_start,
+            self.recorded_wpms,
+            self.num_backspaces,
+        )
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, GameState):
+            return NotImplemented
+        return self._values() == other._values()
+
+    __hash__ = None  # type: ignore
+
+
+class GameStateView(GameState):
+    """
+    Frozen snapshot of a GameState, see GameState.snapshot.
+
+    It shares recorded_wpms with the state it was taken from, the live state
+    copies the window before writing to it again, so a snapshot stays valid
+    however long it is held.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, state: GameState):
+        for name in GameState.__dataclass_fields__:
+            object.__setattr__(self, name, getattr(state, name))
+        object.__setattr__(self, "max_wpm", state.max_wpm)
+        object.__setattr__(self, "_snapshot", None)
+        object.__setattr__(self, "_wpms_shared", True)
+        object.__setattr__(self, "_changes", 0)
+
+    def __setattr__(self, name: str, value: object) -> None:
+        raise FrozenInstanceError(f"cannot assign to field {name!r}")
+
+    def snapshot(self) -> GameStateView:
+        return self
+
+
+class Controller(ABC):
+    """
+    now is the time of the event, from the GameManager's clock. Controllers
+    called without it read time.monotonic.
+    """
+
+    # The parts of the game state tick() reads, as Changed bits
+    TICK_DEPENDS_ON = Changed.ALL
+
+    def needs_tick(self, changes: int, now: float) -> bool:
+        """
+        Whether a tick could change this controller's output, given the
+        Changed bits since its last tick. Controllers with timers of their
+        own also check those.
+        """
+        return bool(changes & self.TICK_DEPENDS_ON)
+
+    def tick(self, state: GameState, now: Optional[float] = None) -> None:
+        raise NotImplementedError()
+
+    def key_down(self, key, state: GameState, now: Optional[float] = None) -> None:
+        return None
+
+    def keys_down(
+        self, count: int, state: GameState, now: Optional[float] = None
+    ) -> None:
+        """
+        count keys at once, from GameManager's batching. Controllers that do
+        per key work should do it for the batch in one go.
+        """
+        for _ in range(count):
+            self.key_down(Key.OTHER, state, now)
+
+    def next_deadline(self, state: GameState, now: float) -> Optional[float]:
+        """
+        The next time a tick would change what this controller outputs.
+        None means it has nothing to do until the state changes.
+        """
+        return None
+
+
+class GameManager:
+    """
+    Applies key presses and ticks to the game state and passes them on to the
+    controllers. The clock is read once per event, defaulting to
+    time.monotonic so a change to the system time can't end or stretch a combo.
+
+    With a coalesce_window, floods of keys (autorepeat, a macro typing a
+    snippet) are batched. A key after a quiet spell is applied straight away
+    and opens a window, keys within it are queued and applied together when
+    it ends, as one increment_by step per word with the WPM recorded at each
+    word like key by key. Controllers get one keys_down call a batch. Combo,
+    backspace and WPM totals come out the same as without batching.
+    """
+
+    def __init__(
+        self,
+        serial_controllers: List[SerialOutputController],
+        clock: Optional[Clock] = None,
+        coalesce_window: float = 0.0,
+    ):
+        self.clock: Clock = clock if clock else monotonic
+        self.game_state: GameState = GameState.start(self.clock())
+        self.serial_controllers: List[SerialOutputController] = serial_controllers
+        # Key presses and ticks arrive on different threads, and the state is
+        # now updated in place, so events are applied one at a time
+        self._lock = threading.Lock()
+        self._subscribers: Tuple[StateSubscription, ...] = ()
+        self._last_published: Optional[GameStateView] = None
+        # Changed bits from key presses since the last tick, and the time left
+        # as last shown, so ticks can skip controllers with nothing new
+        self._changes = 0
+        self._tenths_left = -1
+        # All opt in, see power_mode.recording, power_mode.instrumentation,
+        # power_mode.history and power_mode.timeseries
+        self.recorder: Optional[SessionRecorder] = None
+        self.instrumentation: Optional[Instrumentation] = None
+        self.history: Optional[SessionHistory] = None
+        # Set by track_wpm()
+        self.wpm_series: Optional[WpmTimeSeries] = None
+        self.coalesce_window = coalesce_window
+        # (time, is backspace) of each key queued in the current window
+        self._pending_keys: List[Tuple[float, bool]] = []
+        self._window_end = float("-inf")
+
+    def track_wpm(self, series: Optional[WpmTimeSeries] = None) -> WpmTimeSeries:
+        """
+        Keep every WPM recorded in series, by default a new one. Samples are
+        stamped with times from this manager's clock, so a series on any
+        other clock is refused.
+        """
+        if series is None:
+            from power_mode.timeseries import WpmTimeSeries
+
+            series = WpmTimeSeries(clock=self.clock)
+        elif series.clock is not self.clock:
+            raise ValueError("the WPM series must use the manager's clock")
+        self.wpm_series = series
+        return series
+
+    def trigger_tick(self) -> None:
+        instrumentation = self.instrumentation
+        started = lap = perf_counter() if instrumentation else 0.0
+        with self._lock:
+            now = self.clock()
+            if self.recorder:
+                self.recorder.tick(now)
+            if self._pending_keys:
+                # Before the timeout check, the keys came in before the tick
+                self._apply_pending_keys(now)
+            game_state = self.game_state
+            # Compared against the deadline rather than percent_time_left so
+            # a tick woken for the timeout always ends the combo
+            timeout = game_state.next_deadline()
+            if timeout is not None and now >= timeout:
+                if self.history is not None:
+                    self.history.combo_ended(game_state, now)
+                if instrumentation:
+                    lap = perf_counter()
+                game_state.combo_stopped_in_place(now)
+                if instrumentation:
+                    instrumentation.combo_stopped.lap(lap)
+
+            changes = self._changes | game_state.take_changes()
+            self._changes = 0
+            tenths_left = percent_tenths(game_state.percent_time_left_at(now))
+            if tenths_left != self._tenths_left:
+                self._tenths_left = tenths_left
+                changes |= Changed.TIME_LEFT
+
+            snapshot = game_state.snapshot()
+            if instrumentation:
+                lap = perf_counter()
+            for controller in self.serial_controllers:
+                if instrumentation:
+                    # Looked up first so the controller's writes are timed too
+                    histograms = instrumentation.controller(controller)
+                if not controller.needs_tick(changes, now):
+                    if instrumentation:
+                        histograms.skipped_ticks += 1
+                    continue
+                controller.tick(snapshot, now)
+                if instrumentation:
+                    lap = histograms.tick.lap(lap)
+            self._publish(snapshot)
+        if instrumentation:
+            instrumentation.tick.lap(started)
+
+    def trigger_key_down(self, key) -> None:
+        key = as_key(key)
+        if self.coalesce_window:
+            self._queue_key(key)
+            return
+        instrumentation = self.instrumentation
+        started = lap = perf_counter() if instrumentation else 0.0
+        with self._lock:
+            now = self.clock()
+            if self.recorder:
+                self.recorder.key_down(key, now)
+            game_state = self.game_state
+            if instrumentation:
+                lap = perf_counter()
+            game_state.increment_combo_in_place(key, now)
+            if instrumentation:
+                lap = instrumentation.increment_combo.lap(lap)
+            if game_state.current_combo % game_state.CHARS_IN_WORD == 0:
+                wpm = game_state.current_wpm_at(now)
+                if wpm:
+                    game_state.record_wpm_in_place(now)
+                    if self.wpm_series is not None:
+                        self.wpm_series.record_at(wpm, game_state.current_combo, now)
+                    if instrumentation:
+                        lap = instrumentation.record_wpm.lap(lap)
+            self._changes |= game_state.take_changes()
+            snapshot = game_state.snapshot()
+            if instrumentation:
+                lap = perf_counter()
+            for controller in self.serial_controllers:
+                if instrumentation:
+                    histograms = instrumentation.controller(controller)
+                controller.key_down(key, snapshot, now)
+                if instrumentation:
+                    lap = histograms.key_down.lap(lap)
+            self._publish(snapshot)
+        if instrumentation:
+            instrumentation.key_down.lap(started)
+
+    def _queue_key(self, key) -> None:
+        instrumentation = self.instrumentation
+        started = perf_counter() if instrumentation else 0.0
+        with self._lock:
+            now = self.clock()
+            if self.recorder:
+                self.recorder.key_down(key, now)
+            self._pending_keys.append((now, is_backspace(key)))
+            # Otherwise the tick at the end of the window applies it
+            if now >= self._window_end:
+                self._apply_pending_keys(now)
+        if instrumentation:
+            instrumentation.key_down.lap(started)
+
+    def _apply_pending_keys(self, now: float) -> None:
+        """
+        Applies the queued keys and opens the next window, with the lock held
+        """
+        keys = self._pending_keys
+        self._pending_keys = []
+        self._window_end = now + self.coalesce_window
+        game_state = self.game_state
+        chars_in_word = game_state.CHARS_IN_WORD
+        applied = 0
+        while applied < len(keys):
+            if game_state.current_combo == 0:
+                # A new combo starts at its first key
+                count = 1
+            else:
+                # Up to the end of the word, where a WPM is due
+                count = chars_in_word - game_state.current_combo % chars_in_word
+            batch = keys[applied : applied + count]
+            at = batch[-1][0]
+            backspaces = sum(backspace for _, backspace in batch)
+            game_state.increment_by_in_place(len(batch), backspaces, at)
+            applied += len(batch)
+            if game_state.current_combo % chars_in_word == 0:
+                wpm = game_state.current_wpm_at(at)
+                if wpm:
+                    game_state.record_wpm_in_place(at)
+                    if self.wpm_series is not None:
+                        self.wpm_series.record_at(wpm, game_state.current_combo, at)
+        self._changes |= game_state.take_changes()
+        snapshot = game_state.snapshot()
+        instrumentation = self.instrumentation
+        lap = perf_counter() if instrumentation else 0.0
+        for controller in self.serial_controllers:
+            if instrumentation:
+                histograms = instrumentation.controller(controller)
+            controller.keys_down(len(keys), snapshot, now)
+            if instrumentation:
+                lap = histograms.key_down.lap(lap)
+        self._publish(snapshot)
+
+    def add_controller(self, controller: SerialOutputController) -> None:
+        # The list is replaced rather than changed so an event that is
+        # already looping over it is unaffected
+        with self._lock:
+            self.serial_controllers = self.serial_controllers + [controller]
+
+    def remove_controller(self, controller: SerialOutputController) -> None:
+        with self._lock:
+            self.serial_controllers = [
+                existing
+                for existing in self.serial_controllers
+                if existing is not controller
+            ]
+
+    def next_deadline(self) -> Optional[float]:
+        """
+        The earliest time the game state or any controller needs a tick
+        """
+        with self._lock:
+            now = self.clock()
+            snapshot = self.game_state.snapshot()
+            deadlines = [
+                controller.next_deadline(snapshot, now)
+                for controller in self.serial_controllers
+            ]
+            deadlines.append(self.game_state.next_deadline())
+            if self._pending_keys:
+                deadlines.append(self._window_end)
+        return min(
+            (deadline for deadline in deadlines if deadline is not None), default=None
+        )
+
+    async def states(self, maxsize: int = 1) -> AsyncIterator[GameStateView]:
+        """
+        Stream of state snapshots, starting with the current one.
+
+        Each consumer gets its own queue of up to maxsize snapshots. When a
+        consumer falls behind older snapshots are dropped in favour of newer
+        ones, the key and tick paths never wait on it.
+        """
+        # asyncio is slow to import and only needed here
+        import asyncio
+
+        from power_mode.streaming import StateSubscription
+
+        subscription = StateSubscription(asyncio.get_running_loop(), maxsize)
+        with self._lock:
+            self._subscribers += (subscription,)
+            subscription.publish(self.game_state.snapshot())
+        try:
+            while True:
+                yield await subscription.get()
+        finally:
+            with self._lock:
+                self._subscribers = tuple(
+                    subscriber
+                    for subscriber in self._subscribers
+                    if subscriber is not subscription
+                )
+
+    def _publish(self, snapshot: GameStateView) -> None:
+        # Idle ticks hand out the same snapshot, no need to send it again
+        if snapshot is self._last_published:
+            return
+        self._last_published = snapshot
+        for subscriber in self._subscribers:
+            subscriber.publish(snapshot)
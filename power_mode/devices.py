@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Type,
+)
+
+from power_mode.flow_control import request_credits
+from power_mode.protocol import ASCII, READY, READY_QUERY, Codec
+
+if TYPE_CHECKING:
+    import serial
+
+    from power_mode.controllers import SerialOutputController
+    from power_mode.core import GameManager
+
+
+class DeviceSpec(NamedTuple):
+    serial_number: str
+    controller: Type[SerialOutputController]
+    codec: Codec = ASCII
+    baudrate: int = 9600
+    # Ask the device for send credits and acknowledgements, if it handshakes
+    flow_control: bool = False
+    # Whether its firmware answers READY_QUERY, otherwise it's written to as
+    # soon as it's open and never asked for credits
+    handshake: bool = True
+
+
+def _scan_ports() -> Iterable[Any]:
+    # pyserial is imported on first use, so the game can be imported without it
+    from serial.tools import list_ports
+
+    return list_ports.comports()
+
+
+def _open_port(device: str, baudrate: int = 9600) -> serial.Serial:
+    import serial
+
+    # Reads time out so waiting for the ready byte can give up
+    return serial.Serial(device, baudrate=baudrate, timeout=0.1)
+
+
+class _Device:
+    def __init__(self, spec: DeviceSpec):
+        self.spec = spec
+        self.controller: Optional[SerialOutputController] = None
+        self.backoff = 0.0
+        self.next_attempt = 0.0
+
+
+class DeviceRegistry:
+    """
+    Knows which controller drives which microcontroller, by USB serial number.
+
+    connect() opens everything it can find from a single port scan. watch()
+    then keeps them connected from a background thread: a controller whose
+    port fails is pulled out of the GameManager straight away and reopened,
+    with backoff, once its device shows up again.
+
+    Ports are opened in parallel and each controller is only handed out once
+    its firmware has answered READY_QUERY, so nothing is written while a
+    board is still booting. Firmware that never answers gets its controller
+    after ready_timeout anyway.
+    """
+
+    POLL_INTERVAL = 1.0
+    MIN_BACKOFF = 1.0
+    MAX_BACKOFF = 30.0
+    READY_TIMEOUT = 3.0
+    # Asked again in case the query went to the bootloader
+    READY_QUERY_INTERVAL = 0.5
+
+    def __init__(
+        self,
+        specs: Iterable[DeviceSpec],
+        scan: Callable[[], Iterable[Any]] = _scan_ports,
+        open_port: Callable[[str, int], Any] = _open_port,
+        background_writers: bool = True,
+        ready_timeout: float = READY_TIMEOUT,
+    ):
+        self.devices = [_Device(spec) for spec in specs]
+        self.manager: Optional[GameManager] = None
+        self._scan = scan
+        self._open_port = open_port
+        self._background_writers = background_writers
+        self._ready_timeout = ready_timeout
+        self._on_change: Optional[Callable[[], None]] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def controllers(self) -> List[SerialOutputController]:
+        return [device.controller for device in self.devices if device.controller]
+
+    def connect(self) -> List[SerialOutputController]:
+        self._open_all(self.devices, self._ports(), monotonic())
+        return self.controllers
+
+    def watch(
+        self, manager: GameManager, on_change: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Keep manager's controllers in step with what is plugged in.
+        on_change is called after a controller is added, so it can be ticked.
+        """
+        self.manager = manager
+        self._on_change = on_change
+        self._thread = threading.Thread(
+            target=self._run, name="power-mode-devices", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        for device in self.devices:
+            if device.controller:
+                device.controller.close()
+
+    def poll(self, now: float) -> None:
+        for device in self.devices:
+            if device.controller and not device.controller.connected:
+                self._drop(device, now)
+        due = [
+            device
+            for device in self.devices
+            if not device.controller and device.next_attempt <= now
+        ]
+        if not due:
+            return
+        for controller in self._open_all(due, self._ports(), now):
+            if self.manager:
+                self.manager.add_controller(controller)
+                if self._on_change:
+                    self._on_change()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.POLL_INTERVAL):
+            self.poll(monotonic())
+
+    def _ports(self) -> Dict[str, str]:
+        return {
+            port.serial_number: port.device
+            for port in self._scan()
+            if port.serial_number
+        }
+
+    def _open_all(
+        self, devices: List[_Device], ports: Dict[str, str], now: float
+    ) -> List[SerialOutputController]:
+        """
+        Open devices at the same time, so waiting for them to boot takes as
+        long as the slowest rather than all of them added up
+        """
+        if not devices:
+            return []
+        with ThreadPoolExecutor(max_workers=len(devices)) as executor:
+            opened = list(
+                executor.map(lambda device: self._try_open(device, ports, now), devices)
+            )
+        return [controller for controller in opened if controller]
+
+    def _try_open(
+        self, device: _Device, ports: Dict[str, str], now: float
+    ) -> Optional[SerialOutputController]:
+        spec = device.spec
+        name = spec.controller.__name__
+        port = ports.get(spec.serial_number)
+        if port is None:
+            if not device.backoff:
+                print(f"No microcontroller with serial {spec.serial_number} for {name}")
+            self._back_off(device, now)
+            return None
+        print(f"Opening {spec.serial_number} controller port for {name}")
+        try:
+            serial_port = self._open_port(port, spec.baudrate)
+            if spec.handshake:
+                self._wait_ready(serial_port, name)
+            window = None
+            if spec.flow_control and spec.handshake:
+                window = request_credits(serial_port, self._ready_timeout)
+                if window is None:
+                    print(f"No credits from {name}, pacing its writes instead")
+            controller = spec.controller(serial_port, spec.codec)
+            if window:
+                controller.enable_flow_control(window)
+        except OSError as e:
+            print(f"Could not open {port} for {name}: {e}")
+            self._back_off(device, now)
+            return None
+        if self._background_writers:
+            controller.start_background_writer()
+        device.controller = controller
+        device.backoff = 0.0
+        return controller
+
+    def _wait_ready(self, serial_port: Any, name: str) -> bool:
+        deadline = monotonic() + self._ready_timeout
+        # Whatever the board said before it was asked is stale
+        serial_port.reset_input_buffer()
+        ask_at = 0.0
+        while monotonic() < deadline:
+            if monotonic() >= ask_at:
+                serial_port.write(READY_QUERY)
+                ask_at = monotonic() + self.READY_QUERY_INTERVAL
+            if serial_port.read(1) == READY:
+                return True
+        print(f"No ready byte from {name}, carrying on without it")
+        return False
+
+    def _drop(self, device: _Device, now: float) -> None:
+        controller = device.controller
+        assert controller
+        print(f"Lost {device.spec.controller.__name__}, will reconnect")
+        if self.manager:
+            self.manager.remove_controller(controller)
+        controller.close()
+        device.controller = None
+        self._back_off(device, now)
+
+    def _back_off(self, device: _Device, now: float) -> None:
+        device.backoff = min(
+            self.MAX_BACKOFF, max(self.MIN_BACKOFF, device.backoff * 2)
+        )
+        device.next_attempt = now + device.backoff
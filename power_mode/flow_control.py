@@ -0,0 +1,112 @@
+"""
+Credit based flow control for the serial links.
+
+Asked with FLOW_CONTROL, a sketch answers with the size of its receive buffer
+and from then on writes ACK once it has finished with each frame, good or
+bad. The host keeps no more unacknowledged bytes in flight than that, so
+nothing arriving while the board is busy (eg. in strip.show()) can overflow
+the buffer, and it sends as fast as the board actually gets through frames
+rather than after a fixed sleep.
+"""
+from __future__ import annotations
+
+from collections import deque
+from time import monotonic
+from typing import Any, Deque, Dict, List, Optional
+
+from power_mode.clock import Clock
+from power_mode.protocol import ACK, FLOW_CONTROL
+
+
+def request_credits(serial_connection: Any, timeout: float) -> Optional[int]:
+    """
+    Turn on acknowledgements and return the window the device grants, in
+    bytes, or None if it doesn't answer (eg. older firmware)
+    """
+    serial_connection.write(FLOW_CONTROL)
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        # Anything before the grant, eg. a late READY, is skipped
+        if serial_connection.read(1) != FLOW_CONTROL:
+            continue
+        window = serial_connection.read(2)
+        if len(window) == 2:
+            return int.from_bytes(window, "little")
+    return None
+
+
+class Credits:
+    """
+    Bytes sent but not yet acknowledged, in the order they were sent. A write
+    of several frames at once is only credited back once all of its acks are
+    in.
+
+    acquire() blocks, reading acks, until the next write fits in the window.
+    A write bigger than the whole window waits for everything before it and
+    then goes out alone, the board reads it as it arrives.
+    """
+
+    # Seconds of waiting without an ack before what's in flight is written
+    # off, eg. after a byte was lost and a frame never completed
+    ACK_TIMEOUT = 0.5
+
+    def __init__(self, serial_connection: Any, window: int, clock: Clock = monotonic):
+        self.serial_connection = serial_connection
+        self.window = window
+        self.clock = clock
+        self.acks = 0
+        self.timeouts = 0
+        # Seconds spent waiting for credit
+        self.wait_time = 0.0
+        # [bytes, frames not yet acknowledged] for each write in flight
+        self._in_flight: Deque[List[int]] = deque()
+        self._bytes_in_flight = 0
+
+    @property
+    def bytes_in_flight(self) -> int:
+        return self._bytes_in_flight
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "window": self.window,
+            "bytes_in_flight": self._bytes_in_flight,
+            "acks": self.acks,
+            "ack_timeouts": self.timeouts,
+            "credit_wait_time": self.wait_time,
+        }
+
+    def acquire(self, size: int, frames: int = 1) -> None:
+        """
+        Wait until size bytes holding frames frames can be sent, then count
+        them as in flight. Read errors are the caller's to handle.
+        """
+        if self._in_flight and self._bytes_in_flight + size > self.window:
+            started = self.clock()
+            last_ack = started
+            while self._in_flight and self._bytes_in_flight + size > self.window:
+                if self._read_acks():
+                    last_ack = self.clock()
+                elif self.clock() - last_ack >= self.ACK_TIMEOUT:
+                    self.timeouts += 1
+                    self._in_flight.clear()
+                    self._bytes_in_flight = 0
+            self.wait_time += self.clock() - started
+        self._in_flight.append([size, frames])
+        self._bytes_in_flight += size
+
+    def _read_acks(self) -> int:
+        connection = self.serial_connection
+        # Blocks for up to the port's read timeout when nothing has come back
+        data = connection.read(max(1, connection.in_waiting))
+        acks = data.count(ACK)
+        self.acks += acks
+        in_flight = self._in_flight
+        for _ in range(acks):
+            if not in_flight:
+                break
+            write = in_flight[0]
+            write[1] -= 1
+            if write[1] <= 0:
+                in_flight.popleft()
+                self._bytes_in_flight -= write[0]
+        return acks
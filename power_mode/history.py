@@ -0,0 +1,363 @@
+"""
+Every combo ever played, kept on disk so records survive a restart.
+
+The store is a header followed by fixed size records, appended as each combo
+ends. A record is start and end (seconds since the epoch, f64 each) then the
+combo, median WPM, best WPM and backspaces (u32 each), little endian. Record n
+is at len(MAGIC) + n * RECORD.size, so the file can be read through mmap.
+
+Next to it, <path>.idx keeps what the queries need so none of them scan the
+records: the number of records it covers, the best combo and best median WPM,
+the TOP_N best combos and the best combo of each day. It is rewritten whole
+after each batch of records, and rebuilt from the records if it is missing or
+behind.
+
+    python -m power_mode.main --history ~/.power_mode_history
+    python -m power_mode.history ~/.power_mode_history
+"""
+from __future__ import annotations
+
+import argparse
+import heapq
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from datetime import date
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from power_mode.clock import Clock
+from power_mode.core import GameState
+
+MAGIC = b"PMHIST\x01\x00"
+INDEX_MAGIC = b"PMHIDX\x01\x00"
+
+RECORD = struct.Struct("<ddIIII")
+# Magic, records covered, best combo record, best median WPM record, then the
+# number of top combos and of days that follow
+_INDEX_HEADER = struct.Struct("<8sQIIII")
+# Combo and record number, best first
+_INDEX_TOP = struct.Struct("<II")
+# Day (date.toordinal in local time) and record number, oldest first
+_INDEX_DAY = struct.Struct("<iI")
+_NO_RECORD = 0xFFFFFFFF
+
+
+class SessionRecord(NamedTuple):
+    start: float
+    end: float
+    combo: int
+    median_wpm: int
+    max_wpm: int
+    backspaces: int
+
+    @property
+    def day(self) -> date:
+        return date.fromtimestamp(self.end)
+
+
+class SessionHistory:
+    """
+    Records are queued in memory when a combo ends and written from a
+    background thread every FLUSH_INTERVAL, so the tick path never touches
+    the disk. The index is kept in memory and covers queued records too.
+    """
+
+    FLUSH_INTERVAL = 5.0
+    TOP_N = 100
+
+    def __init__(self, path: str, wall_clock: Clock = time.time):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.wall_clock = wall_clock
+        self._lock = threading.Lock()
+        self._pending: List[bytes] = []
+        self._file: IO[bytes] = open(path, "a+b")
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+            self._file.flush()
+        else:
+            self._file.seek(0)
+            if self._file.read(len(MAGIC)) != MAGIC:
+                self._file.close()
+                raise ValueError(f"{path} is not a power mode history")
+        size = os.fstat(self._file.fileno()).st_size
+        # A record cut off mid write is dropped
+        self._written = (size - len(MAGIC)) // RECORD.size
+        self._file.truncate(len(MAGIC) + self._written * RECORD.size)
+        self._count = self._written
+        self._map: Optional[mmap.mmap] = None
+
+        self._best_combo = _NO_RECORD
+        self._best_wpm = _NO_RECORD
+        # (combo, -record) min heap of the TOP_N best, so the latest of equal
+        # combos is the first to go
+        self._top: List[Tuple[int, int]] = []
+        self._best_by_day: Dict[int, int] = {}
+        self._load_index()
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="power-mode-history", daemon=True
+        )
+        self._thread.start()
+
+    def combo_ended(self, state: GameState, now: float) -> None:
+        """
+        Called with the state as the combo times out, before it is reset.
+        now is on the game's clock, the record is stamped with wall time.
+        """
+        if not state.current_combo:
+            return
+        end = self.wall_clock()
+        self.add(
+            SessionRecord(
+                start=end - (now - state.combo_start),
+                end=end,
+                combo=state.current_combo,
+                median_wpm=state.median_wpm,
+                max_wpm=state.max_wpm,
+                backspaces=state.num_backspaces,
+            )
+        )
+
+    def add(self, record: SessionRecord) -> None:
+        with self._lock:
+            self._pending.append(RECORD.pack(*record))
+            self._index(self._count, record)
+            self._count += 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def record(self, number: int) -> SessionRecord:
+        with self._lock:
+            return self._record(number)
+
+    def records(self) -> Iterator[SessionRecord]:
+        for number in range(len(self)):
+            yield self.record(number)
+
+    def all_time_best(self) -> Optional[SessionRecord]:
+        with self._lock:
+            return self._optional_record(self._best_combo)
+
+    def best_median_wpm(self) -> Optional[SessionRecord]:
+        with self._lock:
+            return self._optional_record(self._best_wpm)
+
+    def best_on(self, day: date) -> Optional[SessionRecord]:
+        with self._lock:
+            return self._optional_record(
+                self._best_by_day.get(day.toordinal(), _NO_RECORD)
+            )
+
+    def best_today(self) -> Optional[SessionRecord]:
+        return self.best_on(date.fromtimestamp(self.wall_clock()))
+
+    def top_combos(self, n: int = 10) -> List[SessionRecord]:
+        """
+        Best combos first, the earlier of equal combos first. Only more than
+        TOP_N needs a scan of every record.
+        """
+        if n > self.TOP_N:
+            ranked = (
+                ((-record.combo, number), record)
+                for number, record in enumerate(self.records())
+            )
+            return [record for _, record in heapq.nsmallest(n, ranked)]
+        with self._lock:
+            return [
+                self._record(-negative_number)
+                for _, negative_number in sorted(self._top, reverse=True)[:n]
+            ]
+
+    def restore_records(self, state: GameState) -> None:
+        """
+        Start a game off with the all time bests, so the game over screen
+        shows them rather than the bests since the program started
+        """
+        best = self.all_time_best()
+        if best:
+            state.max_combo = max(state.max_combo, best.combo)
+        best = self.best_median_wpm()
+        if best:
+            state.max_median_wpm = max(state.max_median_wpm, best.median_wpm)
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+        self._file.close()
+
+    def flush(self) -> None:
+        # Queued records stay readable from memory until they are on disk
+        with self._lock:
+            pending = self._pending[:]
+        if not pending:
+            return
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(b"".join(pending))
+        self._file.flush()
+        with self._lock:
+            del self._pending[: len(pending)]
+            self._written += len(pending)
+            index = self._index_bytes()
+        temporary_path = f"{self.index_path}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(index)
+        os.replace(temporary_path, self.index_path)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.FLUSH_INTERVAL):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Could not write history to {self.path}: {e}")
+        self.flush()
+
+    def _index(self, number: int, record: SessionRecord) -> None:
+        if self._best_combo == _NO_RECORD or record.combo > self._best(
+            self._best_combo
+        ):
+            self._best_combo = number
+        if self._best_wpm == _NO_RECORD or (
+            record.median_wpm > self._record(self._best_wpm).median_wpm
+        ):
+            self._best_wpm = number
+        entry = (record.combo, -number)
+        if len(self._top) < self.TOP_N:
+            heapq.heappush(self._top, entry)
+        elif entry > self._top[0]:
+            heapq.heapreplace(self._top, entry)
+        day = record.day.toordinal()
+        best_of_day = self._best_by_day.get(day)
+        if best_of_day is None or record.combo > self._best(best_of_day):
+            self._best_by_day[day] = number
+
+    def _best(self, number: int) -> int:
+        return self._record(number).combo
+
+    def _optional_record(self, number: int) -> Optional[SessionRecord]:
+        return None if number == _NO_RECORD else self._record(number)
+
+    def _record(self, number: int) -> SessionRecord:
+        if not 0 <= number < self._count:
+            raise IndexError(number)
+        if number >= self._written:
+            return SessionRecord(*RECORD.unpack(self._pending[number - self._written]))
+        offset = len(MAGIC) + number * RECORD.size
+        if self._map is None or len(self._map) < offset + RECORD.size:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return SessionRecord(*RECORD.unpack_from(self._map, offset))
+
+    def _index_bytes(self) -> bytes:
+        top = sorted(self._top, reverse=True)
+        days = sorted(self._best_by_day.items())
+        return b"".join(
+            [
+                _INDEX_HEADER.pack(
+                    INDEX_MAGIC,
+                    self._written,
+                    self._best_combo,
+                    self._best_wpm,
+                    len(top),
+                    len(days),
+                ),
+                *(_INDEX_TOP.pack(combo, -negative) for combo, negative in top),
+                *(_INDEX_DAY.pack(day, number) for day, number in days),
+            ]
+        )
+
+    def _load_index(self) -> None:
+        covered = 0
+        try:
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            covered = self._read_index(data)
+        except (OSError, ValueError, struct.error):
+            covered = 0
+        if covered > self._written:
+            # Records the index saw were lost, eg. the store was replaced
+            covered = 0
+        if covered == 0:
+            self._best_combo = self._best_wpm = _NO_RECORD
+            self._top = []
+            self._best_by_day = {}
+        for number in range(covered, self._written):
+            self._index(number, self._record(number))
+
+    def _read_index(self, data: bytes) -> int:
+        (
+            magic,
+            covered,
+            best_combo,
+            best_wpm,
+            top_count,
+            day_count,
+        ) = _INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC:
+            raise ValueError("not a power mode history index")
+        offset = _INDEX_HEADER.size
+        top = [
+            (combo, -number)
+            for combo, number in _INDEX_TOP.iter_unpack(
+                data[offset : offset + top_count * _INDEX_TOP.size]
+            )
+        ]
+        offset += top_count * _INDEX_TOP.size
+        days = dict(
+            _INDEX_DAY.iter_unpack(data[offset : offset + day_count * _INDEX_DAY.size])
+        )
+        if len(top) != top_count or len(days) != day_count:
+            raise ValueError("index cut short")
+        numbers = [best_combo, best_wpm, *(-number for _, number in top)]
+        numbers.extend(days.values())
+        if any(number >= covered and number != _NO_RECORD for number in numbers):
+            raise ValueError("index refers to records it doesn't cover")
+        self._best_combo = best_combo
+        self._best_wpm = best_wpm
+        heapq.heapify(top)
+        self._top = top
+        self._best_by_day = days
+        return covered
+
+
+def _describe(record: Optional[SessionRecord]) -> str:
+    if record is None:
+        return "none yet"
+    started = time.strftime("%Y-%m-%d %H:%M", time.localtime(record.start))
+    return (
+        f"{record.combo} keys at {record.median_wpm} WPM"
+        f" (best {record.max_wpm}), {started}"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Show the records in a history")
+    parser.add_argument("path")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    history = SessionHistory(args.path)
+    try:
+        print(f"{len(history)} combos")
+        print(f"all time best: {_describe(history.all_time_best())}")
+        print(f"best today:    {_describe(history.best_today())}")
+        for place, record in enumerate(history.top_combos(args.top), 1):
+            print(f"  {place:3d}. {_describe(record)}")
+    finally:
+        history.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
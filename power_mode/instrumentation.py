@@ -0,0 +1,223 @@
+"""
+Latency histograms for the key and tick paths, cheap enough to leave on.
+
+Nothing is measured unless a GameManager is given an Instrumentation. With one
+each event costs a few perf_counter() calls and list increments. StatsFile
+writes everything out as json every few seconds for a look while typing:
+
+    python -m power_mode.main --stats /tmp/power_mode_stats.json
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from bisect import bisect_left
+from time import perf_counter
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Union
+
+if TYPE_CHECKING:
+    from power_mode.controllers import SerialOutputController
+    from power_mode.core import GameManager
+
+# Upper bound of each bucket in microseconds, anything slower goes in a final
+# overflow bucket
+BUCKET_BOUNDS_US = (
+    1,
+    2,
+    5,
+    10,
+    20,
+    50,
+    100,
+    200,
+    500,
+    1_000,
+    2_000,
+    5_000,
+    10_000,
+    20_000,
+    50_000,
+    100_000,
+)
+
+
+class LatencyHistogram:
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKET_BOUNDS_US) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect_left(BUCKET_BOUNDS_US, seconds * 1e6)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def lap(self, started: float) -> float:
+        """
+        Record the time since started (from perf_counter) and return now, to
+        be the start of the next lap
+        """
+        now = perf_counter()
+        self.record(now - started)
+        return now
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Upper bound in microseconds of the bucket holding the given percentile.
+        None if it is in the overflow bucket.
+        """
+        if not self.count:
+            return 0.0
+        wanted = self.count * percent / 100
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_US, self.counts):
+            seen += count
+            if seen >= wanted:
+                return bound
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        counts = self.counts[:]
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count * 1e6 if self.count else 0.0,
+            "max_us": self.max * 1e6,
+            "p50_us": self.percentile(50),
+            "p99_us": self.percentile(99),
+            "buckets": [
+                [bound, count]
+                for bound, count in zip(BUCKET_BOUNDS_US + (None,), counts)
+                if count
+            ],
+        }
+
+
+class ControllerHistograms:
+    __slots__ = ("key_down", "tick", "serial_write", "skipped_ticks")
+
+    def __init__(self) -> None:
+        self.key_down = LatencyHistogram()
+        self.tick = LatencyHistogram()
+        # Ticks where nothing the controller reads had changed
+        self.skipped_ticks = 0
+        # Only writes made on the caller's thread, a background writer's
+        # queue is reported with the writer's stats
+        self.serial_write = LatencyHistogram()
+
+
+class Instrumentation:
+    """
+    key_down and tick cover a whole event, including waiting for the other to
+    finish. The rest break an event down into game state updates and each
+    controller's share.
+    """
+
+    def __init__(self) -> None:
+        self.key_down = LatencyHistogram()
+        self.tick = LatencyHistogram()
+        self.increment_combo = LatencyHistogram()
+        self.record_wpm = LatencyHistogram()
+        self.combo_stopped = LatencyHistogram()
+        # By controller class, so they carry on over a reconnect
+        self.controllers: Dict[str, ControllerHistograms] = {}
+
+    def controller(self, controller: SerialOutputController) -> ControllerHistograms:
+        histograms = controller.histograms
+        if histograms is None:
+            name = type(controller).__name__
+            histograms = self.controllers.get(name)
+            if histograms is None:
+                histograms = self.controllers[name] = ControllerHistograms()
+            controller.histograms = histograms
+        return histograms
+
+    def stats(
+        self, controllers: Iterable[SerialOutputController] = ()
+    ) -> Dict[str, object]:
+        stats: Dict[str, object] = {
+            "key_down": self.key_down.stats(),
+            "tick": self.tick.stats(),
+            "increment_combo": self.increment_combo.stats(),
+            "record_wpm": self.record_wpm.stats(),
+            "combo_stopped": self.combo_stopped.stats(),
+        }
+        controller_stats: Dict[str, Dict[str, object]] = {
+            name: {
+                "key_down": histograms.key_down.stats(),
+                "tick": histograms.tick.stats(),
+                "skipped_ticks": histograms.skipped_ticks,
+                "serial_write": histograms.serial_write.stats(),
+            }
+            for name, histograms in self.controllers.items()
+        }
+        for controller in controllers:
+            entry = controller_stats.setdefault(type(controller).__name__, {})
+            entry.update(controller.write_stats())
+            entry["connected"] = controller.connected
+            if controller.writer:
+                entry["writer"] = controller.writer.stats()
+        stats["controllers"] = controller_stats
+        return stats
+
+
+class StatsFile:
+    """
+    Rewrites path with the manager's stats every interval seconds from a
+    background thread. The file is replaced whole so readers never see half.
+    """
+
+    INTERVAL = 5.0
+
+    def __init__(
+        self,
+        manager: GameManager,
+        path: Union[str, os.PathLike],
+        interval: float = INTERVAL,
+    ):
+        if manager.instrumentation is None:
+            manager.instrumentation = Instrumentation()
+        self.manager = manager
+        self.path = os.fspath(path)
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="power-mode-stats", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.write()
+
+    def write(self) -> None:
+        instrumentation = self.manager.instrumentation
+        if instrumentation is None:
+            return
+        controllers: List[SerialOutputController] = self.manager.serial_controllers
+        stats = instrumentation.stats(controllers)
+        series = self.manager.wpm_series
+        if series is not None:
+            # A minute a sample, as (time, mean WPM, highest combo, samples)
+            end = series.wall_clock()
+            stats["wpm_last_hour"] = list(series.range(end - 3600, end, 60.0))
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(stats, f, indent=2)
+        os.replace(temporary_path, self.path)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Could not write stats to {self.path}: {e}")
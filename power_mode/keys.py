@@ -0,0 +1,44 @@
+"""
+The keys the game tells apart, so the core doesn't depend on an input backend.
+
+The game only cares whether a key is a backspace. Input backends turn their
+own key objects into a Key as they hand them over, see from_pynput. A pynput
+key that gets through anyway is converted where it enters the game, see as_key.
+"""
+from __future__ import annotations
+
+import sys
+from enum import Enum
+
+
+class Key(Enum):
+    BACKSPACE = "backspace"
+    # Everything else, letters and modifiers alike
+    OTHER = "other"
+
+
+def as_key(key: object) -> Key:
+    """
+    key as a Key. A pynput key that wasn't converted still counts as what it
+    is. pynput is only looked at if something has imported it already, as
+    importing it needs a display, so anything else is some other key.
+    """
+    if isinstance(key, Key):
+        return key
+    keyboard = sys.modules.get("pynput.keyboard")
+    if keyboard is not None and key == keyboard.Key.backspace:
+        return Key.BACKSPACE
+    return Key.OTHER
+
+
+def is_backspace(key: object) -> bool:
+    return key is Key.BACKSPACE or (
+        not isinstance(key, Key) and as_key(key) is Key.BACKSPACE
+    )
+
+
+def from_pynput(key: object) -> Key:
+    # Only called by the keyboard listener, which has imported pynput already
+    from pynput.keyboard import Key as PynputKey
+
+    return Key.BACKSPACE if key == PynputKey.backspace else Key.OTHER
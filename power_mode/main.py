@@ -1,371 +1,193 @@
-from __future__ import annotations
-
-import math
-import random
-import statistics
-import threading
-from abc import ABC
-from dataclasses import dataclass
-from time import sleep, time
-from typing import List, Optional, Type, TypeVar
-
-import serial
-from pynput import keyboard
-from pynput.keyboard import Key, KeyCode
-from serial import Serial
-from serial.tools import list_ports
-
-T = TypeVar("T")
-
-
-@dataclass
-class GameState:
-    CHARS_IN_WORD = 5
-    MIN_WORDS_FOR_WPM = 5
-
-    current_combo: int
-    max_combo: int
-    max_median_wpm: int
-    combo_at_last_timeout: int
-    median_wpm_at_last_timeout: int
-    combo_timeout: int
-    time_of_last_key: float
-    combo_start: float
-    recorded_wpms: List[int]
-    num_backspaces: int
-
-    @staticmethod
-    def start() -> GameState:
-        return GameState(
-            current_combo=0,
-            max_combo=0,
-            max_median_wpm=0,
-            combo_at_last_timeout=0,
-            median_wpm_at_last_timeout=0,
-            combo_timeout=10,
-            time_of_last_key=time() - 10,  # want to start 'timed out'
-            combo_start=time(),
-            recorded_wpms=[],
-            num_backspaces=0,
-        )
-
-    @property
-    def percent_time_left(self) -> float:
-        seconds_past = time() - self.time_of_last_key
-        time_left = (self.combo_timeout - seconds_past) / self.combo_timeout
-        return time_left if time_left >= 0 else 0
-
-    @property
-    def current_wpm(self) -> int:
-        words_typed = (
-            self.current_combo - self.num_backspaces
-        ) / GameState.CHARS_IN_WORD
-        if words_typed < GameState.MIN_WORDS_FOR_WPM:
-            return 0
-        minutes_passed = (time() - self.combo_start) / 60
-        return math.floor(words_typed / minutes_passed)
-
-    @property
-    def median_wpm(self) -> int:
-        return (
-            math.floor(statistics.median(self.recorded_wpms))
-            if self.recorded_wpms
-            else 0
-        )
-
-    @staticmethod
-    def _new_if_exists(new: Optional[T], original: T) -> T:
-        return original if new is None else new
-
-    def copy(
-        self,
-        current_combo: Optional[int] = None,
-        max_combo: Optional[int] = None,
-        max_median_wpm: Optional[int] = None,
-        combo_at_last_timeout: Optional[int] = None,
-        median_wpm_at_last_timeout: Optional[int] = None,
-        combo_timeout: Optional[int] = None,
-        time_of_last_key: Optional[float] = None,
-        combo_start: Optional[float] = None,
-        recorded_wpms: Optional[List[int]] = None,
-        num_backspaces: Optional[int] = None,
-    ) -> GameState:
-        return GameState(
-            current_combo=self._new_if_exists(current_combo, self.current_combo),
-            max_combo=self._new_if_exists(max_combo, self.max_combo),
-            max_median_wpm=self._new_if_exists(max_median_wpm, self.max_median_wpm),
-            combo_at_last_timeout=self._new_if_exists(
-                combo_at_last_timeout, self.combo_at_last_timeout
-            ),
-            median_wpm_at_last_timeout=self._new_if_exists(
-                median_wpm_at_last_timeout, self.median_wpm_at_last_timeout
-            ),
-            combo_timeout=self._new_if_exists(combo_timeout, self.combo_timeout),
-            time_of_last_key=self._new_if_exists(
-                time_of_last_key, self.time_of_last_key
-            ),
-            combo_start=self._new_if_exists(combo_start, self.combo_start),
-            recorded_wpms=self._new_if_exists(recorded_wpms, self.recorded_wpms),
-            num_backspaces=self._new_if_exists(num_backspaces, self.num_backspaces),
-        )
-
-    def increment_combo(self, key: KeyCode) -> GameState:
-        new_combo = self.current_combo + 1
-        return self.copy(
-            current_combo=new_combo,
-            num_backspaces=self.num_backspaces + 1 if key == Key.backspace else None,
-            time_of_last_key=time(),
-            recorded_wpms=[] if self.current_combo == 0 else None,
-            max_combo=new_combo if self.max_combo < new_combo else self.max_combo,
-        )
-
-    def combo_stopped(self) -> GameState:
-        return self.copy(
-            current_combo=0,
-            num_backspaces=0,
-            combo_start=time(),
-            combo_at_last_timeout=self.current_combo
-            if self.current_combo
-            else self.combo_at_last_timeout,
-            median_wpm_at_last_timeout=self.median_wpm
-            if self.median_wpm
-            else self.median_wpm_at_last_timeout,
-            recorded_wpms=[],
-        )
-
-    def record_wpm(self) -> GameState:
-        current_wpm = self.current_wpm
-        recorded_wpms = None
-        if current_wpm:
-            recorded_wpms = self.recorded_wpms + [current_wpm]
-            if len(recorded_wpms) > 100:
-                recorded_wpms = recorded_wpms[1:]
-        return self.copy(
-            recorded_wpms=recorded_wpms,
-            max_median_wpm=self.median_wpm
-            if self.median_wpm > self.max_median_wpm
-            else self.max_median_wpm,
-        )
-
-
-class Controller(ABC):
-    def tick(self, state: GameState) -> None:
-        raise NotImplementedError()
-
-    def key_down(self, key, state: GameState) -> None:
-        return None
-
-
-class SerialOutputController(Controller, ABC):
-    def __init__(self, serial_connection: Serial):
-        self.serial_connection = serial_connection
-        self.last_message = ""
-
-    def write(self, message: str) -> bool:
-        if message != self.last_message:
-            self.serial_connection.write(message.encode("utf-8"))
-            self.last_message = message
-            return True
-        else:
-            return False
-
-
-class ScreenController(SerialOutputController):
-    MODE_CHANGE_TIME = 2
-
-    def __init__(self, serial_connection: Serial):
-        super().__init__(serial_connection)
-        self.last_mode_change = time()
-        self.display_combo = True
-
-    def tick(self, state: GameState) -> None:
-        cur_time = time()
-        self._check_for_mode_change(cur_time)
-        self._write_state(state, cur_time)
-
-    def _check_for_mode_change(self, cur_time: float) -> None:
-        if cur_time - self.last_mode_change > self.MODE_CHANGE_TIME:
-            self.display_combo = not self.display_combo
-            self.last_mode_change = cur_time
-
-    def _write_state(self, state: GameState, cur_time: float) -> None:
-        """
-        Protocol is mode,timeleft,value;
-        mode: (one of: c,w,e)
-        timeleft: float
-        value: some string, should not be longer than 8 chars or so....
-
-        Example:
-            c,.5,1039;
-        """
-        if state.current_combo:
-            mode = "c" if self.display_combo or not state.median_wpm else "w"
-            value_to_display = (
-                str(state.current_combo) if mode == "c" else str(state.median_wpm)
-            )
-        else:
-            mode = "e"
-            value_to_display = f"{state.max_combo}  {state.max_median_wpm}"
-        truncated_percent_left = "{:.1f}".format(state.percent_time_left)
-        msg = f"{mode},{truncated_percent_left},{value_to_display};"
-        self.write(msg)
-        self.last_write = cur_time
-
-
-class BellController(SerialOutputController):
-    def __init__(self, serial_connection: Serial):
-        super().__init__(serial_connection)
-        self.bell_click_times = [1.0, 1.0, 1.0, 1.0]
-        self.current_index = 0
+"""
+Runs the game against the devices on the desk and the keyboard.
 
-    def key_down(self, key, state: GameState) -> None:
-        self.bell_click_times[self.current_index] = time()
-        self._increment_index()
-        self._send()
-
-    def tick(self, _: GameState):
-        self._send()
-
-    def _increment_index(self):
-        self.current_index += 1
-        if self.current_index == len(self.bell_click_times):
-            self.current_index = 0
-
-    def _send(self):
-        """
-        protocol is just on or off for each of the bell relays
-        example: 1010
-
-        Any bell that was triggered over .1 seconds ago is flipped to 0
-        """
-        curr_time = time()
-        msg = "".join(
-            [
-                "1" if curr_time - bell_clicked_time < 0.1 else "0"
-                for bell_clicked_time in self.bell_click_times
-            ]
-        )
-        self.write(msg)
-
-
-class StripController(SerialOutputController):
-    NUM_COLORS = 8
-    NUM_PIXELS = 144
-
-    def __init__(self, serial_connection: Serial):
-        super().__init__(serial_connection)
-        self.colors: List[int] = []
-        self.color = 0
-        self.index = 0
-        self.last_message = ""
-        self._reset_colors()
-
-    def tick(self, state: GameState) -> None:
-        if not state.current_combo:
-            self.color = 0
-            self.index = 0
-            self._write_msg("e")
-
-    def key_down(self, key, state: GameState) -> None:
-        self._write_msg(str(self.color))
-        self.index += 1
-        if self.index >= self.NUM_PIXELS:
-            self._change_color()
-
-    def _write_msg(self, mode_param: str):
-        message = f"{self.index},{mode_param};"
-        wrote = self.write(message)
-        if wrote:
-            sleep(0.01)
-
-    def _change_color(self):
-        if not self.colors:
-            self._reset_colors()
-        self.index = 0
-        self.color = self.colors.pop()
-
-    def _reset_colors(self):
-        self.colors = list(range(0, self.NUM_COLORS))
-        random.shuffle(self.colors)
-        if self.colors[-1] == self.color:
-            first_color = self.colors.pop()
-            self.colors.insert(0, first_color)
-
-
-class BalloonFanController(SerialOutputController):
-    FAN_THRESHOLD = 100
-
-    def __init__(self, serial_connection: Serial):
-        super().__init__(serial_connection)
-        self.last_message = ""
-
-    def tick(self, state: GameState) -> None:
-        balloon = "1" if state.current_combo else "0"
-        fan = "1" if state.current_combo >= self.FAN_THRESHOLD else "0"
-        self.write(f"{balloon},{fan};")
-
-
-class GameManager:
-    def __init__(self, serial_controllers: List[SerialOutputController]):
-        self.game_state: GameState = GameState.start()
-        self.serial_controllers: List[SerialOutputController] = serial_controllers
-
-    def trigger_tick(self) -> None:
-        if self.game_state.percent_time_left == 0:
-            self.game_state = self.game_state.combo_stopped()
-
-        snapshot = self.game_state.copy()
-        for controller in self.serial_controllers:
-            controller.tick(snapshot)
-
-    def trigger_key_down(self, key) -> None:
-        self.game_state = self.game_state.increment_combo(key)
-        if (
-            self.game_state.current_wpm
-            and self.game_state.current_combo % self.game_state.CHARS_IN_WORD == 0
-        ):
-            self.game_state = self.game_state.record_wpm()
-        snapshot = self.game_state.copy()
-        for controller in self.serial_controllers:
-            controller.key_down(key, snapshot)
-
-
-def _get_controller(
-    identifier: str, controller: Type[SerialOutputController]
-) -> Optional[SerialOutputController]:
-    microcontroller = None
-    for port in list_ports.comports():
-        if port.serial_number == identifier:
-            print(f"Opening {identifier} controller port for {controller.__name__}")
-            microcontroller = controller(serial.Serial(port.device, baudrate=9600))
-    if not microcontroller:
-        print(f"No microcontroller with serial {identifier} for {controller.__name__}")
-    return microcontroller
-
-
-def _game_tick(manager: GameManager):
-    manager.trigger_tick()
-    threading.Timer(0.05, _game_tick, args=[manager]).start()
+The game itself lives in power_mode.core and the device controllers in
+power_mode.controllers, both are re-exported here. pynput and pyserial are
+only imported once _main needs them.
+"""
+from __future__ import annotations
 
+import argparse
+from typing import TYPE_CHECKING, List, Optional
+
+from power_mode.controllers import (
+    AnimatedStripController,
+    BalloonFanController,
+    BellController,
+    PulsedBellController,
+    RenderedScreenController,
+    ScreenController,
+    SerialOutputController,
+    StripController,
+)
+from power_mode.core import (
+    Changed,
+    Controller,
+    GameManager,
+    GameState,
+    GameStateView,
+)
+from power_mode.devices import DeviceRegistry, DeviceSpec
+from power_mode.instrumentation import StatsFile
+from power_mode.keys import from_pynput
+from power_mode.protocol import BINARY
+from power_mode.scheduler import TickScheduler
+
+if TYPE_CHECKING:
+    from power_mode.simulator import SimulatedDevice
+
+__all__ = [
+    "AnimatedStripController",
+    "BalloonFanController",
+    "BellController",
+    "Changed",
+    "Controller",
+    "DEVICES",
+    "GameManager",
+    "GameState",
+    "GameStateView",
+    "PulsedBellController",
+    "RenderedScreenController",
+    "ScreenController",
+    "SerialOutputController",
+    "StripController",
+]
+
+
+DEVICES = [
+    DeviceSpec("8B94297553344B4151202020FF102840", ScreenController),
+    DeviceSpec("unknown", BellController),
+    DeviceSpec("753343239353516111D1", StripController),
+    # The fan's sketch never answers the ready query
+    DeviceSpec("unknown", BalloonFanController, handshake=False),
+]
+
+
+def _main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Typing power mode")
+    parser.add_argument("--record", help="record the session to this file")
+    parser.add_argument("--stats", help="keep latency stats up to date in this file")
+    parser.add_argument("--history", help="keep every combo played in this file")
+    parser.add_argument(
+        "--track-wpm",
+        action="store_true",
+        help="keep WPM over weeks, the last hour goes in the --stats file",
+    )
+    parser.add_argument(
+        "--coalesce",
+        type=float,
+        default=0.0,
+        help="batch keys that come within this many seconds, eg. 0.01",
+    )
+    parser.add_argument(
+        "--animated-strip",
+        action="store_true",
+        help="draw the strip on the host, needs the latest strip firmware",
+    )
+    parser.add_argument(
+        "--rendered-screen",
+        type=int,
+        nargs="?",
+        const=115200,
+        metavar="BAUD",
+        help="lay the screen out on the host, at 115200 baud unless given",
+    )
+    parser.add_argument(
+        "--pulsed-bells",
+        action="store_true",
+        help="time bell rings on the device, needs the latest bells firmware",
+    )
+    parser.add_argument(
+        "--flow-control",
+        action="store_true",
+        help="pace writes on credits and acks from the devices instead of sleeps",
+    )
+    parser.add_argument(
+        "--simulate",
+        type=int,
+        metavar="BAUD",
+        help="play against simulated devices at this baud rate instead",
+    )
+    args = parser.parse_args(argv)
 
-def _main():
     print("Starting game")
+    specs = DEVICES
+    if args.animated_strip:
+        specs = [
+            spec._replace(controller=AnimatedStripController)
+            if spec.controller is StripController
+            else spec
+            for spec in specs
+        ]
+    if args.rendered_screen:
+        specs = [
+            spec._replace(
+                controller=RenderedScreenController,
+                codec=BINARY,
+                baudrate=args.rendered_screen,
+            )
+            if spec.controller is ScreenController
+            else spec
+            for spec in specs
+        ]
+    if args.pulsed_bells:
+        specs = [
+            spec._replace(controller=PulsedBellController, codec=BINARY)
+            if spec.controller is BellController
+            else spec
+            for spec in specs
+        ]
+    if args.flow_control:
+        specs = [spec._replace(flow_control=True) for spec in specs]
+    simulated: List[SimulatedDevice] = []
+    if args.simulate:
+        from power_mode.simulator import simulated_registry
+
+        registry, simulated = simulated_registry(specs, args.simulate)
+    else:
+        registry = DeviceRegistry(specs)
     game_manager = GameManager(
-        serial_controllers=[
-            controller
-            for controller in [
-                _get_controller("8B94297553344B4151202020FF102840", ScreenController),
-                _get_controller("unknown", BellController),
-                _get_controller("753343239353516111D1", StripController),
-                _get_controller("unknown", BalloonFanController),
-            ]
-            if controller
-        ],
+        serial_controllers=registry.connect(), coalesce_window=args.coalesce
     )
+    # Optional parts and the hardware backends are imported as they are
+    # needed, to keep startup fast
+    if args.record:
+        from power_mode.recording import SessionRecorder, Setup
+
+        game_manager.recorder = SessionRecorder(
+            args.record, game_manager.clock, Setup.of(game_manager)
+        )
+    if args.history:
+        from power_mode.history import SessionHistory
+
+        game_manager.history = SessionHistory(args.history)
+        game_manager.history.restore_records(game_manager.game_state)
+    if args.track_wpm:
+        game_manager.track_wpm()
+    stats_file = None
+    if args.stats:
+        stats_file = StatsFile(game_manager, args.stats)
+        stats_file.start()
     print("Starting listener")
-    _game_tick(game_manager)
-    with keyboard.Listener(on_press=game_manager.trigger_key_down) as listener:
-        listener.join()
+    from pynput import keyboard
+
+    scheduler = TickScheduler(game_manager)
+    scheduler.start()
+    registry.watch(game_manager, on_change=scheduler.wake)
+    try:
+        with keyboard.Listener(
+            on_press=lambda key: scheduler.trigger_key_down(from_pynput(key))
+        ) as listener:
+            listener.join()
+    finally:
+        if game_manager.recorder:
+            game_manager.recorder.close()
+        if game_manager.history is not None:
+            game_manager.history.close()
+        if stats_file:
+            stats_file.stop()
+        for device in simulated:
+            device.close()
 
 
 if __name__ == "__main__":
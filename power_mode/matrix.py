@@ -0,0 +1,224 @@
+"""
+Host side rendering for the 64x32 RGB matrix.
+
+render_page() lays out the same page combodisplay.ino's drawPage() does, with
+the same 5x7 font, into a framebuffer of one RGB 3-3-2 byte per pixel.
+dirty_rects() compares it with the frame on the screen and returns MatrixRect
+messages, run length encoded, covering only the rows that changed. New
+layouts then only need a change here, not a firmware flash.
+
+Rendering is slice assignment of glyph rows cached per size and colour, and
+diffing XORs whole rows as integers, so a frame costs well under a
+millisecond, most of it run length encoding.
+"""
+from __future__ import annotations
+
+import math
+import re
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+from power_mode.protocol import MatrixRect
+
+WIDTH = 64
+HEIGHT = 32
+# Most runs a MatrixRect can carry
+MAX_RUNS = 255
+
+# The glyphs the pages use from the Adafruit GFX classic font, 5 columns of
+# 7 bits each, top row in the least significant bit
+FONT = {
+    " ": (0x00, 0x00, 0x00, 0x00, 0x00),
+    "0": (0x3E, 0x51, 0x49, 0x45, 0x3E),
+    "1": (0x00, 0x42, 0x7F, 0x40, 0x00),
+    "2": (0x42, 0x61, 0x51, 0x49, 0x46),
+    "3": (0x21, 0x41, 0x45, 0x4B, 0x31),
+    "4": (0x18, 0x14, 0x12, 0x7F, 0x10),
+    "5": (0x27, 0x45, 0x45, 0x45, 0x39),
+    "6": (0x3C, 0x4A, 0x49, 0x49, 0x30),
+    "7": (0x01, 0x71, 0x09, 0x05, 0x03),
+    "8": (0x36, 0x49, 0x49, 0x49, 0x36),
+    "9": (0x06, 0x49, 0x49, 0x29, 0x1E),
+    "A": (0x7C, 0x12, 0x11, 0x12, 0x7C),
+    "B": (0x7F, 0x49, 0x49, 0x49, 0x36),
+    "C": (0x3E, 0x41, 0x41, 0x41, 0x22),
+    "M": (0x7F, 0x02, 0x1C, 0x02, 0x7F),
+    "O": (0x3E, 0x41, 0x41, 0x41, 0x3E),
+    "P": (0x7F, 0x09, 0x09, 0x09, 0x06),
+    "W": (0x3F, 0x40, 0x38, 0x40, 0x3F),
+    "X": (0x63, 0x14, 0x08, 0x14, 0x63),
+}
+GLYPH_WIDTH = 5
+GLYPH_HEIGHT = 7
+# Characters advance a column past the glyph
+CHAR_WIDTH = 6
+
+
+def color333(red: int, green: int, blue: int) -> int:
+    """
+    matrix.Color333() as one RGB 3-3-2 byte, blue loses its lowest bit
+    """
+    return red << 5 | green << 2 | blue >> 1
+
+
+BLACK = 0
+MODE_COLORS = {"c": color333(0, 0, 7), "e": color333(7, 0, 0), "w": color333(0, 7, 0)}
+MODE_TEXT = {"c": "COMBO", "e": "MAXC MAXW", "w": "WPM"}
+MODE_X = {"c": 18, "e": 1, "w": 23}
+VALUE_COLOR = color333(1, 7, 2)
+
+
+@lru_cache(maxsize=None)
+def _glyph_rows(char: str, size: int, color: int) -> Tuple[bytes, ...]:
+    """
+    The glyph as rows of pixels, each font pixel size by size
+    """
+    columns = FONT.get(char, FONT[" "])
+    rows = []
+    for y in range(GLYPH_HEIGHT):
+        row = b"".join(
+            bytes([color if column >> y & 1 else BLACK]) * size for column in columns
+        )
+        rows.extend([row] * size)
+    return tuple(rows)
+
+
+def draw_text(
+    frame: bytearray, text: str, x: int, y: int, size: int, color: int
+) -> None:
+    """
+    Like matrix.print() without wrapping, anything off the edge is clipped
+    """
+    for char in text:
+        if x >= WIDTH:
+            return
+        rows = _glyph_rows(char, size, color)
+        width = min(len(rows[0]), WIDTH - x)
+        for dy, row in enumerate(rows[: HEIGHT - y]):
+            start = (y + dy) * WIDTH + x
+            frame[start : start + width] = row[:width]
+        x += CHAR_WIDTH * size
+
+
+def render_page(mode: str, value: str, percent: float) -> bytearray:
+    """
+    drawPage(), mode is the protocol's mode letter: c, w or e
+    """
+    frame = bytearray(WIDTH * HEIGHT)
+    mode = mode if mode in MODE_TEXT else "w"
+    draw_text(frame, MODE_TEXT[mode], MODE_X[mode], 0, 1, MODE_COLORS[mode])
+    # drawDisplayValue() picks the biggest size that fits
+    length = len(value)
+    if length < 4:
+        x, y, size = {1: 25, 2: 18}.get(length, 8), 7, 3
+    elif length < 6:
+        x, y, size = 10 if length == 4 else 3, 8, 2
+    else:
+        x, y, size = 3, 12, 1
+    draw_text(frame, value, x, y, size, VALUE_COLOR)
+    # drawTimeRemaining(), a bar shrinking in to the middle
+    if percent > 0.8:
+        color = color333(0, 7, 0)
+    elif percent > 0.5:
+        color = color333(7, 7, 0)
+    else:
+        color = color333(7, 0, 0)
+    half = min(math.ceil(32 * percent), WIDTH // 2)
+    bar = bytes([color]) * (2 * half)
+    for y in (29, 30):
+        start = y * WIDTH + WIDTH // 2 - half
+        frame[start : start + 2 * half] = bar
+    return frame
+
+
+_RUN = re.compile(rb"(.)\1{0,254}", re.DOTALL)
+
+
+def encode_runs(pixels: bytes) -> bytes:
+    """
+    (count, color) byte pairs, at most 255 pixels a run
+    """
+    runs = bytearray()
+    for match in _RUN.finditer(pixels):
+        runs.append(match.end() - match.start())
+        runs.append(pixels[match.start()])
+    return bytes(runs)
+
+
+def _rect(frame: bytearray, x: int, y: int, w: int, h: int) -> List[MatrixRect]:
+    pixels = b"".join(
+        frame[row * WIDTH + x : row * WIDTH + x + w] for row in range(y, y + h)
+    )
+    runs = encode_runs(pixels)
+    if len(runs) // 2 <= MAX_RUNS:
+        return [MatrixRect(x, y, w, h, runs)]
+    # Too busy for one message, a single row never is
+    top = h // 2
+    return _rect(frame, x, y, w, top) + _rect(frame, x, y + top, w, h - top)
+
+
+def _changed_span(old: Sequence[int], new: Sequence[int]) -> Optional[Tuple[int, int]]:
+    """
+    The first and last indexes at which two equal length buffers differ, from
+    the highest and lowest set bits of their XOR. Big endian, so byte 0 is the
+    highest.
+    """
+    changed = int.from_bytes(old, "big") ^ int.from_bytes(new, "big")
+    if not changed:
+        return None
+    end = len(old) - 1
+    return (
+        end - (changed.bit_length() - 1) // 8,
+        end - ((changed & -changed).bit_length() - 1) // 8,
+    )
+
+
+def dirty_rects(shown: Optional[bytearray], frame: bytearray) -> List[MatrixRect]:
+    """
+    Rects covering every pixel that differs between shown and frame, the whole
+    screen if what's shown isn't known. Consecutive changed rows are one rect,
+    as wide as the changes in them.
+    """
+    if shown is None:
+        return _rect(frame, 0, 0, WIDTH, HEIGHT)
+    rects: List[MatrixRect] = []
+    span = _changed_span(shown, frame)
+    if span is None:
+        return rects
+    # Only the rows from the first change to the last need looking at
+    first_row = span[0] // WIDTH
+    last_row = span[1] // WIDTH
+    # Views so comparing rows doesn't copy them
+    old = memoryview(shown)
+    new = memoryview(frame)
+    top: Optional[int] = None
+    left = right = 0
+    for y in range(first_row, last_row + 2):
+        start = y * WIDTH
+        end = start + WIDTH
+        row_span = (
+            _changed_span(old[start:end], new[start:end]) if y <= last_row else None
+        )
+        if row_span is not None:
+            first, last = row_span
+            if top is None:
+                top, left, right = y, first, last
+            else:
+                left, right = min(left, first), max(right, last)
+        elif top is not None:
+            rects.extend(_rect(frame, left, top, right + 1 - left, y - top))
+            top = None
+    return rects
+
+
+def apply_rect(frame: bytearray, rect: MatrixRect) -> None:
+    """
+    What the firmware does with a MatrixRect
+    """
+    pixels = bytearray()
+    runs = rect.runs
+    for i in range(0, len(runs), 2):
+        pixels += bytes([runs[i + 1]]) * runs[i]
+    for row in range(rect.h):
+        start = (rect.y + row) * WIDTH + rect.x
+        frame[start : start + rect.w] = pixels[row * rect.w : (row + 1) * rect.w]
@@ -0,0 +1,271 @@
+"""
+Mirror the game to remote displays over UDP, unicast or multicast.
+
+Each frame is a header followed by the fields that changed since the previous
+frame:
+
+    magic "PM", version u8, flags u8, sequence u32, time left ms u16,
+    field mask u16, then a u32 for each field in the mask in FIELDS order
+
+All little endian. Every KEYFRAME_INTERVAL the sender sends every field with
+the KEYFRAME flag set, so a receiver that missed frames (or joined late) is
+back in sync within a second. Time left is in every frame rather than being
+a field, receivers count it down on their own clock between frames.
+"""
+from __future__ import annotations
+
+import socket
+import struct
+from time import monotonic
+from typing import NamedTuple, Optional, Tuple
+
+from power_mode.clock import Clock
+from power_mode.controllers import SerialOutputController
+from power_mode.core import Changed, GameState
+
+MAGIC = b"PM"
+VERSION = 1
+KEYFRAME = 1
+
+FIELDS = (
+    "current_combo",
+    "max_combo",
+    "max_median_wpm",
+    "combo_at_last_timeout",
+    "median_wpm_at_last_timeout",
+    "median_wpm",
+    "num_backspaces",
+    "combo_timeout",
+)
+
+_HEADER = struct.Struct("<2sBBIHH")
+_FIELD = struct.Struct("<I")
+_SEQUENCE_MASK = 0xFFFFFFFF
+
+
+class StateFrame(NamedTuple):
+    sequence: int
+    keyframe: bool
+    time_left_ms: int
+    # (field index, value) for each field sent
+    fields: Tuple[Tuple[int, int], ...]
+
+    def to_bytes(self) -> bytes:
+        mask = 0
+        for index, _ in self.fields:
+            mask |= 1 << index
+        header = _HEADER.pack(
+            MAGIC,
+            VERSION,
+            KEYFRAME if self.keyframe else 0,
+            self.sequence,
+            self.time_left_ms,
+            mask,
+        )
+        values = b"".join(
+            _FIELD.pack(min(value, 0xFFFFFFFF)) for _, value in sorted(self.fields)
+        )
+        return header + values
+
+    @staticmethod
+    def from_bytes(data: bytes) -> StateFrame:
+        """
+        Raises ValueError for anything that isn't a frame this version sent
+        """
+        if len(data) < _HEADER.size:
+            raise ValueError("short frame")
+        magic, version, flags, sequence, time_left_ms, mask = _HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a power mode state frame")
+        indexes = [index for index in range(len(FIELDS)) if mask & (1 << index)]
+        if len(data) != _HEADER.size + _FIELD.size * len(indexes):
+            raise ValueError("frame length doesn't match its field mask")
+        fields = tuple(
+            (index, _FIELD.unpack_from(data, _HEADER.size + _FIELD.size * i)[0])
+            for i, index in enumerate(indexes)
+        )
+        return StateFrame(sequence, bool(flags & KEYFRAME), time_left_ms, fields)
+
+
+class UdpConnection:
+    """
+    Stands in for the serial connection of a NetworkController. The socket
+    is non-blocking: a frame that can't be sent straight away is dropped,
+    the next keyframe makes up for it.
+    """
+
+    def __init__(self, address: Tuple[str, int], multicast_ttl: int = 1):
+        self.address = address
+        self.frames_dropped = 0
+        self.send_errors = 0
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+        if _is_multicast(address[0]):
+            self._socket.setsockopt(
+                socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, multicast_ttl
+            )
+
+    def write(self, data: bytes) -> int:
+        try:
+            return self._socket.sendto(data, self.address)
+        except BlockingIOError:
+            self.frames_dropped += 1
+        except OSError:
+            # eg. the network is down for a moment, not worth disconnecting
+            # over as there's nothing to reconnect
+            self.send_errors += 1
+        return 0
+
+    def close(self) -> None:
+        self._socket.close()
+
+
+class NetworkController(SerialOutputController):
+    """
+    Sends the game state to remote displays. Changes go out as soon as they
+    happen, on key presses as well as ticks.
+    """
+
+    KEYFRAME_INTERVAL = 1.0
+    # Receivers count the time left down themselves
+    TICK_DEPENDS_ON = Changed.ALL & ~Changed.TIME_LEFT
+
+    def __init__(self, connection: UdpConnection):
+        super().__init__(connection)  # type: ignore
+        self.sequence = 0
+        self.next_keyframe = 0.0
+        self.last_values: Optional[Tuple[int, ...]] = None
+        self.last_timeout_at: Optional[float] = None
+
+    def tick(self, state: GameState, now: Optional[float] = None) -> None:
+        self._send_state(state, monotonic() if now is None else now)
+
+    def key_down(self, key, state: GameState, now: Optional[float] = None) -> None:
+        self._send_state(state, monotonic() if now is None else now)
+
+    def keys_down(
+        self, count: int, state: GameState, now: Optional[float] = None
+    ) -> None:
+        self._send_state(state, monotonic() if now is None else now)
+
+    def needs_tick(self, changes: int, now: float) -> bool:
+        return changes & self.TICK_DEPENDS_ON != 0 or self.timer_due(now)
+
+    def timer_due(self, now: float) -> bool:
+        return now >= self.next_keyframe
+
+    def next_deadline(self, state: GameState, now: float) -> Optional[float]:
+        return self.next_keyframe
+
+    def _send_state(self, state: GameState, now: float) -> None:
+        values = tuple(getattr(state, field) for field in FIELDS)
+        timeout_at = state.next_deadline()
+        keyframe = now >= self.next_keyframe or self.last_values is None
+        if keyframe:
+            fields = tuple(enumerate(values))
+        else:
+            assert self.last_values is not None
+            fields = tuple(
+                (index, value)
+                for index, (value, last) in enumerate(zip(values, self.last_values))
+                if value != last
+            )
+            if not fields and timeout_at == self.last_timeout_at:
+                return
+        time_left_ms = 0 if timeout_at is None else round((timeout_at - now) * 1000)
+        frame = StateFrame(
+            self.sequence, keyframe, min(max(time_left_ms, 0), 0xFFFF), fields
+        )
+        self.sequence = (self.sequence + 1) & _SEQUENCE_MASK
+        self.last_values = values
+        self.last_timeout_at = timeout_at
+        if keyframe:
+            self.next_keyframe = now + self.KEYFRAME_INTERVAL
+        self.send(frame.to_bytes())
+
+
+class RemoteGameState(NamedTuple):
+    """
+    What a receiver knows of the game, with the same names as GameState
+    """
+
+    current_combo: int = 0
+    max_combo: int = 0
+    max_median_wpm: int = 0
+    combo_at_last_timeout: int = 0
+    median_wpm_at_last_timeout: int = 0
+    median_wpm: int = 0
+    num_backspaces: int = 0
+    combo_timeout: int = 10
+    # On the receiver's clock
+    timeout_at: float = 0.0
+
+    def percent_time_left_at(self, now: float) -> float:
+        return max(self.timeout_at - now, 0.0) / self.combo_timeout
+
+
+class StateReceiver:
+    """
+    Rebuilds the sender's state from the frames fed to it. Frames older than
+    the last one applied are ignored. After a gap in the sequence the state
+    may be missing changes until the next keyframe, synced says whether it
+    has had one since.
+    """
+
+    def __init__(self, clock: Clock = monotonic):
+        self.clock = clock
+        self.state = RemoteGameState()
+        self.sequence: Optional[int] = None
+        self.synced = False
+        self.frames_lost = 0
+        self.bad_frames = 0
+
+    def feed(self, data: bytes) -> bool:
+        """
+        Apply a frame, True if it changed the state
+        """
+        try:
+            frame = StateFrame.from_bytes(data)
+        except ValueError:
+            self.bad_frames += 1
+            return False
+        if self.sequence is not None:
+            ahead = (frame.sequence - self.sequence) & _SEQUENCE_MASK
+            if ahead == 0 or ahead > _SEQUENCE_MASK // 2:
+                # Duplicate or overtaken by a newer frame
+                return False
+            if ahead > 1:
+                self.frames_lost += ahead - 1
+                self.synced = False
+        if frame.keyframe:
+            self.synced = True
+        self.sequence = frame.sequence
+        changes = {FIELDS[index]: value for index, value in frame.fields}
+        self.state = self.state._replace(
+            timeout_at=self.clock() + frame.time_left_ms / 1000, **changes
+        )
+        return True
+
+
+def open_receiver(
+    port: int, group: Optional[str] = None, interface: str = "0.0.0.0"
+) -> socket.socket:
+    """
+    A socket to read frames from, joined to the multicast group if given
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("", port) if group else (interface, port))
+    if group:
+        membership = struct.pack(
+            "4s4s", socket.inet_aton(group), socket.inet_aton(interface)
+        )
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    return sock
+
+
+def _is_multicast(host: str) -> bool:
+    try:
+        return 224 <= socket.inet_aton(host)[0] <= 239
+    except OSError:
+        return False
@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+import math
+import struct
+from typing import Dict, List, NamedTuple, Tuple, Type, Union
+
+# The host asks if a device is ready with READY_QUERY, between messages. The
+# firmware answers READY once it's reading serial, and sends it unasked at
+# the end of setup() too.
+READY_QUERY = b"?"
+READY = b"!"
+# With FLOW_CONTROL the host asks a device to acknowledge frames. It answers
+# FLOW_CONTROL and its receive buffer size as a u16, then ACK after each
+# frame. See power_mode.flow_control.
+FLOW_CONTROL = b"$"
+ACK = b"+"
+
+
+def percent_tenths(percent: float) -> int:
+    """
+    Percent of time left as a whole number of tenths, how the screen shows it
+    """
+    return math.floor(percent * 10 + 0.5)
+
+
+class ScreenMessage(NamedTuple):
+    """
+    ASCII protocol is mode,timeleft,value;
+    mode: (one of: c,w,e)
+    timeleft: float
+    value: some string, should not be longer than 8 chars or so....
+
+    Example:
+        c,.5,1039;
+
+    Binary payloads are (percent tenths u8, combo u32) for C,
+    (percent tenths u8, wpm u16) for W and
+    (percent tenths u8, max combo u32, max wpm u16) for E
+    """
+
+    mode: str
+    percent_tenths: int
+    value: int
+    second_value: int = 0
+
+    @property
+    def display_value(self) -> str:
+        if self.mode == "e":
+            return f"{self.value}  {self.second_value}"
+        return str(self.value)
+
+    def to_ascii(self) -> str:
+        tenths = self.percent_tenths
+        return f"{self.mode},{tenths // 10}.{tenths % 10},{self.display_value};"
+
+    def to_binary(self) -> bytes:
+        if self.mode == "c":
+            return _COMBO.pack(ord("C"), self.percent_tenths, self.value)
+        if self.mode == "w":
+            return _WPM.pack(ord("W"), self.percent_tenths, min(self.value, 0xFFFF))
+        return _GAME_OVER.pack(
+            ord("E"),
+            self.percent_tenths,
+            self.value,
+            min(self.second_value, 0xFFFF),
+        )
+
+    @staticmethod
+    def from_binary(body: bytes) -> ScreenMessage:
+        if body[0] == ord("C"):
+            _, tenths, value = _COMBO.unpack(body)
+            return ScreenMessage("c", tenths, value)
+        if body[0] == ord("W"):
+            _, tenths, value = _WPM.unpack(body)
+            return ScreenMessage("w", tenths, value)
+        _, tenths, value, second_value = _GAME_OVER.unpack(body)
+        return ScreenMessage("e", tenths, value, second_value)
+
+
+class MatrixRect(NamedTuple):
+    """
+    Binary only, pixels x to x + w - 1 of rows y to y + h - 1 of the matrix,
+    filled row by row from runs of (count u8, color u8) pairs. Colors are RGB
+    3-3-2. See power_mode.matrix.
+
+    Payload is (x u8, y u8, w u8, h u8, number of runs u8) then the runs, so
+    unlike the other frames its length depends on the header.
+    """
+
+    x: int
+    y: int
+    w: int
+    h: int
+    runs: bytes
+
+    def to_ascii(self) -> str:
+        raise ValueError("MatrixRect has no ASCII form, use the BINARY codec")
+
+    def to_binary(self) -> bytes:
+        header = _RECT.pack(
+            ord("R"), self.x, self.y, self.w, self.h, len(self.runs) // 2
+        )
+        return header + self.runs
+
+    @staticmethod
+    def from_binary(body: bytes) -> MatrixRect:
+        _, x, y, w, h, _ = _RECT.unpack_from(body)
+        return MatrixRect(x, y, w, h, bytes(body[_RECT.size :]))
+
+
+class BellMessage(NamedTuple):
+    """
+    ASCII protocol is just on or off for each of the bell relays
+    example: 1010
+
+    Binary payload is a u8 with bit i set when relay i is on
+    """
+
+    relays: Tuple[bool, ...]
+
+    def to_ascii(self) -> str:
+        return "".join(["1" if relay else "0" for relay in self.relays])
+
+    def to_binary(self) -> bytes:
+        return _BELLS.pack(ord("B"), _relay_mask(self.relays))
+
+    @staticmethod
+    def from_binary(body: bytes) -> BellMessage:
+        _, mask = _BELLS.unpack(body)
+        return BellMessage(_relays(mask))
+
+
+class BellPulse(NamedTuple):
+    """
+    Binary only, turns on the relays set for duration_ms each, the firmware
+    turning them off again. Relays not set are left as they are.
+
+    Payload is (relay bitmask u8, duration ms u16)
+    """
+
+    relays: Tuple[bool, ...]
+    duration_ms: int
+
+    def to_ascii(self) -> str:
+        raise ValueError("BellPulse has no ASCII form, use the BINARY codec")
+
+    def to_binary(self) -> bytes:
+        return _PULSE.pack(
+            ord("T"), _relay_mask(self.relays), min(self.duration_ms, 0xFFFF)
+        )
+
+    @staticmethod
+    def from_binary(body: bytes) -> BellPulse:
+        _, mask, duration_ms = _PULSE.unpack(body)
+        return BellPulse(_relays(mask), duration_ms)
+
+
+def _relay_mask(relays: Tuple[bool, ...]) -> int:
+    mask = 0
+    for i, relay in enumerate(relays):
+        if relay:
+            mask |= 1 << i
+    return mask
+
+
+def _relays(mask: int) -> Tuple[bool, ...]:
+    return tuple(bool(mask & (1 << i)) for i in range(4))
+
+
+# The last entry of the strip firmware's colour table is black, to turn
+# pixels off without clearing the whole strip
+STRIP_OFF = 8
+
+
+class StripPixels(NamedTuple):
+    """
+    ASCII protocol is index,color; to light a single pixel or
+    start,color,end; to light pixels start to end (inclusive).
+    color is an index into the firmware's colour table, STRIP_OFF for off.
+
+    Binary payload is (start u8, end u8, color u8)
+    """
+
+    start: int
+    end: int
+    color: int
+
+    def to_ascii(self) -> str:
+        if self.start == self.end:
+            return f"{self.start},{self.color};"
+        return f"{self.start},{self.color},{self.end};"
+
+    def to_binary(self) -> bytes:
+        return _PIXELS.pack(ord("P"), self.start, self.end, self.color)
+
+    @staticmethod
+    def from_binary(body: bytes) -> StripPixels:
+        _, start, end, color = _PIXELS.unpack(body)
+        return StripPixels(start, end, color)
+
+
+class StripClear(NamedTuple):
+    """
+    ASCII protocol is index,e; and turns every pixel off
+
+    Binary has no payload
+    """
+
+    start: int = 0
+
+    def to_ascii(self) -> str:
+        return f"{self.start},e;"
+
+    def to_binary(self) -> bytes:
+        return _CLEAR.pack(ord("X"))
+
+    @staticmethod
+    def from_binary(body: bytes) -> StripClear:
+        return StripClear()
+
+
+class BalloonFanMessage(NamedTuple):
+    """
+    ASCII protocol is balloon,fan; each 1 for on or 0 for off
+    example: 1,0;
+
+    Binary payload is a u8, bit 0 for the balloon and bit 1 for the fan
+    """
+
+    balloon: bool
+    fan: bool
+
+    def to_ascii(self) -> str:
+        return f"{int(self.balloon)},{int(self.fan)};"
+
+    def to_binary(self) -> bytes:
+        return _BALLOON_FAN.pack(ord("F"), int(self.balloon) | int(self.fan) << 1)
+
+    @staticmethod
+    def from_binary(body: bytes) -> BalloonFanMessage:
+        _, bits = _BALLOON_FAN.unpack(body)
+        return BalloonFanMessage(bool(bits & 1), bool(bits & 2))
+
+
+Message = Union[
+    ScreenMessage,
+    MatrixRect,
+    BellMessage,
+    BellPulse,
+    StripPixels,
+    StripClear,
+    BalloonFanMessage,
+]
+
+_COMBO = struct.Struct("<BBI")
+_WPM = struct.Struct("<BBH")
+_GAME_OVER = struct.Struct("<BBIH")
+_RECT = struct.Struct("<BBBBBB")
+_BELLS = struct.Struct("<BB")
+_PULSE = struct.Struct("<BBH")
+_PIXELS = struct.Struct("<BBBB")
+_CLEAR = struct.Struct("<B")
+_BALLOON_FAN = struct.Struct("<BB")
+
+# Frame type byte -> (message class, body size including the type byte). For
+# MatrixRect that's the header, the runs follow.
+_BINARY_TYPES: Dict[int, Tuple[Type[NamedTuple], int]] = {
+    ord("C"): (ScreenMessage, _COMBO.size),
+    ord("W"): (ScreenMessage, _WPM.size),
+    ord("E"): (ScreenMessage, _GAME_OVER.size),
+    ord("R"): (MatrixRect, _RECT.size),
+    ord("B"): (BellMessage, _BELLS.size),
+    ord("T"): (BellPulse, _PULSE.size),
+    ord("P"): (StripPixels, _PIXELS.size),
+    ord("X"): (StripClear, _CLEAR.size),
+    ord("F"): (BalloonFanMessage, _BALLOON_FAN.size),
+}
+
+
+class Codec:
+    def encode(self, message: Message) -> bytes:
+        raise NotImplementedError()
+
+
+class AsciiCodec(Codec):
+    """
+    The original text protocol, see each message for its format
+    """
+
+    def encode(self, message: Message) -> bytes:
+        return message.to_ascii().encode("utf-8")
+
+
+class BinaryCodec(Codec):
+    """
+    Frames are a type byte, a fixed width little endian payload that depends
+    on the type, then a checksum byte: the sum of the other bytes mod 256.
+
+    Type bytes are upper case letters, which never start an ASCII message,
+    so the firmware can accept either protocol without being told.
+    """
+
+    def encode(self, message: Message) -> bytes:
+        body = message.to_binary()
+        return body + bytes((sum(body) & 0xFF,))
+
+
+class BinaryDecoder:
+    """
+    Reference decoder for BinaryCodec frames, following the same rules as the
+    firmware: bytes that aren't a known type are skipped and a frame with a bad
+    checksum is thrown away whole.
+    """
+
+    def __init__(self) -> None:
+        self.bad_frames = 0
+        self.skipped_bytes = 0
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Message]:
+        buffer = self._buffer
+        buffer.extend(data)
+        messages: List[Message] = []
+        while buffer:
+            frame_type = _BINARY_TYPES.get(buffer[0])
+            if frame_type is None:
+                del buffer[0]
+                self.skipped_bytes += 1
+                continue
+            message_class, body_size = frame_type
+            if message_class is MatrixRect:
+                if len(buffer) < body_size:
+                    break
+                body_size += 2 * buffer[body_size - 1]
+            if len(buffer) < body_size + 1:
+                break
+            body = bytes(buffer[:body_size])
+            checksum = buffer[body_size]
+            del buffer[: body_size + 1]
+            if sum(body) & 0xFF != checksum:
+                self.bad_frames += 1
+                continue
+            messages.append(message_class.from_binary(body))  # type: ignore
+        return messages
+
+
+ASCII = AsciiCodec()
+BINARY = BinaryCodec()
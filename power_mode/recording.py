@@ -0,0 +1,292 @@
+"""
+Record the key presses and ticks a GameManager sees, and play them back.
+
+A log is a short header followed by fixed size events: the seconds since
+recording started (f64) and one byte for the kind of event. Only the class of
+key the game cares about is kept, never what was typed. The header holds the
+Setup the session was played with, so a replay builds the same controllers.
+
+    python -m power_mode.main --record session.pmrec
+    python -m power_mode.recording session.pmrec --speed 10
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import struct
+import sys
+import threading
+from collections import deque
+from time import monotonic, sleep
+from typing import (
+    IO,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from power_mode.clock import Clock, VirtualClock
+from power_mode.controllers import (
+    AnimatedStripController,
+    BalloonFanController,
+    BellController,
+    PulsedBellController,
+    RenderedScreenController,
+    ScreenController,
+    SerialOutputController,
+    StripController,
+)
+from power_mode.core import GameManager
+from power_mode.keys import Key, is_backspace
+from power_mode.memory_serial import MemorySerial
+from power_mode.protocol import ASCII, BINARY
+
+MAGIC = b"PMREC\x02"
+# Logs from before the header had a Setup, played with the defaults
+MAGIC_V1 = b"PMREC\x01"
+_SETUP_SIZE = struct.Struct("<H")
+
+KEY = b"K"
+BACKSPACE = b"B"
+TICK = b"T"
+
+_EVENT = struct.Struct("<dc")
+# Stands in for every key that isn't a backspace when replaying
+REPLAY_KEY = Key.OTHER
+
+
+class Event(NamedTuple):
+    # Seconds since recording started
+    offset: float
+    kind: bytes
+
+    @property
+    def key(self) -> Key:
+        return Key.BACKSPACE if self.kind == BACKSPACE else REPLAY_KEY
+
+
+def key_kind(key) -> bytes:
+    return BACKSPACE if is_backspace(key) else KEY
+
+
+_CONTROLLERS = {
+    controller_class.__name__: controller_class
+    for controller_class in (
+        ScreenController,
+        RenderedScreenController,
+        BellController,
+        PulsedBellController,
+        StripController,
+        AnimatedStripController,
+        BalloonFanController,
+    )
+}
+_CODECS = {"ascii": ASCII, "binary": BINARY}
+
+
+class Setup(NamedTuple):
+    """
+    What a session's controller output depends on besides its events: the
+    controllers connected when recording started, in order, as (class name,
+    codec name, baud rate or 0) and GameManager's coalesce_window
+    """
+
+    controllers: Tuple[Tuple[str, str, int], ...] = (
+        ("ScreenController", "ascii", 0),
+        ("BellController", "ascii", 0),
+        ("StripController", "ascii", 0),
+        ("BalloonFanController", "ascii", 0),
+    )
+    coalesce_window: float = 0.0
+
+    @staticmethod
+    def of(manager: GameManager) -> Setup:
+        return Setup(
+            tuple(_describe(controller) for controller in manager.serial_controllers),
+            manager.coalesce_window,
+        )
+
+    def memory_manager(self, clock: Clock) -> GameManager:
+        """
+        A GameManager like the recorded one, on in-memory devices
+        """
+        return GameManager(
+            [
+                _CONTROLLERS[name](MemorySerial(baudrate or None), _CODECS[codec])
+                for name, codec, baudrate in self.controllers
+            ],
+            clock,
+            coalesce_window=self.coalesce_window,
+        )
+
+    def encode(self) -> bytes:
+        data = json.dumps(self._asdict()).encode()
+        return _SETUP_SIZE.pack(len(data)) + data
+
+    @staticmethod
+    def decode(data: bytes) -> Setup:
+        fields = json.loads(data)
+        return Setup(
+            tuple(tuple(controller) for controller in fields["controllers"]),
+            fields["coalesce_window"],
+        )
+
+
+def _describe(controller: SerialOutputController) -> Tuple[str, str, int]:
+    baudrate = getattr(controller.serial_connection, "baudrate", None)
+    return (
+        type(controller).__name__,
+        "binary" if controller.codec is BINARY else "ascii",
+        baudrate if isinstance(baudrate, int) else 0,
+    )
+
+
+class SessionRecorder:
+    """
+    Collects events in memory and appends them to the log from its own thread
+    every FLUSH_INTERVAL, so the key and tick paths never touch the disk.
+
+    Give it the GameManager's clock, events are stamped with the time the
+    manager passes in, and its Setup.of(manager) so replays match.
+    """
+
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path: str, clock: Clock = monotonic, setup: Setup = Setup()):
+        self.path = path
+        self.clock = clock
+        self.setup = setup
+        self.events_written = 0
+        self._start = clock()
+        # Appended to from the key and tick paths, drained by the thread
+        self._pending: Deque[bytes] = deque()
+        self._stopped = threading.Event()
+        self._file: IO[bytes] = open(path, "wb")
+        self._file.write(MAGIC + setup.encode())
+        self._thread = threading.Thread(
+            target=self._run, name="power-mode-recorder", daemon=True
+        )
+        self._thread.start()
+
+    def key_down(self, key, now: Optional[float] = None) -> None:
+        if now is None:
+            now = self.clock()
+        self._pending.append(_EVENT.pack(now - self._start, key_kind(key)))
+
+    def tick(self, now: Optional[float] = None) -> None:
+        if now is None:
+            now = self.clock()
+        self._pending.append(_EVENT.pack(now - self._start, TICK))
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        self._file.close()
+
+    def _flush(self) -> None:
+        # deque appends and pops are thread safe, events recorded while
+        # draining go in this write or the next, never nowhere
+        pending = self._pending
+        events: List[bytes] = []
+        while pending:
+            events.append(pending.popleft())
+        if events:
+            self._file.write(b"".join(events))
+            self._file.flush()
+            self.events_written += len(events)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.FLUSH_INTERVAL):
+            self._flush()
+        self._flush()
+
+
+def read_recording(path: str) -> Tuple[Setup, Iterator[Event]]:
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic == MAGIC:
+            (size,) = _SETUP_SIZE.unpack(f.read(_SETUP_SIZE.size))
+            setup = Setup.decode(f.read(size))
+        elif magic == MAGIC_V1:
+            setup = Setup()
+        else:
+            raise ValueError(f"{path} is not a power mode recording")
+        data = f.read()
+    return setup, _events(data)
+
+
+def read_events(path: str) -> Iterator[Event]:
+    setup, events = read_recording(path)
+    return events
+
+
+def _events(data: bytes) -> Iterator[Event]:
+    # A recording cut off mid write can end in a partial event
+    usable = len(data) - len(data) % _EVENT.size
+    for offset, kind in _EVENT.iter_unpack(data[:usable]):
+        yield Event(offset, kind)
+
+
+def replay(
+    events: Iterable[Event],
+    make_manager: Callable[[Clock], GameManager],
+    speed: Optional[float] = None,
+) -> GameManager:
+    """
+    Feed recorded events through a new GameManager.
+
+    The game runs on a virtual clock set to each event's recorded time, so the
+    state changes and controller output match the original session whatever
+    the speed. speed=1 replays in real time, 10 ten times as fast and None as
+    fast as possible. make_manager is given the virtual clock to build the
+    manager with.
+
+    The strip picks colours at random, seed the random module before recording
+    and replaying to get the same colours.
+    """
+    clock = VirtualClock()
+    start = clock.now
+    manager = make_manager(clock)
+    previous = 0.0
+    for event in events:
+        if speed and event.offset > previous:
+            sleep((event.offset - previous) / speed)
+        previous = event.offset
+        clock.now = start + event.offset
+        if event.kind == TICK:
+            manager.trigger_tick()
+        else:
+            manager.trigger_key_down(event.key)
+    return manager
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay a recording against in-memory devices"
+    )
+    parser.add_argument("path")
+    parser.add_argument(
+        "--speed", type=float, help="1 for real time (default: as fast as possible)"
+    )
+    args = parser.parse_args(argv)
+
+    setup, recorded = read_recording(args.path)
+    events = list(recorded)
+    manager = replay(events, setup.memory_manager, args.speed)
+    keys = sum(1 for event in events if event.kind != TICK)
+    duration = events[-1].offset if events else 0.0
+    print(f"{keys} keys and {len(events) - keys} ticks over {duration:.1f}s")
+    print(f"max combo {manager.game_state.max_combo}")
+    for controller in manager.serial_controllers:
+        serial_connection = controller.serial_connection
+        print(f"  {type(controller).__name__:<22}{serial_connection.bytes:8d} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import heapq
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Sequence, overload
+
+
+class RollingMedian(Sequence[int]):
+    """
+    Bounded window of ints that keeps its median up to date as values come and go.
+
+    Values are split across two heaps: a max-heap holding the lower half and a
+    min-heap holding the upper half. Evicted values are deleted lazily, they are
+    only popped once they surface at the top of a heap. Appending (and the
+    eviction it may cause) is O(log n) and reading the median is O(1).
+
+    The median matches math.floor(statistics.median(values)), or 0 when empty.
+    """
+
+    __slots__ = (
+        "maxlen",
+        "_window",
+        "_low",
+        "_high",
+        "_low_size",
+        "_high_size",
+        "_pending_removal",
+        "_median",
+    )
+
+    def __init__(self, values: Iterable[int] = (), maxlen: int = 100):
+        self.maxlen = maxlen
+        self._window: Deque[int] = deque()
+        self._low: List[int] = []  # negated so heapq gives us a max-heap
+        self._high: List[int] = []
+        self._low_size = 0
+        self._high_size = 0
+        self._pending_removal: Dict[int, int] = {}
+        self._median = 0
+        for value in values:
+            self.append(value)
+
+    @property
+    def median(self) -> int:
+        return self._median
+
+    def append(self, value: int) -> None:
+        if len(self._window) == self.maxlen:
+            self._remove(self._window.popleft())
+        self._window.append(value)
+        self._insert(value)
+        self._median = self._compute_median()
+
+    def clear(self) -> None:
+        self._window.clear()
+        self._low.clear()
+        self._high.clear()
+        self._low_size = 0
+        self._high_size = 0
+        self._pending_removal.clear()
+        self._median = 0
+
+    def copy(self) -> RollingMedian:
+        new = RollingMedian(maxlen=self.maxlen)
+        new._window = self._window.copy()
+        new._low = self._low.copy()
+        new._high = self._high.copy()
+        new._low_size = self._low_size
+        new._high_size = self._high_size
+        new._pending_removal = self._pending_removal.copy()
+        new._median = self._median
+        return new
+
+    def _insert(self, value: int) -> None:
+        if not self._low or value <= -self._low[0]:
+            heapq.heappush(self._low, -value)
+            self._low_size += 1
+        else:
+            heapq.heappush(self._high, value)
+            self._high_size += 1
+        self._rebalance()
+
+    def _remove(self, value: int) -> None:
+        self._pending_removal[value] = self._pending_removal.get(value, 0) + 1
+        if value <= -self._low[0]:
+            self._low_size -= 1
+            if value == -self._low[0]:
+                self._prune(self._low, -1)
+        else:
+            self._high_size -= 1
+            if value == self._high[0]:
+                self._prune(self._high, 1)
+        self._rebalance()
+
+    def _rebalance(self) -> None:
+        if self._low_size > self._high_size + 1:
+            heapq.heappush(self._high, -heapq.heappop(self._low))
+            self._low_size -= 1
+            self._high_size += 1
+            self._prune(self._low, -1)
+        elif self._low_size < self._high_size:
+            heapq.heappush(self._low, -heapq.heappop(self._high))
+            self._low_size += 1
+            self._high_size -= 1
+            self._prune(self._high, 1)
+
+    def _prune(self, heap: List[int], sign: int) -> None:
+        while heap:
+            value = heap[0] * sign
+            pending = self._pending_removal.get(value)
+            if not pending:
+                return
+            if pending == 1:
+                del self._pending_removal[value]
+            else:
+                self._pending_removal[value] = pending - 1
+            heapq.heappop(heap)
+
+    def _compute_median(self) -> int:
+        if not self._low_size:
+            return 0
+        if self._low_size > self._high_size:
+            return -self._low[0]
+        return (-self._low[0] + self._high[0]) // 2
+
+    @overload
+    def __getitem__(self, index: int) -> int:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[int]:
+        ...
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            return list(self._window)[index]
+        return self._window[index]
+
+    def __len__(self) -> int:
+        return len(self._window)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._window)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RollingMedian):
+            return self._window == other._window
+        if isinstance(other, (list, tuple)):
+            return list(self._window) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self) -> str:
+        return repr(list(self._window))
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import threading
+from time import monotonic
+from typing import TYPE_CHECKING, Optional, Union
+
+if TYPE_CHECKING:
+    import asyncio
+
+    from power_mode.core import GameManager
+    from power_mode.sessions import SessionManager
+
+
+class _DeadlineScheduler:
+    # Lower bound between ticks so a deadline that keeps landing in the past
+    # can't spin the scheduler
+    MIN_TICK_INTERVAL = 0.01
+
+    def __init__(self, manager: Union[GameManager, SessionManager]):
+        self.manager = manager
+        self.ticks = 0
+        self._last_tick = 0.0
+
+    def seconds_until_next_tick(self) -> Optional[float]:
+        deadline = self.manager.next_deadline()
+        if deadline is None:
+            return None
+        return max(
+            deadline - self.manager.clock(),
+            self.MIN_TICK_INTERVAL - (monotonic() - self._last_tick),
+        )
+
+    def _tick(self) -> None:
+        self._last_tick = monotonic()
+        self.ticks += 1
+        self.manager.trigger_tick()
+
+
+class TickScheduler(_DeadlineScheduler):
+    """
+    Drives GameManager ticks from a single long lived thread.
+
+    Rather than ticking on a fixed interval it asks the manager for the next
+    deadline (combo timeout, a bell turning off, the screen changing) and sleeps
+    until then. With nothing going on it sleeps until the next key press.
+    """
+
+    def __init__(self, manager: Union[GameManager, SessionManager]):
+        super().__init__(manager)
+        self._stopped = False
+        self._wakeup = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="power-mode-ticks", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def trigger_key_down(self, *event) -> None:
+        """
+        Takes the same arguments as the manager's trigger_key_down, a key or
+        for a SessionManager the source and the key
+        """
+        self.manager.trigger_key_down(*event)
+        # The key press moved the deadlines, have the tick thread look again
+        self.wake()
+
+    def wake(self) -> None:
+        """
+        Recheck deadlines, call after anything outside a tick changes them
+        """
+        self._wakeup.set()
+
+    def _run(self) -> None:
+        while True:
+            self._tick()
+            while True:
+                self._wakeup.clear()
+                if self._stopped:
+                    return
+                delay = self.seconds_until_next_tick()
+                if delay is not None and delay <= 0:
+                    break
+                self._wakeup.wait(delay)
+
+
+class AsyncTickScheduler(_DeadlineScheduler):
+    """
+    The asyncio version of TickScheduler, for running the game inside an event
+    loop without the keyboard listener thread. Await run() in a task and feed
+    key presses to trigger_key_down from the same loop.
+    """
+
+    def __init__(self, manager: Union[GameManager, SessionManager]):
+        super().__init__(manager)
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def trigger_key_down(self, *event) -> None:
+        self.manager.trigger_key_down(*event)
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def run(self) -> None:
+        # Imported here so the threaded scheduler doesn't pay for asyncio
+        import asyncio
+
+        wakeup = self._wakeup = asyncio.Event()
+        while True:
+            self._tick()
+            while True:
+                wakeup.clear()
+                delay = self.seconds_until_next_tick()
+                if delay is not None and delay <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from time import sleep
+from typing import TYPE_CHECKING, Callable, Deque, Dict, Optional, Tuple
+
+if TYPE_CHECKING:
+    from serial import Serial
+
+    from power_mode.flow_control import Credits
+
+
+class SerialWriter:
+    """
+    Writes frames to a serial connection from its own thread so a slow or
+    stalled device never holds up the keyboard callback or other devices.
+
+    Frames wait in a bounded queue. A coalescing writer only ever keeps the
+    newest frame, for devices where only the latest state matters. Otherwise
+    frames go out in order and the oldest is dropped if the queue fills up.
+
+    With credits, each write first waits for the device to have room for it
+    instead of sleeping for pacing.
+    """
+
+    def __init__(
+        self,
+        serial_connection: Serial,
+        name: str,
+        coalesce: bool,
+        pacing: float = 0.0,
+        maxsize: int = 64,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        credits: Optional[Credits] = None,
+    ):
+        self.serial_connection = serial_connection
+        self.name = name
+        self.coalesce = coalesce
+        self.pacing = pacing
+        self.maxsize = maxsize
+        self.on_error = on_error
+        self.credits = credits
+        self.frames_written = 0
+        self.bytes_written = 0
+        self.frames_dropped = 0
+        self.write_errors = 0
+        # (data, number of frames in it)
+        self._frames: Deque[Tuple[bytes, int]] = deque()
+        self._writing = False
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name=f"power-mode-writer-{name}", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._frames)
+
+    def submit(self, frame: bytes, frames: int = 1) -> None:
+        with self._condition:
+            if self.coalesce and self._frames:
+                self.frames_dropped += len(self._frames)
+                self._frames.clear()
+            elif len(self._frames) >= self.maxsize:
+                self._frames.popleft()
+                self.frames_dropped += 1
+            self._frames.append((frame, frames))
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queue_depth": self.queue_depth,
+            "frames_written": self.frames_written,
+            "bytes_written": self.bytes_written,
+            "frames_dropped": self.frames_dropped,
+            "write_errors": self.write_errors,
+        }
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for everything queued so far to be written
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._frames and not self._writing, timeout
+            )
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._frames or self._stopped)
+                if not self._frames:
+                    return
+                frame, frames = self._frames.popleft()
+                self._writing = True
+            try:
+                if self.credits:
+                    self.credits.acquire(len(frame), frames)
+                self.serial_connection.write(frame)
+            except OSError as e:
+                # SerialException is an OSError, keep going and let the
+                # device come back rather than killing the thread
+                self.write_errors += 1
+                if self.on_error:
+                    self.on_error(e)
+                else:
+                    print(f"Write to {self.name} failed: {e}")
+            else:
+                self.frames_written += 1
+                self.bytes_written += len(frame)
+            if self.pacing and not self.credits:
+                sleep(self.pacing)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import heapq
+import itertools
+import threading
+from time import monotonic
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from power_mode.clock import Clock
+from power_mode.controllers import SerialOutputController
+from power_mode.core import GameManager
+
+
+class SessionManager:
+    """
+    Several independent games on one host, eg. a contest with a keyboard and
+    a set of displays per player. Each input source gets its own GameManager,
+    so its own GameState and controllers.
+
+    One scheduler drives them all: SessionManager has the same next_deadline()
+    and trigger_tick() as a GameManager, so it can be handed to TickScheduler.
+    Each session's next deadline is kept in a heap, a key press only
+    reschedules the session it was for and a tick only ticks the sessions that
+    are due. Neither costs more with more players, bar the log n of the heap.
+    """
+
+    def __init__(self, clock: Optional[Clock] = None):
+        self.clock: Clock = clock if clock else monotonic
+        self.sessions: Dict[Hashable, GameManager] = {}
+        # (deadline, sequence, source), an entry is stale once the source has
+        # been rescheduled with a newer sequence number
+        self._deadlines: List[Tuple[float, int, Hashable]] = []
+        self._scheduled: Dict[Hashable, int] = {}
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def add_session(
+        self, source: Hashable, controllers: List[SerialOutputController]
+    ) -> GameManager:
+        manager = GameManager(controllers, self.clock)
+        with self._lock:
+            self.sessions[source] = manager
+            # Ticked straight away to put the displays in their start state
+            self._schedule(source, self.clock())
+        return manager
+
+    def remove_session(self, source: Hashable) -> Optional[GameManager]:
+        with self._lock:
+            self._scheduled.pop(source, None)
+            return self.sessions.pop(source, None)
+
+    def trigger_key_down(self, source: Hashable, key) -> None:
+        """
+        Key presses from a source without a session are ignored, eg. a
+        keyboard that isn't playing
+        """
+        manager = self.sessions.get(source)
+        if manager is None:
+            return
+        manager.trigger_key_down(key)
+        self._reschedule(source, manager)
+
+    def trigger_tick(self) -> None:
+        now = self.clock()
+        due = []
+        with self._lock:
+            deadlines = self._deadlines
+            while deadlines and deadlines[0][0] <= now:
+                _, sequence, source = heapq.heappop(deadlines)
+                if self._scheduled.get(source) == sequence:
+                    del self._scheduled[source]
+                    due.append(source)
+        for source in due:
+            manager = self.sessions.get(source)
+            if manager is not None:
+                manager.trigger_tick()
+                self._reschedule(source, manager)
+
+    def next_deadline(self) -> Optional[float]:
+        with self._lock:
+            deadlines = self._deadlines
+            while deadlines:
+                _, sequence, source = deadlines[0]
+                if self._scheduled.get(source) == sequence:
+                    return deadlines[0][0]
+                heapq.heappop(deadlines)
+        return None
+
+    def _reschedule(self, source: Hashable, manager: GameManager) -> None:
+        # The deadline is read under the lock, so when a tick and a key press
+        # for the same session race the one scheduled last saw both
+        with self._lock:
+            if source not in self.sessions:
+                return
+            deadline = manager.next_deadline()
+            if deadline is None:
+                self._scheduled.pop(source, None)
+            else:
+                self._schedule(source, deadline)
+
+    def _schedule(self, source: Hashable, deadline: float) -> None:
+        sequence = next(self._sequence)
+        self._scheduled[source] = sequence
+        heapq.heappush(self._deadlines, (deadline, sequence, source))
+        if len(self._deadlines) > 4 * len(self._scheduled) + 64:
+            # Stale entries only leave the heap as their deadline passes, key
+            # presses can pile them up faster than that
+            self._deadlines = [
+                entry
+                for entry in self._deadlines
+                if self._scheduled.get(entry[2]) == entry[1]
+            ]
+            heapq.heapify(self._deadlines)
@@ -0,0 +1,666 @@
+"""
+Simulated microcontrollers on pseudo-terminals, to load test the serial path
+without the hardware on the desk.
+
+Each firmware class is a port of the parser in its sketch (bells/bells.ino,
+strip/strip.ino and combodisplay/combodisplay.ino), quirks included, and keeps
+the state the board would show. A SimulatedDevice puts one on a pty that
+pyserial opens like the real port. Bytes reach the firmware no faster than the
+baud rate allows, through a receive buffer the size of the board's, which
+overflows if the sketch is busy (strip.show() for instance) for too long.
+
+    python -m power_mode.simulator --baud 9600 --baud 115200
+
+plays a benchmark profile through the real controllers and background writers
+into simulated devices and reports what each device received and lost.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import select
+import threading
+import tty
+from collections import deque
+from time import monotonic, sleep
+from typing import Deque, Dict, List, Optional, Sequence, Tuple, Type
+
+from power_mode.clock import Clock
+from power_mode.controllers import (
+    BellController,
+    ScreenController,
+    SerialOutputController,
+    StripController,
+)
+from power_mode.devices import DeviceRegistry, DeviceSpec
+from power_mode.matrix import apply_rect, render_page
+from power_mode.protocol import (
+    ACK,
+    ASCII,
+    BINARY,
+    FLOW_CONTROL,
+    READY,
+    READY_QUERY,
+    STRIP_OFF,
+    Codec,
+    MatrixRect,
+)
+
+_INT = re.compile(r"\s*[-+]?\d+")
+_FLOAT = re.compile(r"\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?")
+
+
+def _to_int(text: str) -> int:
+    # Arduino's String.toInt(), the leading number or 0
+    match = _INT.match(text)
+    return int(match.group()) if match else 0
+
+
+def _to_float(text: str) -> float:
+    # Arduino's String.toFloat()
+    match = _FLOAT.match(text)
+    return float(match.group()) if match else 0.0
+
+
+class Firmware:
+    """
+    A sketch's serial parser, fed a byte at a time the way its getData() loop
+    reads them
+    """
+
+    # Bytes of serial receive buffer on the board, more than that is lost
+    RX_BUFFER_SIZE = 64
+    # Seconds from reset (which opening the port does on an Uno) until the
+    # sketch first reads serial
+    BOOT_TIME = 0.0
+    # Seconds the sketch spends acting on a command rather than reading
+    EXECUTE_TIME = 0.0
+    # Binary frame type byte -> frame length including the checksum
+    BINARY_FRAME_LENGTHS: Dict[int, int] = {}
+
+    def __init__(self) -> None:
+        self.commands = 0
+        self.bad_frames = 0
+        # Bytes written back to the host
+        self.output = bytearray()
+        # Whether the host asked for acks
+        self.acking = False
+        self._binary_frame = bytearray()
+
+    def setup_done(self) -> None:
+        self.output += READY
+
+    def feed(self, byte: int) -> bool:
+        """
+        Hand the sketch one byte, True if that completed a command
+        """
+        if not self._binary_frame:
+            if byte == READY_QUERY[0]:
+                self.output += READY
+                return False
+            if byte == FLOW_CONTROL[0]:
+                self.acking = True
+                self.output += FLOW_CONTROL
+                self.output += self.RX_BUFFER_SIZE.to_bytes(2, "little")
+                return False
+        if self._read(byte):
+            self._acknowledge()
+            return True
+        return False
+
+    def _acknowledge(self) -> None:
+        if self.acking:
+            self.output += ACK
+
+    def _read(self, byte: int) -> bool:
+        raise NotImplementedError()
+
+    def execute_time(self) -> float:
+        """
+        Seconds the last command took to act on
+        """
+        return self.EXECUTE_TIME
+
+    def _frame_length(self, frame: bytearray) -> int:
+        return self.BINARY_FRAME_LENGTHS[frame[0]]
+
+    def _reading_binary(self, byte: int) -> bool:
+        return bool(self._binary_frame) or byte in self.BINARY_FRAME_LENGTHS
+
+    def _read_binary(self, byte: int) -> Optional[bytes]:
+        """
+        readBinary() from the sketches, the whole frame once it has arrived
+        with a good checksum
+        """
+        frame = self._binary_frame
+        frame.append(byte)
+        if len(frame) < self._frame_length(frame):
+            return None
+        complete = bytes(frame)
+        frame.clear()
+        # A bad checksum throws the whole frame away
+        if sum(complete[:-1]) & 0xFF != complete[-1]:
+            self.bad_frames += 1
+            self._acknowledge()
+            return None
+        return complete
+
+
+class BellsFirmware(Firmware):
+    """
+    bells/bells.ino, four relays set by 4 characters of 1 or 0 or a 'B'
+    frame, or pulsed by a 'T' frame. The sketch turns a pulsed relay off
+    again by itself, pulse_ms keeps each relay's last pulse (0 once set
+    otherwise) rather than timing it here.
+    """
+
+    BOOT_TIME = 2.0
+    BINARY_FRAME_LENGTHS = {ord("B"): 3, ord("T"): 5}
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.relays = [False] * 4
+        self.pulse_ms = [0] * 4
+        self._params = [False] * 4
+        self._index = 0
+
+    def _read(self, byte: int) -> bool:
+        if self._reading_binary(byte):
+            frame = self._read_binary(byte)
+            if frame is None:
+                return False
+            if frame[0] == ord("T"):
+                duration_ms = int.from_bytes(frame[2:4], "little")
+                for i in range(4):
+                    if frame[1] & (1 << i):
+                        self._params[i] = True
+                        self.pulse_ms[i] = duration_ms
+            else:
+                self._params = [bool(frame[1] & (1 << i)) for i in range(4)]
+                self.pulse_ms = [0] * 4
+            return self._execute()
+        # Anything that isn't a 1, newlines included, turns a relay off
+        self._params[self._index] = byte == ord("1")
+        self.pulse_ms[self._index] = 0
+        self._index += 1
+        if self._index == 4:
+            return self._execute()
+        return False
+
+    def _execute(self) -> bool:
+        self.relays = list(self._params)
+        self._index = 0
+        self.commands += 1
+        return True
+
+
+# COLOR_ARRAY from strip.ino as (red, green, blue)
+STRIP_COLORS = [
+    (0, 255, 0),
+    (255, 0, 0),
+    (255, 80, 0),
+    (255, 255, 0),
+    (0, 0, 255),
+    (75, 0, 130),
+    (238, 130, 238),
+    (0, 255, 60),
+    (0, 0, 0),
+]
+
+
+class StripFirmware(Firmware):
+    """
+    strip/strip.ino, 144 pixels each off (None) or an index into STRIP_COLORS
+    """
+
+    LED_COUNT = 144
+    # strip.show() clocks 32 bits a pixel out at 800kHz, then latches
+    EXECUTE_TIME = LED_COUNT * 32 / 800_000 + 0.00008
+    BINARY_FRAME_LENGTHS = {ord("P"): 5, ord("X"): 2}
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.pixels: List[Optional[int]] = [None] * self.LED_COUNT
+        # index, color mode and end index
+        self._params = ["", "", ""]
+        self._param = 0
+
+    def _read(self, byte: int) -> bool:
+        if self._reading_binary(byte):
+            frame = self._read_binary(byte)
+            if frame is None:
+                return False
+            if frame[0] == ord("X"):
+                self._clear()
+            else:
+                self._light(frame[1], frame[2], frame[3])
+            return self._execute()
+        char = chr(byte)
+        if char == ";":
+            index, color, end = self._params
+            if color == "e":
+                self._clear()
+            elif end:
+                self._light(_to_int(index), _to_int(end), _to_int(color))
+            else:
+                self._set_pixel(_to_int(index), _to_int(color))
+            return self._execute()
+        if char == ",":
+            self._param += 1
+        else:
+            # Fields past the third land in the index, as in the sketch
+            field = self._param if self._param in (1, 2) else 0
+            self._params[field] += char
+        return False
+
+    def _clear(self) -> None:
+        self.pixels = [None] * self.LED_COUNT
+
+    def _light(self, start: int, end: int, color: int) -> None:
+        for i in range(start, min(end, self.LED_COUNT - 1) + 1):
+            self._set_pixel(i, color)
+
+    def _set_pixel(self, index: int, color: int) -> None:
+        # setPixelColor ignores pixels off the end of the strip
+        if 0 <= index < self.LED_COUNT:
+            self.pixels[index] = None if color == STRIP_OFF else color
+
+    def _execute(self) -> bool:
+        self._params = ["", "", ""]
+        self._param = 0
+        self.commands += 1
+        return True
+
+
+class ComboDisplayFirmware(Firmware):
+    """
+    combodisplay/combodisplay.ino, keeping what drawPage() was last asked to
+    draw and the matrix's pixels, drawn by power_mode.matrix for pages
+    """
+
+    # The Metro M4's SAMD core has a bigger buffer than an Uno
+    RX_BUFFER_SIZE = 350
+    BOOT_TIME = 2.0
+    # Estimate of drawPage() clearing and redrawing the 64x32 panel
+    EXECUTE_TIME = 0.002
+    # And of blitting a MatrixRect, a drawPixel() each
+    RECT_TIME_PER_PIXEL = 0.000001
+    BINARY_FRAME_LENGTHS = {ord("C"): 7, ord("W"): 5, ord("E"): 9, ord("R"): 7}
+
+    MODES = {"c": "COMBO", "e": "MAXC MAXW"}
+
+    def __init__(self) -> None:
+        super().__init__()
+        # setup() draws a zero combo
+        self.mode = "COMBO"
+        self.value = "0"
+        self.percent = 1.0
+        self.pixels = render_page("c", "0", 1.0)
+        self._execute_time = self.EXECUTE_TIME
+        self._mode = "s"
+        self._percent = ""
+        self._value = ""
+        self._param = 0
+
+    def _read(self, byte: int) -> bool:
+        if self._reading_binary(byte):
+            frame = self._read_binary(byte)
+            if frame is None:
+                return False
+            if frame[0] == ord("R"):
+                rect = MatrixRect.from_binary(frame[:-1])
+                apply_rect(self.pixels, rect)
+                self._execute_time = rect.w * rect.h * self.RECT_TIME_PER_PIXEL
+                self.commands += 1
+                self._reset()
+                return True
+            if frame[0] == ord("C"):
+                self._draw("c", int.from_bytes(frame[2:6], "little"), frame[1] / 10)
+            elif frame[0] == ord("W"):
+                self._draw("w", int.from_bytes(frame[2:4], "little"), frame[1] / 10)
+            else:
+                max_combo = int.from_bytes(frame[2:6], "little")
+                max_wpm = int.from_bytes(frame[6:8], "little")
+                self._draw("e", f"{max_combo}  {max_wpm}", frame[1] / 10)
+            return True
+        char = chr(byte)
+        if char == ";":
+            self._draw(self._mode, self._value, _to_float(self._percent))
+            return True
+        if char == ",":
+            self._param += 1
+        elif self._param == 2:
+            self._value += char
+        elif self._param == 1:
+            self._percent += char
+        else:
+            self._mode = char
+        return False
+
+    def _draw(self, mode: str, value: object, percent: float) -> None:
+        # Anything other than c or e shows the WPM page
+        self.mode = self.MODES.get(mode, "WPM")
+        self.value = str(value)
+        self.percent = percent
+        self.pixels = render_page(mode, self.value, percent)
+        self._execute_time = self.EXECUTE_TIME
+        self.commands += 1
+        self._reset()
+
+    def execute_time(self) -> float:
+        return self._execute_time
+
+    def _frame_length(self, frame: bytearray) -> int:
+        # A rect's run count, the header's last byte, says how long it is
+        if frame[0] == ord("R") and len(frame) >= 6:
+            return 6 + 2 * frame[5] + 1
+        return super()._frame_length(frame)
+
+    def _reset(self) -> None:
+        self._mode = "s"
+        self._percent = ""
+        self._value = ""
+        self._param = 0
+
+
+class SerialLine:
+    """
+    The board's end of a serial line: bytes take 10 bit times each to arrive
+    (start, 8 data and stop bits) and wait in the receive buffer until the
+    firmware reads them, which it doesn't while booting or executing a command.
+    A byte arriving to a full buffer is lost.
+
+    Times are passed in, so this runs as fast as you like in tests.
+    """
+
+    def __init__(
+        self,
+        firmware: Firmware,
+        baudrate: int = 9600,
+        now: float = 0.0,
+        boot: bool = True,
+    ):
+        self.firmware = firmware
+        self.baudrate = baudrate
+        self.byte_time = 10 / baudrate
+        self.bytes_received = 0
+        self.bytes_dropped = 0
+        self.busy_until = now + (firmware.BOOT_TIME if boot else 0.0)
+        self._setup_pending = True
+        self.line_free_at = now
+        self._rx: Deque[Tuple[float, int]] = deque()
+
+    @property
+    def rx_waiting(self) -> int:
+        return len(self._rx)
+
+    def receive(self, data: bytes, now: float) -> float:
+        """
+        Send data down the line at now, after anything still on the wire.
+        Returns when the last byte arrives.
+        """
+        arrival = max(now, self.line_free_at)
+        rx = self._rx
+        rx_buffer_size = self.firmware.RX_BUFFER_SIZE
+        for byte in data:
+            arrival += self.byte_time
+            self.run_until(arrival)
+            self.bytes_received += 1
+            if len(rx) >= rx_buffer_size:
+                self.bytes_dropped += 1
+            else:
+                rx.append((arrival, byte))
+        self.run_until(arrival)
+        self.line_free_at = arrival
+        return arrival
+
+    def run_until(self, now: float) -> None:
+        """
+        Let the firmware read what it would have by now
+        """
+        rx = self._rx
+        firmware = self.firmware
+        if self._setup_pending and now >= self.busy_until:
+            firmware.setup_done()
+            self._setup_pending = False
+        while rx:
+            arrival, byte = rx[0]
+            read_at = max(arrival, self.busy_until)
+            if read_at > now:
+                return
+            rx.popleft()
+            if firmware.feed(byte):
+                read_at += firmware.execute_time()
+            self.busy_until = read_at
+
+
+class SimulatedDevice:
+    """
+    A firmware on a pseudo-terminal. .device is the path to open with
+    pyserial and, with .serial_number, makes it look like a port from a
+    DeviceRegistry scan.
+    """
+
+    # Seconds of wire time read from the pty at once. The thread then sleeps
+    # them off, so a host writing faster than the baud rate backs up in the
+    # pty and eventually blocks, as it would on a real port.
+    READ_CHUNK_TIME = 0.005
+    IDLE_POLL = 0.05
+
+    def __init__(
+        self,
+        firmware: Firmware,
+        serial_number: str,
+        baudrate: int = 9600,
+        boot: bool = True,
+        clock: Clock = monotonic,
+    ):
+        self.firmware = firmware
+        self.serial_number = serial_number
+        self._clock = clock
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.device = os.ttyname(self._slave)
+        self.line = SerialLine(firmware, baudrate, clock(), boot)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name=f"power-mode-sim-{serial_number}", daemon=True
+        )
+        self._thread.start()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self.line.run_until(self._clock())
+            return {
+                "bytes_received": self.line.bytes_received,
+                "bytes_dropped": self.line.bytes_dropped,
+                "rx_waiting": self.line.rx_waiting,
+                "commands": self.firmware.commands,
+                "bad_frames": self.firmware.bad_frames,
+            }
+
+    def settled(self) -> bool:
+        """
+        Whether the firmware has read everything written to the pty so far
+        """
+        readable, _, _ = select.select([self._master], [], [], 0)
+        return not readable and not self.stats()["rx_waiting"]
+
+    def close(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _run(self) -> None:
+        line = self.line
+        chunk = max(1, int(line.baudrate / 10 * self.READ_CHUNK_TIME))
+        while not self._stopped.is_set():
+            readable, _, _ = select.select([self._master], [], [], self.IDLE_POLL)
+            if not readable:
+                with self._lock:
+                    line.run_until(self._clock())
+                    self._write_output()
+                continue
+            data = os.read(self._master, chunk)
+            with self._lock:
+                done = line.receive(data, self._clock())
+                self._write_output()
+            self._stopped.wait(max(0.0, done - self._clock()))
+
+    def _write_output(self) -> None:
+        # Replies are a byte or two, well within what the pty buffers
+        output = self.firmware.output
+        if output:
+            os.write(self._master, output)
+            output.clear()
+
+
+FIRMWARE: Dict[Type[SerialOutputController], Type[Firmware]] = {
+    ScreenController: ComboDisplayFirmware,
+    BellController: BellsFirmware,
+    StripController: StripFirmware,
+}
+
+
+def simulated_registry(
+    specs: Sequence[DeviceSpec],
+    baudrate: Optional[int] = None,
+    boot: bool = True,
+    background_writers: bool = True,
+) -> Tuple[DeviceRegistry, List[SimulatedDevice]]:
+    """
+    A DeviceRegistry for specs that finds a simulated device for each
+    controller with a firmware in FIRMWARE instead of scanning USB, at
+    baudrate or else each spec's own. Close the devices once done with them.
+    """
+    sim_specs = []
+    devices = []
+    for spec in specs:
+        # Subclasses, eg. AnimatedStripController, drive the same firmware
+        firmware = next(
+            (FIRMWARE[cls] for cls in spec.controller.__mro__ if cls in FIRMWARE),
+            None,
+        )
+        if firmware is None:
+            continue
+        # Serial numbers of their own, as several real specs share "unknown"
+        serial_number = f"sim-{spec.controller.__name__}"
+        sim_specs.append(spec._replace(serial_number=serial_number))
+        devices.append(
+            SimulatedDevice(firmware(), serial_number, baudrate or spec.baudrate, boot)
+        )
+    registry = DeviceRegistry(
+        sim_specs, scan=lambda: devices, background_writers=background_writers
+    )
+    return registry, devices
+
+
+def measure(
+    profile_name: str = "autorepeat",
+    baudrate: int = 9600,
+    codec: Codec = ASCII,
+    boot: bool = True,
+    coalesce_window: float = 0.0,
+    flow_control: bool = False,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Play a benchmark profile in real time through the controllers, their
+    background writers and the pty into simulated devices, then report per
+    device what the writer sent and what the firmware made of it
+    """
+    # Imported here, the benchmark is only needed when measuring
+    from power_mode.benchmark import PROFILES
+    from power_mode.core import GameManager
+    from power_mode.main import DEVICES
+    from power_mode.scheduler import TickScheduler
+
+    profile = next(profile for profile in PROFILES if profile.name == profile_name)
+    specs = [spec._replace(codec=codec, flow_control=flow_control) for spec in DEVICES]
+    registry, devices = simulated_registry(specs, baudrate, boot)
+    results: Dict[str, Dict[str, float]] = {}
+    try:
+        controllers = registry.connect()
+        manager = GameManager(controllers, coalesce_window=coalesce_window)
+        scheduler = TickScheduler(manager)
+        scheduler.start()
+        start = monotonic()
+        at = start
+        for delay, key in profile.keys():
+            at += delay
+            sleep(max(0.0, at - monotonic()))
+            scheduler.trigger_key_down(key)
+        scheduler.stop()
+        for controller in controllers:
+            if controller.writer:
+                controller.writer.drain()
+        # Give the last bytes time to cross the wire
+        for device in devices:
+            while not device.settled():
+                sleep(0.01)
+        elapsed = monotonic() - start
+        by_serial = {device.serial_number: device for device in devices}
+        for registered in registry.devices:
+            if not registered.controller or not registered.controller.writer:
+                continue
+            writer = registered.controller.writer.stats()
+            sim = by_serial[registered.spec.serial_number].stats()
+            results[registered.spec.controller.__name__] = {
+                "frames_written": writer["frames_written"],
+                "frames_coalesced": writer["frames_dropped"],
+                "commands": sim["commands"],
+                "frames_lost": writer["frames_written"] - sim["commands"],
+                "bytes_dropped": sim["bytes_dropped"],
+                "bad_frames": sim["bad_frames"],
+                "bytes_per_second": sim["bytes_received"] / elapsed,
+            }
+    finally:
+        registry.stop()
+        for device in devices:
+            device.close()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--baud",
+        type=int,
+        action="append",
+        help="baud rate to simulate, can be repeated (default: 9600)",
+    )
+    parser.add_argument("--profile", default="autorepeat", help="benchmark profile")
+    parser.add_argument("--codec", choices=["ascii", "binary"], default="ascii")
+    parser.add_argument("--coalesce", type=float, default=0.0)
+    parser.add_argument(
+        "--flow-control", action="store_true", help="pace writes on acks"
+    )
+    parser.add_argument(
+        "--skip-boot", action="store_true", help="devices are ready straight away"
+    )
+    args = parser.parse_args(argv)
+
+    codec = BINARY if args.codec == "binary" else ASCII
+    for baudrate in args.baud or [9600]:
+        results = measure(
+            args.profile,
+            baudrate,
+            codec,
+            not args.skip_boot,
+            args.coalesce,
+            args.flow_control,
+        )
+        print(f"{args.profile} at {baudrate} baud")
+        for name, result in results.items():
+            print(
+                f"  {name:<18} {result['frames_written']:5.0f} frames "
+                f"{result['frames_lost']:4.0f} lost "
+                f"{result['bytes_dropped']:5.0f} bytes overflowed "
+                f"{result['bytes_per_second']:7.0f} bytes/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import TYPE_CHECKING, Deque
+
+if TYPE_CHECKING:
+    from power_mode.core import GameStateView
+
+
+class StateSubscription:
+    """
+    Snapshots waiting for one async consumer of GameManager.states().
+
+    publish can be called from any thread. The queue is bounded, once it is full
+    the oldest snapshot is dropped, so a slow consumer just sees fewer, newer
+    states and never holds up the thread publishing them.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, maxsize: int = 1):
+        self.dropped = 0
+        self._loop = loop
+        self._snapshots: Deque[GameStateView] = deque(maxlen=maxsize)
+        self._ready = asyncio.Event()
+        self._wake_pending = False
+
+    def publish(self, snapshot: GameStateView) -> None:
+        if len(self._snapshots) == self._snapshots.maxlen:
+            self.dropped += 1
+        self._snapshots.append(snapshot)
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # The consumer's loop has been closed under it
+                pass
+
+    async def get(self) -> GameStateView:
+        while not self._snapshots:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._snapshots.popleft()
+
+    def _wake(self) -> None:
+        self._wake_pending = False
+        self._ready.set()
@@ -0,0 +1,209 @@
+"""
+Typing speed over weeks, in constant memory.
+
+Samples of (time, WPM, combo) go into ring buffers at several resolutions, by
+default a second, a minute and an hour. Each level keeps a fixed number of
+buckets in flat arrays, so memory is set when the series is made and never
+grows. A bucket holds the mean WPM and the highest combo of the samples in it.
+As a bucket closes it is rolled up into the bucket of the next level, so a
+level holds data for far longer than the one below it, at lower resolution.
+
+Times are seconds since the epoch so graphs can be labelled with the time of
+day.
+"""
+from __future__ import annotations
+
+import time
+from array import array
+from typing import Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from power_mode.clock import Clock
+
+# (seconds per bucket, buckets kept): an hour of seconds, a day of minutes and
+# eight weeks of hours, about 100KB in all
+LEVELS = ((1.0, 3600), (60.0, 1440), (3600.0, 1344))
+
+
+class Sample(NamedTuple):
+    # Start of the bucket
+    time: float
+    wpm: float
+    combo: int
+    # Samples averaged into it
+    samples: int
+
+
+class _Level:
+    """
+    A ring of closed buckets plus the open one still being filled
+    """
+
+    __slots__ = (
+        "resolution",
+        "capacity",
+        "times",
+        "wpm_sums",
+        "combos",
+        "counts",
+        "_start",
+        "_size",
+        "open_time",
+        "open_wpm_sum",
+        "open_combo",
+        "open_count",
+    )
+
+    def __init__(self, resolution: float, capacity: int):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        # Sums rather than means, so rolling up weighs buckets by their samples
+        self.wpm_sums = array("f", bytes(4 * capacity))
+        self.combos = array("I", bytes(4 * capacity))
+        self.counts = array("I", bytes(4 * capacity))
+        self._start = 0
+        self._size = 0
+        self.open_time: Optional[float] = None
+        self.open_wpm_sum = 0.0
+        self.open_combo = 0
+        self.open_count = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(
+        self, at: float, wpm_sum: float, combo: int, count: int
+    ) -> Optional[Tuple[float, float, int, int]]:
+        """
+        Add to the bucket at falls in. Returns the bucket that closed to make
+        way for it, if one did.
+        """
+        bucket = at - at % self.resolution
+        closed = None
+        if bucket != self.open_time:
+            if self.open_time is not None:
+                closed = self._close()
+            self.open_time = bucket
+        self.open_wpm_sum += wpm_sum
+        if combo > self.open_combo:
+            self.open_combo = combo
+        self.open_count += count
+        return closed
+
+    def _close(self) -> Tuple[float, float, int, int]:
+        assert self.open_time is not None
+        closed = (self.open_time, self.open_wpm_sum, self.open_combo, self.open_count)
+        if self._size == self.capacity:
+            index = self._start
+            self._start = (self._start + 1) % self.capacity
+        else:
+            index = (self._start + self._size) % self.capacity
+            self._size += 1
+        self.times[index] = closed[0]
+        self.wpm_sums[index] = closed[1]
+        self.combos[index] = closed[2]
+        self.counts[index] = closed[3]
+        self.open_wpm_sum = 0.0
+        self.open_combo = 0
+        self.open_count = 0
+        return closed
+
+    def sample(self, position: int) -> Sample:
+        index = (self._start + position) % self.capacity
+        count = self.counts[index]
+        return Sample(
+            self.times[index], self.wpm_sums[index] / count, self.combos[index], count
+        )
+
+    def first_at_or_after(self, at: float) -> int:
+        # Closed buckets are in time order, so a binary search over the ring
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[(self._start + middle) % self.capacity] < at:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+class WpmTimeSeries:
+    """
+    record() costs O(1) a level. range() costs O(log n) to find the start and
+    then O(1) for each sample returned.
+
+    clock is the game's clock. record_at() takes times from it and turns them
+    into wall time with an offset measured once, when the series is made.
+    """
+
+    def __init__(
+        self,
+        levels: Sequence[Tuple[float, int]] = LEVELS,
+        wall_clock: Clock = time.time,
+        clock: Clock = time.monotonic,
+    ):
+        self.wall_clock = wall_clock
+        self.clock = clock
+        self._wall_offset = wall_clock() - clock()
+        self.levels: List[_Level] = [
+            _Level(resolution, capacity) for resolution, capacity in levels
+        ]
+
+    @property
+    def resolutions(self) -> List[float]:
+        return [level.resolution for level in self.levels]
+
+    def record(self, wpm: float, combo: int, at: Optional[float] = None) -> None:
+        if at is None:
+            at = self.wall_clock()
+        closed: Optional[Tuple[float, float, int, int]] = (at, wpm, combo, 1)
+        for level in self.levels:
+            assert closed is not None
+            closed = level.add(*closed)
+            if closed is None:
+                break
+
+    def record_at(self, wpm: float, combo: int, now: float) -> None:
+        """
+        record() a sample from now on the game's clock, without reading the
+        wall clock again
+        """
+        self.record(wpm, combo, now + self._wall_offset)
+
+    def range(
+        self, start: float, end: float, resolution: Optional[float] = None
+    ) -> Iterator[Sample]:
+        """
+        Buckets starting in [start, end), oldest first, from the level with
+        the given resolution. Left out, the finest level that still reaches
+        back to start is used.
+
+        The newest samples reach a coarser level once the finer bucket they
+        are in closes.
+        """
+        level = self._level(start, resolution)
+        position = level.first_at_or_after(start)
+        while position < len(level):
+            sample = level.sample(position)
+            if sample.time >= end:
+                return
+            yield sample
+            position += 1
+        if level.open_time is not None and start <= level.open_time < end:
+            yield Sample(
+                level.open_time,
+                level.open_wpm_sum / level.open_count,
+                level.open_combo,
+                level.open_count,
+            )
+
+    def _level(self, start: float, resolution: Optional[float]) -> _Level:
+        if resolution is not None:
+            for level in self.levels:
+                if level.resolution == resolution:
+                    return level
+            raise ValueError(f"no level with a resolution of {resolution}s")
+        for level in self.levels:
+            if len(level) < level.capacity or level.sample(0).time <= start:
+                return level
+        return self.levels[-1]
@@ -8,6 +8,23 @@ Adafruit_NeoPixel strip(LED_COUNT, LED_PIN, NEO_GRBW + NEO_KHZ800);
 
 String END_CODE = String("e");
 
+// Binary frames are a type byte, a fixed payload and a checksum byte (the sum
+// of the others). 'P' start end color lights a run, 'X' clears the strip.
+#define BINARY_PIXELS 'P'
+#define BINARY_CLEAR 'X'
+#define MAX_BINARY_FRAME_LENGTH 5
+// The host asks with READY_QUERY and waits for READY before sending
+#define READY_QUERY '?'
+#define READY '!'
+// Sent FLOW_CONTROL, the sketch answers FLOW_CONTROL and RX_WINDOW (u16 little
+// endian) then writes ACK once done with each frame, good or bad. The host
+// never has more than RX_WINDOW bytes unacknowledged, so the receive buffer
+// can't overflow while the sketch is busy.
+#define FLOW_CONTROL '$'
+#define ACK '+'
+// The Uno's serial receive buffer
+#define RX_WINDOW 64
+
 uint32_t COLOR_ARRAY[] = {
   strip.Color(  0, 255,   0),
   strip.Color(255,   0,   0),
@@ -16,28 +33,99 @@ uint32_t COLOR_ARRAY[] = {
   strip.Color(  0, 0,   255),
   strip.Color( 75, 0,   130),
   strip.Color(238, 130, 238),
-  strip.Color(  0, 255, 60)
+  strip.Color(  0, 255, 60),
+  // Off, for the host to turn single pixels off
+  strip.Color(  0,   0,   0)
 };
 
 bool newData;
+bool newBinaryData;
+
+byte binaryFrame[MAX_BINARY_FRAME_LENGTH];
+byte binaryIndex;
+byte binaryFrameLength;
+boolean acking = false;
 
 String colorModeParam;
 String indexParam;
+String endIndexParam;
 int parameterIndex;
 
 void reset() {
   colorModeParam = String("");
   indexParam = String("");
+  endIndexParam = String("");
   newData = false;
+  newBinaryData = false;
+  binaryIndex = 0;
+  binaryFrameLength = 0;
   parameterIndex = 0;
 }
 
+void grantCredits() {
+  acking = true;
+  Serial.write(FLOW_CONTROL);
+  Serial.write(RX_WINDOW & 0xFF);
+  Serial.write(RX_WINDOW >> 8);
+}
+
+void acknowledge() {
+  if (acking) {
+    Serial.write(ACK);
+  }
+}
+
+byte frameLengthFor(char frameType) {
+  if (frameType == BINARY_PIXELS) {
+    return 5;
+  } else if (frameType == BINARY_CLEAR) {
+    return 2;
+  }
+  return 0;
+}
+
+void readBinary(byte recievedByte) {
+  if (binaryIndex == 0) {
+    binaryFrameLength = frameLengthFor(recievedByte);
+  }
+  binaryFrame[binaryIndex] = recievedByte;
+  binaryIndex += 1;
+  if (binaryIndex < binaryFrameLength) {
+    return;
+  }
+  byte checksum = 0;
+  for (byte i = 0; i < binaryFrameLength - 1; i++) {
+    checksum += binaryFrame[i];
+  }
+  binaryIndex = 0;
+  // A bad checksum throws the whole frame away
+  newBinaryData = checksum == binaryFrame[binaryFrameLength - 1];
+  if (!newBinaryData) {
+    acknowledge();
+  }
+}
+
+void executeBinary() {
+  if (binaryFrame[0] == BINARY_CLEAR) {
+    strip.clear();
+  } else {
+    uint32_t color = COLOR_ARRAY[binaryFrame[3]];
+    int endIndex = min((int)binaryFrame[2], LED_COUNT - 1);
+    for (int i = binaryFrame[1]; i <= endIndex; i++) {
+      strip.setPixelColor(i, color);
+    }
+  }
+  strip.show();
+  reset();
+}
+
 void setup() {
   reset();
   strip.begin();
   strip.show();
   strip.setBrightness(BRIGHTNESS);
   Serial.begin(9600);
+  Serial.write(READY);
 }
 
 void loop() {
@@ -48,14 +136,26 @@ void loop() {
 void getData() {
   static byte index = 0;
   char recievedChar;
-  while (Serial.available() > 0 && newData == false) {
+  while (Serial.available() > 0 && newData == false && newBinaryData == false) {
     recievedChar = Serial.read();
-    if (recievedChar == ';') {
+    if (binaryIndex == 0 && recievedChar == READY_QUERY) {
+      Serial.write(READY);
+      continue;
+    }
+    if (binaryIndex == 0 && recievedChar == FLOW_CONTROL) {
+      grantCredits();
+      continue;
+    }
+    if (binaryIndex > 0 || frameLengthFor(recievedChar) > 0) {
+      readBinary(recievedChar);
+    } else if (recievedChar == ';') {
       newData = true;
     } else if (recievedChar == ',') {
       parameterIndex += 1;
     } else {
-      if (parameterIndex == 1) {
+      if (parameterIndex == 2) {
+        endIndexParam += String(recievedChar);
+      } else if (parameterIndex == 1) {
         colorModeParam += String(recievedChar);
       } else {
         indexParam += String(recievedChar);
@@ -65,13 +165,24 @@ void getData() {
 }
 
 void execute() {
-  if (newData) {
+  if (newBinaryData) {
+    executeBinary();
+    acknowledge();
+  } else if (newData) {
     if (colorModeParam == END_CODE) {
       strip.clear();
+    } else if (endIndexParam.length() > 0) {
+      // start,color,end; lights a whole run with a single show
+      uint32_t color = COLOR_ARRAY[colorModeParam.toInt()];
+      int endIndex = min(endIndexParam.toInt(), LED_COUNT - 1);
+      for (int i = indexParam.toInt(); i <= endIndex; i++) {
+        strip.setPixelColor(i, color);
+      }
     } else {
       strip.setPixelColor(indexParam.toInt(), COLOR_ARRAY[colorModeParam.toInt()]);
     }
     strip.show();
     reset();
+    acknowledge();
   }
 }
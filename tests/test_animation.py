@@ -0,0 +1,69 @@
+from power_mode.animation import (
+    GREEN,
+    OFF,
+    ORANGE,
+    RED,
+    VIOLET,
+    YELLOW,
+    StripAnimation,
+    blank,
+    diff,
+)
+from power_mode.main import GameState
+from power_mode.protocol import StripPixels
+
+
+def test_diff():
+    shown = blank(10)
+    assert diff(shown, blank(10)) == []
+    frame = bytearray([GREEN] * 4) + blank(6)
+    assert diff(shown, frame) == [StripPixels(0, 3, GREEN)]
+    # Pixels already showing the colour are only rewritten between changes
+    shown = bytearray(frame)
+    frame[1] = RED
+    frame[4] = GREEN
+    assert diff(shown, frame) == [StripPixels(1, 1, RED), StripPixels(4, 4, GREEN)]
+    shown = bytearray([GREEN, RED, GREEN, GREEN, GREEN] + [OFF] * 5)
+    frame = bytearray([GREEN] * 6 + [OFF] * 4)
+    assert diff(shown, frame) == [StripPixels(1, 5, GREEN)]
+    assert diff(frame, blank(10)) == [StripPixels(0, 5, OFF)]
+
+
+def test_trail_fades_into_the_key_color():
+    animation = StripAnimation(20)
+    state = GameState.start(0.0).increment_by(3, now=0.0)
+    animation.light(0, 2, GREEN, 0.0)
+    assert animation.render(state, 0.0)[:4] == bytearray([YELLOW] * 3 + [OFF])
+    assert animation.next_change(state, 0.0) == 0.08 + animation.STEP_SLACK
+    assert animation.render(state, 0.1)[:3] == bytearray([ORANGE] * 3)
+    assert animation.render(state, 0.2)[:3] == bytearray([RED] * 3)
+    assert animation.render(state, 0.3)[:3] == bytearray([GREEN] * 3)
+    # Then nothing until the timeout bar appears
+    assert animation.next_change(state, 0.3) == 5.0 + animation.STEP_SLACK
+
+
+def test_milestone_flash():
+    animation = StripAnimation(20)
+    state = GameState.start(0.0).increment_by(100, now=0.0)
+    animation.combo(99, 0.0)
+    animation.combo(100, 10.0)
+    assert animation.render(state, 10.0) == bytearray([VIOLET] * 20)
+    assert animation.render(state, 10.2) == blank(20)
+    assert animation.render(state, 10.35) == bytearray([VIOLET] * 20)
+    assert animation.render(state, 10.6) == blank(20)
+    # Only once per hundred
+    animation.combo(150, 20.0)
+    assert animation.render(state, 20.0) == blank(20)
+
+
+def test_timeout_bar():
+    animation = StripAnimation(20)
+    state = GameState.start(0.0).increment_by(1, now=0.0)
+    assert animation.render(state, 4.0) == blank(20)
+    assert animation.next_change(state, 4.0) == 5.0 + animation.STEP_SLACK
+    # Half the bar a quarter of the way from timing out
+    frame = animation.render(state, 7.5)
+    assert frame[4:] == bytearray([RED] * 8 + [OFF] * 8)
+    assert animation.next_change(state, 7.5) == 7.8125 + animation.STEP_SLACK
+    assert animation.render(state, 10.0) == blank(20)
+    assert animation.next_change(state, 10.0) is None
@@ -32,3 +32,14 @@ def test_tick():
     controller.tick(gamestate)
     assert mock_serial.write.call_count == 4
     assert mock_serial.write.call_args == call(b"0,0;")
+
+
+def test_next_deadline():
+    mock_serial = Mock()
+    controller = BalloonFanController(mock_serial)
+    gamestate = GameState.start()
+    assert controller.next_deadline(gamestate, 10.0) == 10.0
+    controller.tick(gamestate)
+    assert controller.next_deadline(gamestate, 10.0) is None
+    gamestate = gamestate.increment_combo(KeyCode.from_char("a"))
+    assert controller.next_deadline(gamestate, 11.0) == 11.0
@@ -1,10 +1,13 @@
 from datetime import timedelta
+from time import time
 from unittest.mock import Mock, call
 
 import freezegun
+import pytest
 from pynput.keyboard import KeyCode
 
-from power_mode.main import BellController, GameState
+from power_mode.main import BellController, GameState, PulsedBellController
+from power_mode.protocol import BINARY, BellMessage, BellPulse
 
 
 def test_bell_controller():
@@ -58,3 +61,85 @@ def test_bell_timeout():
             call(b"1111"),
             call(b"0000"),
         ]
+
+
+def test_next_deadline():
+    mock_serial = Mock()
+    controller = BellController(mock_serial)
+    gamestate = GameState.start()
+    with freezegun.freeze_time("2020-05-17 10:12:34") as frozen_time:
+        # Nothing sent yet
+        assert controller.next_deadline(gamestate, time()) == time()
+        controller.tick(gamestate)
+        assert controller.next_deadline(gamestate, time()) is None
+
+        controller.key_down(KeyCode.from_char("a"), gamestate)
+        first_click = time()
+        frozen_time.tick(delta=timedelta(seconds=0.05))
+        controller.key_down(KeyCode.from_char("a"), gamestate)
+        # The first bell to go off decides the deadline
+        assert controller.next_deadline(gamestate, time()) == pytest.approx(
+            first_click + controller.BELL_TIME
+        )
+        frozen_time.tick(delta=timedelta(seconds=0.06))
+        # The first bell is overdue
+        assert controller.next_deadline(gamestate, time()) == time()
+        controller.tick(gamestate)
+        assert mock_serial.write.call_args == call(b"0100")
+        assert controller.next_deadline(gamestate, time()) == pytest.approx(
+            first_click + 0.05 + controller.BELL_TIME
+        )
+
+
+def test_keys_down():
+    batched = BellController(Mock())
+    one_at_a_time = BellController(Mock())
+    gamestate = GameState.start()
+    for count, now in [(2, 10.0), (7, 10.05), (1, 11.0)]:
+        batched.keys_down(count, gamestate, now)
+        for _ in range(count):
+            one_at_a_time.key_down(KeyCode.from_char("a"), gamestate, now)
+        assert batched.bell_click_times == one_at_a_time.bell_click_times
+        assert batched.current_index == one_at_a_time.current_index
+        assert batched.last_message == one_at_a_time.last_message
+    # One message a batch
+    assert batched.serial_connection.write.call_count == 3
+
+
+def pulse(*relays: bool) -> bytes:
+    return BINARY.encode(BellPulse(relays, 100))
+
+
+def test_pulsed_bells_one_frame_a_ring():
+    mock_serial = Mock()
+    controller = PulsedBellController(mock_serial)
+    gamestate = GameState.start()
+    controller.tick(gamestate, 0.0)
+    for i in range(5):
+        controller.key_down(KeyCode.from_char("a"), gamestate, 1.0 + i * 0.04)
+    # Bells turn themselves off, so ticks have nothing to send
+    assert controller.next_deadline(gamestate, 1.2) is None
+    assert not controller.needs_tick(0, 1.2)
+    controller.tick(gamestate, 1.2)
+    assert mock_serial.write.call_args_list == [
+        call(BINARY.encode(BellMessage((False,) * 4))),
+        call(pulse(True, False, False, False)),
+        call(pulse(False, True, False, False)),
+        call(pulse(False, False, True, False)),
+        call(pulse(False, False, False, True)),
+        # Round again, the first bell rang long enough ago
+        call(pulse(True, False, False, False)),
+    ]
+
+
+def test_pulsed_bells_rate_cap():
+    mock_serial = Mock()
+    controller = PulsedBellController(mock_serial)
+    gamestate = GameState.start()
+    controller.keys_down(10, gamestate, 1.0)
+    # Every bell is still ringing
+    controller.key_down(KeyCode.from_char("a"), gamestate, 1.1)
+    assert controller.rings_skipped == 7
+    assert mock_serial.write.call_args_list == [call(pulse(True, True, True, True))]
+    controller.key_down(KeyCode.from_char("a"), gamestate, 1.2)
+    assert mock_serial.write.call_args == call(pulse(True, False, False, False))
@@ -0,0 +1,70 @@
+from typing import Iterator, Tuple
+
+from pynput.keyboard import KeyCode
+
+from power_mode.benchmark import Profile, compare, measure_startup, run_profile
+
+
+def _few_keys() -> Iterator[Tuple[float, KeyCode]]:
+    for _ in range(12):
+        yield 0.1, KeyCode.from_char("a")
+
+
+FEW_KEYS = Profile("few", "a dozen keys", _few_keys)
+
+
+def test_run_profile():
+    result = run_profile(FEW_KEYS)
+    assert result["keys"] == 12
+    # Start up, bells turning off and screen updates, then the timeout
+    assert result["ticks"] > 12
+    assert result["bytes_written"]["BalloonFanController"] == len(b"0,0;1,0;0,0;")
+    assert result["frames_written"]["BalloonFanController"] == 3
+    # The bells ring once per key and turn off before the next one
+    assert result["frames_written"]["BellController"] == 1 + 12 * 2
+    assert result["alloc_bytes_per_event"] > 0
+
+
+def test_compare():
+    baseline = {
+        "few": {
+            "keys": 12,
+            "key_latency_us": {"p50": 10.0, "p99": 20.0, "max": 30.0},
+            "bytes_written": {"ScreenController": 100},
+        }
+    }
+    same = {
+        "few": {
+            "keys": 12,
+            "key_latency_us": {"p50": 11.0, "p99": 20.0, "max": 300.0},
+            "bytes_written": {"ScreenController": 100},
+        }
+    }
+    assert compare(same, baseline) == []
+    worse = {
+        "few": {
+            "keys": 12,
+            "key_latency_us": {"p50": 20.0, "p99": 20.0, "max": 30.0},
+            "bytes_written": {"ScreenController": 200},
+        }
+    }
+    assert compare(worse, baseline) == [
+        "few.bytes_written.ScreenController: 100.0 -> 200.0",
+        "few.key_latency_us.p50: 10.0 -> 20.0",
+    ]
+
+
+def test_run_profile_sessions():
+    result = run_profile(FEW_KEYS, sessions=3)
+    assert result["keys"] == 36
+    assert result["frames_written"]["BalloonFanController"] == 3 * 3
+
+
+def test_startup_leaves_hardware_unloaded():
+    startup = measure_startup(runs=1)
+    assert set(startup) == {"core", "main"}
+    for result in startup.values():
+        assert result["import_ms"] > 0
+        # pynput needs a display server, nothing should import it until the
+        # keyboard listener starts
+        assert result["heavy_modules"] == 0
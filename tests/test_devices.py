@@ -0,0 +1,175 @@
+import threading
+from types import SimpleNamespace
+from typing import Dict, List
+from unittest.mock import Mock
+
+from pynput.keyboard import KeyCode
+
+from power_mode.devices import DeviceRegistry, DeviceSpec
+from power_mode.main import (
+    BalloonFanController,
+    GameManager,
+    ScreenController,
+    StripController,
+)
+from power_mode.protocol import FLOW_CONTROL, READY, READY_QUERY
+
+SPECS = [
+    DeviceSpec("screen", ScreenController),
+    DeviceSpec("strip", StripController),
+    DeviceSpec("unknown", BalloonFanController, handshake=False),
+]
+
+
+class FakePorts:
+    def __init__(self) -> None:
+        self.plugged_in = {"screen": "/dev/ttyACM0", "strip": "/dev/ttyACM1"}
+        self.scans = 0
+        self.opened: Dict[str, Mock] = {}
+
+    def scan(self) -> List[SimpleNamespace]:
+        self.scans += 1
+        return [
+            SimpleNamespace(serial_number=serial_number, device=device)
+            for serial_number, device in self.plugged_in.items()
+        ]
+
+    def open(self, device: str, baudrate: int) -> Mock:
+        self.opened[device] = Mock(**{"read.return_value": READY})
+        return self.opened[device]
+
+
+def make_registry(ports: FakePorts) -> DeviceRegistry:
+    return DeviceRegistry(
+        SPECS, scan=ports.scan, open_port=ports.open, background_writers=False
+    )
+
+
+def test_connect_scans_once():
+    ports = FakePorts()
+    registry = make_registry(ports)
+    controllers = registry.connect()
+    assert ports.scans == 1
+    assert [type(controller) for controller in controllers] == [
+        ScreenController,
+        StripController,
+    ]
+    assert set(ports.opened) == {"/dev/ttyACM0", "/dev/ttyACM1"}
+
+
+def test_unplugged_device_is_dropped_and_reconnected():
+    ports = FakePorts()
+    registry = make_registry(ports)
+    game_manager = GameManager(registry.connect())
+    registry.manager = game_manager
+    on_change = Mock()
+    registry._on_change = on_change
+    screen = game_manager.serial_controllers[0]
+
+    # Unplug the screen, the failed write marks it disconnected
+    ports.opened["/dev/ttyACM0"].write.side_effect = OSError("unplugged")
+    del ports.plugged_in["screen"]
+    game_manager.trigger_tick()
+    assert not screen.connected
+    game_manager.trigger_tick()
+    # The ready query, then the write that failed
+    assert ports.opened["/dev/ttyACM0"].write.call_count == 2
+
+    registry.poll(now=100.0)
+    assert screen not in game_manager.serial_controllers
+    assert ports.opened["/dev/ttyACM0"].close.called
+
+    # Still not there, so we wait before looking again
+    scans = ports.scans
+    registry.poll(now=100.5)
+    assert ports.scans == scans
+    registry.poll(now=101.0)
+    assert ports.scans == scans + 1
+
+    ports.plugged_in["screen"] = "/dev/ttyACM2"
+    registry.poll(now=102.0)
+    assert ports.scans == scans + 1
+    registry.poll(now=103.0)
+    new_screen = game_manager.serial_controllers[-1]
+    assert isinstance(new_screen, ScreenController)
+    assert new_screen is not screen
+    assert on_change.call_count == 1
+
+    game_manager.trigger_key_down(KeyCode.from_char("a"))
+    game_manager.trigger_tick()
+    assert ports.opened["/dev/ttyACM2"].write.called
+
+
+def test_backoff_is_capped():
+    ports = FakePorts()
+    registry = make_registry(ports)
+    registry.connect()
+    missing = registry.devices[2]
+    now = 0.0
+    for _ in range(20):
+        now = missing.next_attempt
+        registry.poll(now)
+    assert missing.backoff == DeviceRegistry.MAX_BACKOFF
+    assert missing.next_attempt == now + DeviceRegistry.MAX_BACKOFF
+
+
+def test_waits_for_ready_byte():
+    ports = FakePorts()
+    registry = make_registry(ports)
+    registry.connect()
+    screen = ports.opened["/dev/ttyACM0"]
+    screen.reset_input_buffer.assert_called_once_with()
+    screen.write.assert_called_once_with(READY_QUERY)
+
+
+def test_no_ready_query_without_handshake():
+    ports = FakePorts()
+    ports.plugged_in["unknown"] = "/dev/ttyACM2"
+    specs = [spec._replace(flow_control=True) for spec in SPECS]
+    registry = DeviceRegistry(
+        specs,
+        scan=ports.scan,
+        open_port=ports.open,
+        background_writers=False,
+        ready_timeout=0.05,
+    )
+    registry.connect()
+    fan = ports.opened["/dev/ttyACM2"]
+    assert not fan.reset_input_buffer.called
+    assert not fan.read.called
+    # Nor asked for credits it would never grant
+    written = [args.args[0] for args in fan.write.call_args_list]
+    assert READY_QUERY not in written
+    assert FLOW_CONTROL not in written
+
+
+def test_opens_devices_in_parallel():
+    booting = threading.Barrier(2, timeout=5)
+
+    def boot(size: int) -> bytes:
+        # Neither board is ready until both are being waited on, which times
+        # out if they are opened one after the other
+        booting.wait()
+        return READY
+
+    class SlowPorts(FakePorts):
+        def open(self, device: str, baudrate: int) -> Mock:
+            port = super().open(device, baudrate)
+            port.read.side_effect = boot
+            return port
+
+    ports = SlowPorts()
+    registry = make_registry(ports)
+    assert len(registry.connect()) == 2
+
+
+def test_carries_on_without_ready_byte():
+    ports = FakePorts()
+    registry = DeviceRegistry(
+        SPECS,
+        scan=ports.scan,
+        open_port=lambda device, baudrate: Mock(**{"read.return_value": b""}),
+        background_writers=False,
+        ready_timeout=0.05,
+    )
+    assert len(registry.connect()) == 2
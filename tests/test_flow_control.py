@@ -0,0 +1,97 @@
+from time import monotonic, sleep
+from typing import List, Optional
+
+from power_mode.clock import VirtualClock
+from power_mode.controllers import StripController
+from power_mode.devices import DeviceSpec
+from power_mode.flow_control import Credits, request_credits
+from power_mode.protocol import ACK, ASCII, FLOW_CONTROL, READY, StripClear
+from power_mode.simulator import simulated_registry
+
+
+class AckingSerial:
+    """
+    Replies are queued up front. A read with nothing to return takes the
+    port's read timeout on clock, if given.
+    """
+
+    READ_TIMEOUT = 0.1
+
+    def __init__(self, replies: bytes = b"", clock: Optional[VirtualClock] = None):
+        self.replies = bytearray(replies)
+        self.clock = clock
+        self.written: List[bytes] = []
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.replies)
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.replies and self.clock:
+            self.clock.advance(self.READ_TIMEOUT)
+        data = bytes(self.replies[:size])
+        del self.replies[:size]
+        return data
+
+    def write(self, data: bytes) -> None:
+        self.written.append(data)
+
+
+def test_request_credits():
+    port = AckingSerial(READY + FLOW_CONTROL + (350).to_bytes(2, "little"))
+    assert request_credits(port, timeout=1.0) == 350
+    assert port.written == [FLOW_CONTROL]
+    assert request_credits(AckingSerial(), timeout=0.05) is None
+
+
+def test_credits_wait_for_acks():
+    port = AckingSerial()
+    credits = Credits(port, window=10)
+    credits.acquire(4)
+    credits.acquire(6)
+    assert credits.bytes_in_flight == 10
+    port.replies += ACK
+    credits.acquire(4)
+    assert credits.bytes_in_flight == 10
+    assert credits.acks == 1
+    # Bigger than the window, it waits for everything else
+    port.replies += READY + ACK + ACK
+    credits.acquire(20)
+    assert credits.bytes_in_flight == 20
+
+
+def test_write_of_several_frames_needs_all_its_acks():
+    clock = VirtualClock()
+    port = AckingSerial(clock=clock)
+    credits = Credits(port, window=10, clock=clock)
+    credits.acquire(8, frames=3)
+    port.replies += ACK + ACK
+    # Two of its three acks come, then nothing, so it's written off
+    credits.acquire(4)
+    assert credits.acks == 2
+    assert credits.timeouts == 1
+    assert credits.bytes_in_flight == 4
+
+
+def test_no_overflow_with_flow_control():
+    # Writes back to back, which overflow the strip's buffer while it's in
+    # show() without pacing, see test_serial_line_overflows_while_busy
+    spec = DeviceSpec("strip", StripController, ASCII, 1_000_000, flow_control=True)
+    registry, devices = simulated_registry([spec], background_writers=False)
+    try:
+        (strip,) = registry.connect()
+        assert strip.credits and strip.credits.window == 64
+        assert strip.write_pacing == 0.0
+        for _ in range(100):
+            strip.send(ASCII.encode(StripClear()))
+        deadline = monotonic() + 5
+        while not devices[0].settled() and monotonic() < deadline:
+            sleep(0.01)
+        stats = devices[0].stats()
+        assert stats["bytes_dropped"] == 0
+        assert stats["commands"] == 100
+        assert strip.credits.timeouts == 0
+    finally:
+        registry.stop()
+        for device in devices:
+            device.close()
@@ -1,10 +1,21 @@
+import sys
 from datetime import timedelta
 from unittest.mock import Mock
 
 import freezegun
+import pytest
 from pynput.keyboard import KeyCode
 
-from power_mode.main import GameManager, GameState
+from power_mode.clock import VirtualClock
+from power_mode.keys import Key
+from power_mode.main import (
+    BalloonFanController,
+    BellController,
+    GameManager,
+    GameState,
+    ScreenController,
+    StripController,
+)
 
 
 def test_key_down():
@@ -32,14 +43,28 @@ def test_key_down():
             assert len(controller.tick.call_args_list) == 0
             assert len(controller.key_down.call_args_list) == 1
             args, _ = controller.key_down.call_args_list[0]
-            key, state = args
-            assert KeyCode.from_char("a") == key
+            key, state, now = args
+            # Converted to the game's own keys on the way in
+            assert key is Key.OTHER
+            assert now == 1589710354.0
             assert expected_gamestate == state
             # Verify we send a copy of the state
             assert state == game_manager.game_state
             assert id(state) != id(game_manager.game_state)
 
 
+def test_pynput_backspace_counts():
+    from pynput.keyboard import Key as PynputKey
+
+    for coalesce_window in (0.0, 0.01):
+        clock = VirtualClock()
+        game_manager = GameManager([Mock()], clock, coalesce_window=coalesce_window)
+        game_manager.trigger_key_down(PynputKey.backspace)
+        clock.advance(1)
+        game_manager.trigger_tick()
+        assert game_manager.game_state.num_backspaces == 1
+
+
 def test_key_down_multiple():
     mock_controller_one = Mock()
     mock_controller_two = Mock()
@@ -128,3 +153,158 @@ def test_trigger_tick():
             # Verify we send a copy of the state
             assert state == game_manager.game_state
             assert id(state) != id(game_manager.game_state)
+
+
+def test_idle_ticks_reuse_snapshot():
+    mock_controller = Mock()
+    with freezegun.freeze_time("2020-05-17 10:12:34"):
+        game_manager = GameManager(serial_controllers=[mock_controller])
+        game_manager.trigger_key_down(KeyCode.from_char("a"))
+        game_manager.trigger_tick()
+        game_manager.trigger_tick()
+        (_, key_snapshot, _), _ = mock_controller.key_down.call_args
+        (first_tick, _), _ = mock_controller.tick.call_args_list[0]
+        (second_tick, _), _ = mock_controller.tick.call_args_list[1]
+        assert first_tick is key_snapshot
+        assert second_tick is key_snapshot
+        assert key_snapshot is not game_manager.game_state
+
+
+def test_one_clock_read_per_event():
+    clock = VirtualClock()
+    reads = Mock(side_effect=clock)
+    controllers = [
+        ScreenController(Mock()),
+        BellController(Mock()),
+        StripController(Mock()),
+        BalloonFanController(Mock()),
+    ]
+    game_manager = GameManager(controllers, clock=reads)
+    reads.reset_mock()
+    for _ in range(10):
+        game_manager.trigger_key_down(KeyCode.from_char("a"))
+        assert reads.call_count == 1
+        clock.advance(0.2)
+        game_manager.trigger_tick()
+        assert reads.call_count == 2
+        reads.reset_mock()
+
+
+def test_virtual_clock_timeout():
+    clock = VirtualClock()
+    game_manager = GameManager([BalloonFanController(Mock())], clock=clock)
+    for _ in range(3600):
+        game_manager.trigger_key_down(KeyCode.from_char("a"))
+        clock.advance(9.99)
+        game_manager.trigger_tick()
+    assert game_manager.game_state.current_combo == 3600
+    clock.advance(0.01)
+    game_manager.trigger_tick()
+    assert game_manager.game_state.current_combo == 0
+    assert game_manager.game_state.combo_at_last_timeout == 3600
+
+
+def test_idle_ticks_skip_controllers():
+    clock = VirtualClock()
+    screen = ScreenController(Mock())
+    balloon = BalloonFanController(Mock())
+    bells = BellController(Mock())
+    controllers = [screen, balloon, bells]
+    for controller in controllers:
+        controller.tick = Mock(wraps=controller.tick)  # type: ignore
+    game_manager = GameManager(list(controllers), clock=clock)
+    game_manager.trigger_tick()
+    assert [controller.tick.call_count for controller in controllers] == [1, 1, 1]
+
+    clock.advance(1)
+    game_manager.trigger_tick()
+    assert [controller.tick.call_count for controller in controllers] == [1, 1, 1]
+
+    game_manager.trigger_key_down(KeyCode.from_char("a"))
+    game_manager.trigger_tick()
+    # The bell only needs a tick once it's time to turn it off
+    assert [controller.tick.call_count for controller in controllers] == [2, 2, 1]
+    clock.advance(0.1)
+    game_manager.trigger_tick()
+    assert [controller.tick.call_count for controller in controllers] == [2, 2, 2]
+    clock.advance(0.5)
+    game_manager.trigger_tick()
+    # The time left shown went from 1.0 to 0.9
+    assert [controller.tick.call_count for controller in controllers] == [3, 2, 2]
+
+
+def _flood(game_manager: GameManager, clock: VirtualClock) -> None:
+    # Steady typing, then autorepeat with the odd backspace, ticking at the
+    # deadlines the manager asks for like the scheduler would
+    keys = [(0.15, KeyCode.from_char("a"))] * 40
+    keys += [
+        (0.002, Key.BACKSPACE if i % 7 == 6 else KeyCode.from_char("a"))
+        for i in range(500)
+    ]
+    at = clock.now
+    for delay, key in keys:
+        at += delay
+        deadline = game_manager.next_deadline()
+        while deadline is not None and deadline <= at:
+            clock.now = max(clock.now, deadline)
+            game_manager.trigger_tick()
+            deadline = game_manager.next_deadline()
+        clock.now = at
+        game_manager.trigger_key_down(key)
+    clock.advance(0.01)
+    game_manager.trigger_tick()
+
+
+def test_coalesced_keys_match_one_at_a_time():
+    states = []
+    for window in [0.0, 0.01]:
+        clock = VirtualClock()
+        game_manager = GameManager(
+            [BalloonFanController(Mock())], clock=clock, coalesce_window=window
+        )
+        _flood(game_manager, clock)
+        states.append(game_manager.game_state.copy())
+        clock.advance(10)
+        game_manager.trigger_tick()
+        states.append(game_manager.game_state.copy())
+    one_at_a_time, ended, coalesced, coalesced_ended = states
+    assert coalesced.current_combo == one_at_a_time.current_combo == 540
+    assert coalesced.num_backspaces == one_at_a_time.num_backspaces
+    assert list(coalesced.recorded_wpms) == list(one_at_a_time.recorded_wpms)
+    assert coalesced.max_median_wpm == one_at_a_time.max_median_wpm
+    assert coalesced_ended.combo_at_last_timeout == ended.combo_at_last_timeout
+    assert (
+        coalesced_ended.median_wpm_at_last_timeout == ended.median_wpm_at_last_timeout
+    )
+
+
+def test_coalesced_keys_batched_for_controllers():
+    clock = VirtualClock()
+    controller = Mock()
+    controller.next_deadline.return_value = None
+    game_manager = GameManager([controller], clock=clock, coalesce_window=0.01)
+    # The first key of a burst goes straight through
+    game_manager.trigger_key_down(KeyCode.from_char("a"))
+    assert game_manager.game_state.current_combo == 1
+    assert controller.keys_down.call_args.args[0] == 1
+    for _ in range(9):
+        clock.advance(0.001)
+        game_manager.trigger_key_down(KeyCode.from_char("a"))
+    assert game_manager.game_state.current_combo == 1
+    assert game_manager.next_deadline() == pytest.approx(clock.now - 0.009 + 0.01)
+    clock.now = game_manager.next_deadline()
+    game_manager.trigger_tick()
+    assert game_manager.game_state.current_combo == 10
+    assert controller.keys_down.call_count == 2
+    assert controller.keys_down.call_args.args[0] == 9
+    controller.key_down.assert_not_called()
+
+
+def test_keys_without_pynput(monkeypatch: pytest.MonkeyPatch):
+    # As on a machine with no display, where importing pynput fails
+    monkeypatch.setitem(sys.modules, "pynput.keyboard", None)
+    game_manager = GameManager([])
+    game_manager.trigger_key_down("a")
+    game_manager.trigger_key_down(Key.BACKSPACE)
+    assert game_manager.game_state.current_combo == 2
+    assert game_manager.game_state.num_backspaces == 1
@@ -1,10 +1,13 @@
+from dataclasses import FrozenInstanceError
 from datetime import timedelta
 from time import time
 
 import freezegun
-from pynput.keyboard import Key, KeyCode
+import pytest
+from pynput.keyboard import KeyCode
 
-from power_mode.main import GameState
+from power_mode.keys import Key
+from power_mode.main import Changed, GameState
 
 
 @freezegun.freeze_time("2020-05-17 10:12:34")
@@ -55,7 +58,7 @@ def test_increment_combo():
         gamestate = GameState.start().increment_combo(KeyCode.from_char("a"))
         assert gamestate.current_combo == 1
         assert gamestate.num_backspaces == 0
-        gamestate = gamestate.increment_combo(Key.backspace)
+        gamestate = gamestate.increment_combo(Key.BACKSPACE)
         assert gamestate.current_combo == 2
         assert gamestate.num_backspaces == 1
         assert gamestate.time_of_last_key == 1589710354.0
@@ -116,3 +119,92 @@ def test_record_wpm():
         ).record_wpm()
         assert len(hundred_and_first_recording.recorded_wpms) == 100
         assert hundred_and_first_recording.recorded_wpms[-1] == 20
+
+
+def test_snapshot_is_read_only():
+    snapshot = GameState.start().snapshot()
+    with pytest.raises(FrozenInstanceError):
+        snapshot.current_combo = 10
+    with pytest.raises(FrozenInstanceError):
+        snapshot.increment_combo_in_place(KeyCode.from_char("a"))
+    # The functional api still works and hands back a live state
+    assert snapshot.increment_combo(KeyCode.from_char("a")).current_combo == 1
+
+
+def test_snapshot_reused_until_state_changes():
+    gamestate = GameState.start()
+    snapshot = gamestate.snapshot()
+    assert gamestate.snapshot() is snapshot
+    gamestate.increment_combo_in_place(KeyCode.from_char("a"))
+    assert gamestate.snapshot() is not snapshot
+    assert snapshot.current_combo == 0
+    assert gamestate.snapshot().current_combo == 1
+
+
+def test_snapshot_unchanged_by_live_state():
+    with freezegun.freeze_time("2020-05-17 10:12:34") as frozen_time:
+        gamestate = GameState.start().copy(current_combo=100, recorded_wpms=[10])
+        frozen_time.tick(delta=timedelta(minutes=1))
+        snapshot = gamestate.snapshot()
+        copied = snapshot.copy()
+        gamestate.record_wpm_in_place()
+        assert gamestate.recorded_wpms == [10, 20]
+        assert snapshot == snapshot
+        assert snapshot.recorded_wpms == [10]
+        assert (snapshot.median_wpm, snapshot.max_wpm) == (10, 10)
+        assert copied.recorded_wpms == [10]
+        assert snapshot.record_wpm().recorded_wpms == [10, 20]
+        # Only the one copy, the live state then owns its window again
+        window = gamestate.recorded_wpms
+        gamestate.record_wpm_in_place()
+        assert gamestate.recorded_wpms is window
+        gamestate.combo_stopped_in_place()
+        assert gamestate.recorded_wpms == []
+        assert snapshot.recorded_wpms == copied.recorded_wpms == [10]
+        assert snapshot.median_wpm == 10
+
+
+def test_next_deadline():
+    with freezegun.freeze_time("2020-05-17 10:12:34"):
+        gamestate = GameState.start()
+        assert gamestate.next_deadline() is None
+        gamestate.increment_combo_in_place(KeyCode.from_char("a"))
+        assert gamestate.next_deadline() == time() + gamestate.combo_timeout
+        gamestate.combo_stopped_in_place()
+        assert gamestate.next_deadline() is None
+
+
+def test_take_changes():
+    gamestate = GameState.start(now=100.0)
+    assert gamestate.take_changes() == Changed.ALL
+    assert gamestate.take_changes() == 0
+    gamestate.increment_combo_in_place(KeyCode.from_char("a"), now=101.0)
+    assert gamestate.take_changes() == Changed.COMBO | Changed.WPM | Changed.MAX
+    gamestate.max_combo = 10
+    gamestate.increment_combo_in_place(KeyCode.from_char("a"), now=102.0)
+    assert gamestate.take_changes() == Changed.COMBO
+    gamestate.combo_stopped_in_place(now=112.0)
+    assert gamestate.take_changes() == (
+        Changed.COMBO | Changed.WPM | Changed.LAST_TIMEOUT
+    )
+
+
+def test_pynput_keys_converted():
+    from pynput.keyboard import Key as PynputKey
+
+    from power_mode.keys import from_pynput
+
+    assert from_pynput(PynputKey.backspace) is Key.BACKSPACE
+    assert from_pynput(KeyCode.from_char("a")) is Key.OTHER
+    # Passed straight in, they still count as what they are
+    gamestate = GameState.start(0.0).increment_combo(PynputKey.backspace, 1.0)
+    assert gamestate.num_backspaces == 1
+
+
+def test_increment_by():
+    state = GameState.start(0.0)
+    one_at_a_time = state.copy()
+    for key in [KeyCode.from_char("a"), Key.BACKSPACE, KeyCode.from_char("b")]:
+        one_at_a_time.increment_combo_in_place(key, 2.0)
+    assert state.increment_by(3, backspaces=1, now=2.0) == one_at_a_time
+    assert state.increment_by(0, now=2.0) == state
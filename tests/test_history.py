@@ -0,0 +1,165 @@
+import os
+from datetime import date, datetime
+from pathlib import Path
+from unittest.mock import Mock
+
+import pytest
+from pynput.keyboard import KeyCode
+
+from power_mode.clock import VirtualClock
+from power_mode.history import MAGIC, RECORD, SessionHistory, SessionRecord
+from power_mode.main import GameManager, GameState
+
+KEY = KeyCode.from_char("a")
+DAY_ONE = datetime(2024, 3, 1, 12).timestamp()
+DAY_TWO = datetime(2024, 3, 2, 12).timestamp()
+
+
+def _record(end: float, combo: int, median_wpm: int = 60) -> SessionRecord:
+    return SessionRecord(end - 10, end, combo, median_wpm, median_wpm + 5, 0)
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> str:
+    return str(tmp_path / "history")
+
+
+def test_queries(path: str):
+    history = SessionHistory(path, wall_clock=lambda: DAY_TWO)
+    assert history.all_time_best() is None
+    assert history.best_today() is None
+    assert history.top_combos() == []
+    for end, combo, wpm in [
+        (DAY_ONE, 50, 70),
+        (DAY_ONE + 60, 80, 50),
+        (DAY_TWO, 30, 90),
+        (DAY_TWO + 60, 80, 40),
+    ]:
+        history.add(_record(end, combo, wpm))
+
+    assert len(history) == 4
+    # The first to reach a combo keeps the record
+    assert history.all_time_best() == _record(DAY_ONE + 60, 80, 50)
+    assert history.best_median_wpm() == _record(DAY_TWO, 30, 90)
+    assert history.best_today() == _record(DAY_TWO + 60, 80, 40)
+    assert history.best_on(date.fromtimestamp(DAY_ONE)) == _record(DAY_ONE + 60, 80, 50)
+    assert [record.combo for record in history.top_combos(3)] == [80, 80, 50]
+    assert history.top_combos(3)[0].end == DAY_ONE + 60
+    history.close()
+
+
+def test_survives_restart(path: str):
+    history = SessionHistory(path)
+    history.add(_record(DAY_ONE, 50))
+    history.add(_record(DAY_TWO, 70))
+    history.close()
+    assert os.path.getsize(path) == len(MAGIC) + 2 * RECORD.size
+
+    history = SessionHistory(path)
+    assert len(history) == 2
+    assert history.all_time_best() == _record(DAY_TWO, 70)
+    history.add(_record(DAY_TWO, 90))
+    # Read from memory until it is flushed
+    assert history.record(2) == _record(DAY_TWO, 90)
+    assert history.all_time_best() == _record(DAY_TWO, 90)
+    history.close()
+
+
+def test_index_rebuilt(path: str):
+    history = SessionHistory(path)
+    history.add(_record(DAY_ONE, 50))
+    history.flush()
+    history.add(_record(DAY_TWO, 70))
+    history.close()
+    os.remove(f"{path}.idx")
+    with open(path, "ab") as f:
+        # Cut off mid write
+        f.write(b"\x00" * 5)
+
+    history = SessionHistory(path)
+    assert len(history) == 2
+    assert history.best_on(date.fromtimestamp(DAY_ONE)) == _record(DAY_ONE, 50)
+    assert history.all_time_best() == _record(DAY_TWO, 70)
+    history.close()
+
+
+def test_index_behind(path: str):
+    history = SessionHistory(path)
+    history.add(_record(DAY_ONE, 50))
+    history.flush()
+    with open(f"{path}.idx", "rb") as f:
+        old_index = f.read()
+    history.add(_record(DAY_TWO, 70))
+    history.close()
+    with open(f"{path}.idx", "wb") as f:
+        f.write(old_index)
+
+    history = SessionHistory(path)
+    assert history.all_time_best() == _record(DAY_TWO, 70)
+    assert [record.combo for record in history.top_combos()] == [70, 50]
+    history.close()
+
+
+def test_top_combos_beyond_index(path: str):
+    history = SessionHistory(path)
+    history.TOP_N = 2
+    for combo in [10, 40, 30, 20]:
+        history.add(_record(DAY_ONE, combo))
+    assert [record.combo for record in history.top_combos(2)] == [40, 30]
+    assert [record.combo for record in history.top_combos(3)] == [40, 30, 20]
+    history.close()
+
+
+def test_not_a_history(path: str):
+    with open(path, "wb") as f:
+        f.write(b"something else")
+    with pytest.raises(ValueError):
+        SessionHistory(path)
+
+
+def test_game_manager_records_combos(path: str):
+    clock = VirtualClock()
+    history = SessionHistory(path, wall_clock=lambda: DAY_ONE + clock.now)
+    manager = GameManager([Mock()], clock)
+    manager.history = history
+    for _ in range(30):
+        clock.advance(0.1)
+        manager.trigger_key_down(KEY)
+    clock.advance(10)
+    manager.trigger_tick()
+
+    record = history.all_time_best()
+    assert record is not None
+    assert record.combo == 30
+    assert record.end - record.start == pytest.approx(12.9)
+    assert record.max_wpm > 0
+    history.close()
+
+
+def test_restore_records(path: str):
+    history = SessionHistory(path)
+    history.add(_record(DAY_ONE, 50, 90))
+    state = GameState.start()
+    history.restore_records(state)
+    assert state.max_combo == 50
+    assert state.max_median_wpm == 90
+    history.close()
+
+
+def test_max_wpm_covers_whole_combo(path: str):
+    history = SessionHistory(path, wall_clock=lambda: DAY_TWO)
+    state = GameState.start(0.0).increment_by(500, now=0.0)
+    state.combo_start = -60.0
+    # A fast start, then well over MAX_RECORDED_WPMS slower words
+    state.record_wpm_in_place(0.0)
+    fastest = state.max_wpm
+    state.combo_start = -600.0
+    for _ in range(GameState.MAX_RECORDED_WPMS + 20):
+        state.record_wpm_in_place(0.0)
+    assert fastest not in state.recorded_wpms
+    history.combo_ended(state, 0.0)
+    best = history.all_time_best()
+    history.close()
+    assert best and best.max_wpm == fastest
+    state.combo_stopped_in_place(0.0)
+    assert state.max_wpm == 0
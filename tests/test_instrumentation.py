@@ -0,0 +1,105 @@
+import json
+from pathlib import Path
+from unittest.mock import Mock
+
+import freezegun
+from pynput.keyboard import KeyCode
+
+from power_mode.clock import VirtualClock
+from power_mode.instrumentation import Instrumentation, LatencyHistogram, StatsFile
+from power_mode.main import (
+    BalloonFanController,
+    BellController,
+    GameManager,
+    GameState,
+)
+from power_mode.timeseries import WpmTimeSeries
+
+
+def test_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0.0
+    for _ in range(98):
+        histogram.record(0.000_003)
+    histogram.record(0.000_150)
+    histogram.record(2.0)
+    assert histogram.count == 100
+    assert histogram.max == 2.0
+    assert histogram.percentile(50) == 5
+    assert histogram.percentile(99) == 200
+    assert histogram.percentile(100) is None
+    assert histogram.stats()["buckets"] == [[5, 98], [200, 1], [None, 1]]
+
+
+def test_manager_instrumentation():
+    bells = BellController(Mock())
+    balloon = BalloonFanController(Mock())
+    with freezegun.freeze_time("2020-05-17 10:12:34") as frozen_time:
+        manager = GameManager([bells, balloon])
+        manager.instrumentation = Instrumentation()
+        manager.trigger_tick()
+        for _ in range(5):
+            manager.trigger_key_down(KeyCode.from_char("a"))
+        manager.trigger_tick()
+        frozen_time.tick(11)
+        manager.trigger_tick()
+
+    stats = manager.instrumentation.stats(manager.serial_controllers)
+    assert stats["key_down"]["count"] == 5
+    assert stats["tick"]["count"] == 3
+    assert stats["increment_combo"]["count"] == 5
+    assert stats["combo_stopped"]["count"] == 1
+    balloon_stats = stats["controllers"]["BalloonFanController"]
+    assert balloon_stats["key_down"]["count"] == 5
+    assert balloon_stats["tick"]["count"] == 3
+    assert balloon_stats["serial_write"]["count"] == 3
+    assert balloon_stats["messages_written"] == 3
+    assert balloon_stats["bytes_written"] == len(b"0,0;1,0;0,0;")
+    # All four bells are already ringing for the fifth key
+    assert stats["controllers"]["BellController"]["messages_written"] == 6
+    assert stats["controllers"]["BellController"]["dedup_hits"] == 1
+    # Nothing had changed for the bells on the tick straight after the keys
+    assert stats["controllers"]["BellController"]["skipped_ticks"] == 1
+    assert stats["controllers"]["BellController"]["tick"]["count"] == 2
+
+
+def test_dedup_hits_without_instrumentation():
+    balloon = BalloonFanController(Mock())
+    game_state = GameState.start()
+    balloon.tick(game_state)
+    balloon.tick(game_state)
+    balloon.tick(game_state)
+    assert balloon.write_stats() == {
+        "messages_written": 1,
+        "bytes_written": 4,
+        "dedup_hits": 2,
+    }
+    assert balloon.histograms is None
+
+
+def test_stats_file(tmp_path: Path):
+    path = tmp_path / "stats.json"
+    manager = GameManager([BalloonFanController(Mock())])
+    stats_file = StatsFile(manager, path, interval=0.01)
+    stats_file.start()
+    manager.trigger_tick()
+    stats_file.stop()
+    stats = json.loads(path.read_text())
+    assert stats["tick"]["count"] == 1
+    assert stats["controllers"]["BalloonFanController"]["connected"] is True
+    assert "wpm_last_hour" not in stats
+
+
+def test_stats_file_has_recent_wpm(tmp_path: Path):
+    path = tmp_path / "stats.json"
+    clock = VirtualClock()
+    manager = GameManager([], clock)
+    manager.track_wpm(WpmTimeSeries(wall_clock=lambda: clock.now, clock=clock))
+    for _ in range(40):
+        clock.advance(0.1)
+        manager.trigger_key_down(KeyCode.from_char("a"))
+    StatsFile(manager, path).write()
+    # Samples reach the minutes once the second they came in is over
+    (sample,) = json.loads(path.read_text())["wpm_last_hour"]
+    time, wpm, combo, samples = sample
+    assert wpm > 0 and 25 <= combo <= 40 and samples >= 1
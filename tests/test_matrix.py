@@ -0,0 +1,55 @@
+from power_mode.matrix import (
+    HEIGHT,
+    MAX_RUNS,
+    WIDTH,
+    apply_rect,
+    color333,
+    dirty_rects,
+    encode_runs,
+    render_page,
+)
+
+
+def test_encode_runs():
+    assert encode_runs(b"\x00\x00\x00\x07\x00") == b"\x03\x00\x01\x07\x01\x00"
+    assert encode_runs(bytes(300)) == b"\xff\x00\x2d\x00"
+
+
+def test_render_page():
+    frame = render_page("c", "7", 1.0)
+    green = color333(0, 7, 0)
+    # The time bar is full width and green
+    assert frame[29 * WIDTH : 30 * WIDTH] == bytes([green]) * WIDTH
+    # Half the time left is half the bar, red
+    frame = render_page("c", "7", 0.5)
+    red = color333(7, 0, 0)
+    assert frame[29 * WIDTH : 30 * WIDTH] == bytes(16) + bytes([red]) * 32 + bytes(16)
+    # COMBO starts at column 18 in blue, the C's top row is one in
+    assert frame[WIDTH + 18] == color333(0, 0, 7)
+    assert not any(frame[:18])
+
+
+def test_dirty_rects_only_cover_changes():
+    shown = render_page("c", "123", 0.7)
+    frame = render_page("c", "124", 0.7)
+    rects = dirty_rects(shown, frame)
+    # The last digit, drawn three times the font size
+    assert [(rect.x, rect.y, rect.h) for rect in rects] == [(44, 7, 21)]
+    assert rects[0].w <= 18
+    applied = bytearray(shown)
+    for rect in rects:
+        apply_rect(applied, rect)
+    assert applied == frame
+    assert dirty_rects(frame, frame) == []
+
+
+def test_unknown_screen_gets_everything():
+    # A frame too busy for one rect is split
+    frame = bytearray(i % 2 for i in range(WIDTH * HEIGHT))
+    rects = dirty_rects(None, frame)
+    assert len(rects) > 1
+    assert all(len(rect.runs) // 2 <= MAX_RUNS for rect in rects)
+    applied = bytearray(b"\xff" * WIDTH * HEIGHT)
+    for rect in rects:
+        apply_rect(applied, rect)
+    assert applied == frame
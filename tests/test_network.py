@@ -0,0 +1,155 @@
+import socket
+from typing import Iterator, List
+from unittest.mock import Mock
+
+import pytest
+from pynput.keyboard import KeyCode
+
+from power_mode.clock import VirtualClock
+from power_mode.main import GameManager
+from power_mode.network import (
+    FIELDS,
+    NetworkController,
+    StateFrame,
+    StateReceiver,
+    UdpConnection,
+    open_receiver,
+)
+
+KEY = KeyCode.from_char("a")
+
+
+@pytest.fixture
+def clock() -> VirtualClock:
+    return VirtualClock()
+
+
+@pytest.fixture
+def receiver_socket() -> Iterator[socket.socket]:
+    sock = open_receiver(0, interface="127.0.0.1")
+    sock.settimeout(1.0)
+    yield sock
+    sock.close()
+
+
+def _frames(controller: NetworkController) -> List[StateFrame]:
+    return [
+        StateFrame.from_bytes(call.args[0])
+        for call in controller.serial_connection.write.call_args_list
+    ]
+
+
+def test_frame_round_trip():
+    frame = StateFrame(7, False, 9500, ((0, 3), (1, 12), (5, 80)))
+    data = frame.to_bytes()
+    assert len(data) == 12 + 3 * 4
+    assert StateFrame.from_bytes(data) == frame
+
+
+def test_bad_frames_rejected():
+    with pytest.raises(ValueError):
+        StateFrame.from_bytes(b"PM")
+    with pytest.raises(ValueError):
+        StateFrame.from_bytes(b"XX" + StateFrame(0, True, 0, ()).to_bytes()[2:])
+    with pytest.raises(ValueError):
+        StateFrame.from_bytes(StateFrame(0, True, 0, ((0, 1),)).to_bytes()[:-1])
+
+
+def test_only_changes_sent_between_keyframes(clock: VirtualClock):
+    controller = NetworkController(Mock())
+    manager = GameManager([controller], clock)
+    manager.trigger_tick()
+    clock.advance(0.1)
+    manager.trigger_key_down(KEY)
+
+    keyframe, delta = _frames(controller)
+    assert keyframe.keyframe
+    assert [index for index, _ in keyframe.fields] == list(range(len(FIELDS)))
+    assert not delta.keyframe
+    assert dict(delta.fields) == {
+        FIELDS.index("current_combo"): 1,
+        FIELDS.index("max_combo"): 1,
+    }
+    assert delta.time_left_ms == 10_000
+    assert delta.sequence == keyframe.sequence + 1
+
+
+def test_keyframe_each_interval(clock: VirtualClock):
+    controller = NetworkController(Mock())
+    manager = GameManager([controller], clock)
+    manager.trigger_tick()
+    # Nothing changed, nothing sent until the next keyframe is due
+    clock.advance(0.5)
+    manager.trigger_tick()
+    assert len(_frames(controller)) == 1
+    assert manager.next_deadline() == pytest.approx(clock.now + 0.5)
+    clock.advance(0.5)
+    manager.trigger_tick()
+    frames = _frames(controller)
+    assert len(frames) == 2
+    assert frames[1].keyframe
+
+
+def test_receiver_recovers_at_keyframe(clock: VirtualClock):
+    sender = NetworkController(Mock())
+    manager = GameManager([sender], clock)
+    receiver = StateReceiver(clock)
+    manager.trigger_tick()
+    for _ in range(3):
+        clock.advance(0.1)
+        manager.trigger_key_down(KEY)
+    clock.advance(1)
+    manager.trigger_tick()
+    frames = [call.args[0] for call in sender.serial_connection.write.call_args_list]
+
+    assert receiver.feed(frames[0])
+    assert receiver.synced
+    # The second frame is lost
+    assert receiver.feed(frames[2])
+    assert receiver.frames_lost == 1
+    assert not receiver.synced
+    assert receiver.state.current_combo == 2
+    assert receiver.state.max_combo == 2
+    # Late and duplicate frames are ignored
+    assert not receiver.feed(frames[1])
+    assert not receiver.feed(frames[2])
+    assert receiver.feed(frames[3])
+    assert receiver.feed(frames[4])
+    assert receiver.synced
+    assert receiver.state.current_combo == 3
+    assert receiver.state.percent_time_left_at(clock.now) == pytest.approx(0.9)
+    assert not receiver.feed(b"garbage")
+    assert receiver.bad_frames == 1
+
+
+def test_receiver_sequence_wraps(clock: VirtualClock):
+    receiver = StateReceiver(clock)
+    assert receiver.feed(StateFrame(0xFFFFFFFF, True, 0, ()).to_bytes())
+    assert receiver.feed(StateFrame(0, False, 0, ((0, 1),)).to_bytes())
+    assert receiver.frames_lost == 0
+    assert receiver.state.current_combo == 1
+
+
+def test_loopback(clock: VirtualClock, receiver_socket: socket.socket):
+    connection = UdpConnection(receiver_socket.getsockname())
+    controller = NetworkController(connection)
+    manager = GameManager([controller], clock)
+    receiver = StateReceiver(clock)
+    manager.trigger_tick()
+    manager.trigger_key_down(KEY)
+    for _ in range(2):
+        receiver.feed(receiver_socket.recv(1024))
+    assert receiver.synced
+    assert receiver.state.current_combo == 1
+    assert controller.messages_written == 2
+    controller.close()
+
+
+def test_send_errors_never_raise():
+    connection = UdpConnection(("127.0.0.1", 9))
+    controller = NetworkController(connection)
+    connection.close()
+    # Writing on the closed socket fails, the controller stays connected
+    controller.send(b"frame")
+    assert connection.send_errors == 1
+    assert controller.connected
@@ -0,0 +1,125 @@
+from unittest.mock import Mock, call
+
+import pytest
+from pynput.keyboard import KeyCode
+
+from power_mode.main import BalloonFanController, GameState
+from power_mode.protocol import (
+    ASCII,
+    BINARY,
+    BalloonFanMessage,
+    BellMessage,
+    BellPulse,
+    BinaryDecoder,
+    MatrixRect,
+    ScreenMessage,
+    StripClear,
+    StripPixels,
+    percent_tenths,
+)
+
+MESSAGES = [
+    ScreenMessage("c", 7, 1039),
+    ScreenMessage("w", 10, 85),
+    ScreenMessage("e", 0, 1000, 80),
+    BellMessage((True, False, True, False)),
+    StripPixels(143, 143, 5),
+    StripPixels(0, 9, 2),
+    StripClear(),
+    BalloonFanMessage(True, False),
+]
+
+
+def test_ascii():
+    assert [ASCII.encode(message) for message in MESSAGES] == [
+        b"c,0.7,1039;",
+        b"w,1.0,85;",
+        b"e,0.0,1000  80;",
+        b"1010",
+        b"143,5;",
+        b"0,2,9;",
+        b"0,e;",
+        b"1,0;",
+    ]
+
+
+def test_percent_tenths():
+    assert percent_tenths(1) == 10
+    assert percent_tenths(0.7) == 7
+    assert percent_tenths(0.849) == 8
+    assert percent_tenths(0.851) == 9
+    assert percent_tenths(0.04) == 0
+
+
+@pytest.mark.parametrize("message", MESSAGES)
+def test_binary_round_trip(message):
+    frame = BINARY.encode(message)
+    assert BinaryDecoder().feed(frame) == [message]
+
+
+def test_binary_frames_are_smaller():
+    assert len(BINARY.encode(ScreenMessage("c", 7, 1039))) == 7
+    assert len(BINARY.encode(ScreenMessage("e", 0, 1000, 80))) == 9
+    assert len(BINARY.encode(StripPixels(0, 9, 2))) == 5
+    ascii_bytes = sum(len(ASCII.encode(message)) for message in MESSAGES)
+    binary_bytes = sum(len(BINARY.encode(message)) for message in MESSAGES)
+    assert binary_bytes < ascii_bytes * 0.75
+
+
+def test_decoder_handles_split_frames():
+    stream = b"".join(BINARY.encode(message) for message in MESSAGES)
+    decoder = BinaryDecoder()
+    decoded = []
+    for i in range(len(stream)):
+        decoded += decoder.feed(stream[i : i + 1])
+    assert decoded == MESSAGES
+
+
+def test_decoder_drops_bad_frames():
+    good = BINARY.encode(BalloonFanMessage(True, True))
+    corrupted = bytearray(BINARY.encode(StripPixels(0, 9, 2)))
+    corrupted[2] ^= 0xFF
+    decoder = BinaryDecoder()
+    assert decoder.feed(b"\x00junk" + bytes(corrupted) + good) == [
+        BalloonFanMessage(True, True)
+    ]
+    assert decoder.bad_frames == 1
+    assert decoder.skipped_bytes == 5
+
+
+def test_controller_with_binary_codec():
+    mock_serial = Mock()
+    controller = BalloonFanController(mock_serial, BINARY)
+    gamestate = GameState.start()
+    controller.tick(gamestate)
+    controller.tick(gamestate.increment_combo(KeyCode.from_char("a")))
+    assert mock_serial.write.call_args_list == [
+        call(BINARY.encode(BalloonFanMessage(False, False))),
+        call(BINARY.encode(BalloonFanMessage(True, False))),
+    ]
+    frames = b"".join(args[0] for args, _ in mock_serial.write.call_args_list)
+    assert BinaryDecoder().feed(frames) == [
+        BalloonFanMessage(False, False),
+        BalloonFanMessage(True, False),
+    ]
+
+
+def test_matrix_rect_round_trip():
+    rect = MatrixRect(2, 3, 4, 2, b"\x03\x1c\x05\x00")
+    frame = BINARY.encode(rect)
+    assert frame[:6] == b"R\x02\x03\x04\x02\x02"
+    decoder = BinaryDecoder()
+    # The length is only known once the header is in
+    assert decoder.feed(frame[:4]) == []
+    assert decoder.feed(frame[4:]) == [rect]
+    with pytest.raises(ValueError):
+        ASCII.encode(rect)
+
+
+def test_bell_pulse_round_trip():
+    pulse = BellPulse((False, True, False, True), 100)
+    frame = BINARY.encode(pulse)
+    assert frame == b"T\x0a\x64\x00\xc2"
+    assert BinaryDecoder().feed(frame) == [pulse]
+    with pytest.raises(ValueError):
+        ASCII.encode(pulse)
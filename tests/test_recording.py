@@ -0,0 +1,151 @@
+import random
+from pathlib import Path
+from typing import List
+from unittest.mock import Mock
+
+import pytest
+from pynput.keyboard import KeyCode
+
+from power_mode.clock import Clock, VirtualClock
+from power_mode.keys import Key
+from power_mode.main import (
+    AnimatedStripController,
+    BalloonFanController,
+    BellController,
+    GameManager,
+    PulsedBellController,
+    RenderedScreenController,
+    ScreenController,
+    StripController,
+)
+from power_mode.memory_serial import MemorySerial
+from power_mode.recording import (
+    BACKSPACE,
+    KEY,
+    MAGIC,
+    TICK,
+    Event,
+    SessionRecorder,
+    Setup,
+    read_events,
+    read_recording,
+    replay,
+)
+
+
+def _manager(clock: Clock) -> GameManager:
+    return GameManager(
+        [
+            ScreenController(Mock()),
+            BellController(Mock()),
+            StripController(Mock()),
+            BalloonFanController(Mock()),
+        ],
+        clock,
+    )
+
+
+def _writes(manager: GameManager) -> List[list]:
+    return [
+        controller.serial_connection.write.call_args_list
+        for controller in manager.serial_controllers
+    ]
+
+
+def test_record_and_replay(tmp_path: Path):
+    path = str(tmp_path / "session.pmrec")
+    clock = VirtualClock()
+    random.seed(1)
+    recorded = _manager(clock)
+    recorded.recorder = SessionRecorder(path, clock=clock)
+    recorded.trigger_tick()
+    for i in range(30):
+        clock.advance(0.15)
+        recorded.trigger_key_down(
+            Key.BACKSPACE if i % 10 == 9 else KeyCode.from_char("x")
+        )
+        clock.advance(0.05)
+        recorded.trigger_tick()
+    clock.advance(11)
+    recorded.trigger_tick()
+    recorded.recorder.close()
+
+    events = list(read_events(path))
+    assert len(events) == 62
+    assert events[0] == Event(0.0, TICK)
+    assert events[1].offset == pytest.approx(0.15)
+    assert events[1].kind == KEY
+    assert events[19].kind == BACKSPACE
+    assert events[19].key == Key.BACKSPACE
+
+    random.seed(1)
+    replayed = replay(events, _manager)
+    assert replayed.game_state == recorded.game_state
+    assert _writes(replayed) == _writes(recorded)
+
+
+def test_partial_event_is_ignored(tmp_path: Path):
+    path = tmp_path / "session.pmrec"
+    clock = VirtualClock()
+    recorder = SessionRecorder(str(path), clock=clock)
+    recorder.key_down(KeyCode.from_char("a"))
+    clock.now += 1
+    recorder.tick()
+    recorder.close()
+    path.write_bytes(path.read_bytes() + b"\x00\x01")
+    assert list(read_events(str(path))) == [Event(0.0, KEY), Event(1.0, TICK)]
+
+
+def test_not_a_recording(tmp_path: Path):
+    path = tmp_path / "session.pmrec"
+    path.write_bytes(b"1,0;" + MAGIC)
+    with pytest.raises(ValueError):
+        list(read_events(str(path)))
+
+
+def test_no_events_lost_while_flushing(tmp_path: Path):
+    path = str(tmp_path / "session.pmrec")
+    recorder = SessionRecorder(path, VirtualClock())
+    recorder.FLUSH_INTERVAL = 0.0001
+    for _ in range(20_000):
+        recorder.tick()
+    recorder.close()
+    assert recorder.events_written == 20_000
+    assert len(list(read_events(path))) == 20_000
+
+
+def test_replay_matches_the_recorded_setup(tmp_path: Path):
+    path = str(tmp_path / "session.pmrec")
+    clock = VirtualClock()
+    random.seed(1)
+    recorded = GameManager(
+        [
+            RenderedScreenController(MemorySerial(baudrate=9600)),
+            PulsedBellController(MemorySerial()),
+            AnimatedStripController(MemorySerial()),
+        ],
+        clock,
+        coalesce_window=0.01,
+    )
+    recorded.recorder = SessionRecorder(path, clock, Setup.of(recorded))
+    for i in range(40):
+        clock.advance(0.004 if i % 4 else 0.1)
+        recorded.trigger_key_down(KeyCode.from_char("x"))
+        if i % 4 == 3:
+            clock.advance(0.02)
+            recorded.trigger_tick()
+    recorded.recorder.close()
+
+    setup, events = read_recording(path)
+    assert setup == Setup.of(recorded)
+    assert setup.coalesce_window == 0.01
+    random.seed(1)
+    replayed = replay(events, setup.memory_manager)
+    assert replayed.game_state == recorded.game_state
+    assert [
+        (type(controller), controller.serial_connection.bytes)
+        for controller in replayed.serial_controllers
+    ] == [
+        (type(controller), controller.serial_connection.bytes)
+        for controller in recorded.serial_controllers
+    ]
@@ -0,0 +1,57 @@
+import math
+import random
+import statistics
+
+from power_mode.rolling_median import RollingMedian
+
+
+def test_empty():
+    window = RollingMedian()
+    assert window.median == 0
+    assert len(window) == 0
+    assert window == []
+
+
+def test_median():
+    assert RollingMedian([10, 20, 30]).median == 20
+    assert RollingMedian([10, 20, 30, 41]).median == 25
+    assert RollingMedian([5, 5, 5, 5]).median == 5
+
+
+def test_evicts_oldest():
+    window = RollingMedian([1, 2, 3], maxlen=3)
+    window.append(100)
+    assert window == [2, 3, 100]
+    assert window[-1] == 100
+    assert window.median == 3
+
+
+def test_matches_statistics_median():
+    rng = random.Random(1234)
+    window = RollingMedian(maxlen=100)
+    values = []
+    for _ in range(2000):
+        value = rng.randint(0, 150)
+        window.append(value)
+        values = (values + [value])[-100:]
+        assert window == values
+        assert window.median == math.floor(statistics.median(values))
+
+
+def test_copy_is_independent():
+    window = RollingMedian([1, 2, 3])
+    copied = window.copy()
+    copied.append(10)
+    assert window == [1, 2, 3]
+    assert copied == [1, 2, 3, 10]
+    assert window.median == 2
+    assert copied.median == 2
+
+
+def test_clear():
+    window = RollingMedian([1, 2, 3])
+    window.clear()
+    assert window == []
+    assert window.median == 0
+    window.append(7)
+    assert window.median == 7
@@ -0,0 +1,44 @@
+from time import sleep
+from typing import Generator, Tuple
+from unittest.mock import Mock
+
+import pytest
+from pynput.keyboard import KeyCode
+
+from power_mode.main import BellController, GameManager
+from power_mode.scheduler import TickScheduler
+
+
+@pytest.fixture
+def running_bells() -> Generator[Tuple[TickScheduler, Mock], None, None]:
+    mock_serial = Mock()
+    scheduler = TickScheduler(GameManager([BellController(mock_serial)]))
+    scheduler.start()
+    yield scheduler, mock_serial
+    scheduler.stop()
+
+
+def test_first_tick_is_immediate(running_bells: Tuple[TickScheduler, Mock]):
+    scheduler, mock_serial = running_bells
+    sleep(0.05)
+    assert scheduler.ticks == 1
+    assert mock_serial.write.call_count == 1
+
+
+def test_idle_does_not_tick(running_bells: Tuple[TickScheduler, Mock]):
+    scheduler, _ = running_bells
+    sleep(0.2)
+    assert scheduler.ticks == 1
+    assert scheduler.seconds_until_next_tick() is None
+
+
+def test_ticks_on_deadlines(running_bells: Tuple[TickScheduler, Mock]):
+    scheduler, mock_serial = running_bells
+    sleep(0.02)
+    scheduler.trigger_key_down(KeyCode.from_char("a"))
+    assert mock_serial.write.call_args_list[-1].args == (b"1000",)
+    # The bell turns off after 0.1s, the combo timeout is 10s away
+    sleep(0.2)
+    assert mock_serial.write.call_args_list[-1].args == (b"0000",)
+    assert scheduler.ticks == 2
+    assert scheduler.seconds_until_next_tick() == pytest.approx(9.8, abs=0.1)
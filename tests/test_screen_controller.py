@@ -1,11 +1,15 @@
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from time import time
 from unittest.mock import Mock, call
 
 import freezegun
+import pytest
 from pynput.keyboard import KeyCode
 
-from power_mode.main import GameState, ScreenController
+from power_mode.main import GameState, RenderedScreenController, ScreenController
+from power_mode.matrix import render_page
+from power_mode.protocol import ASCII
+from power_mode.simulator import ComboDisplayFirmware
 
 
 def test_screen_tick():
@@ -104,3 +108,121 @@ def test_count_down():
         controller.tick(game_state.combo_stopped())
         assert mock_serial.write.call_args_list == [call(b"e,0.0,1000  80;")]
         mock_serial.reset_mock()
+
+
+def test_next_deadline():
+    mock_serial = Mock()
+    with freezegun.freeze_time("2020-05-17 10:12:34") as frozen_time:
+        game_state = GameState.start()
+        controller = ScreenController(mock_serial)
+        # Nothing written yet so we want a tick straight away
+        assert controller.next_deadline(game_state, time()) == time()
+        controller.tick(game_state)
+        # Idle, nothing will change until a key is pressed
+        assert controller.next_deadline(game_state, time()) is None
+
+        game_state = game_state.increment_combo(KeyCode.from_char("a"))
+        key_time = time()
+        # Redraws are rate limited
+        assert controller.next_deadline(game_state, time()) == pytest.approx(
+            controller.last_write + controller.REDRAW_INTERVAL
+        )
+        frozen_time.tick(delta=timedelta(seconds=1))
+        controller.tick(game_state)
+        assert mock_serial.write.call_args == call(b"c,0.9,1;")
+        # 0.9 turns into 0.8 once less than 85% of the time is left
+        deadline = controller.next_deadline(game_state, time())
+        assert deadline == pytest.approx(key_time + 1.5 + controller.PERCENT_STEP_SLACK)
+
+        frozen_time.move_to(datetime.fromtimestamp(deadline, tz=timezone.utc))
+        assert controller.next_deadline(game_state, time()) == time()
+        controller.tick(game_state)
+        assert mock_serial.write.call_args == call(b"c,0.8,1;")
+
+        frozen_time.move_to(datetime.fromtimestamp(key_time + 9.6, tz=timezone.utc))
+        controller.tick(game_state)
+        assert mock_serial.write.call_args == call(b"c,0.0,1;")
+        # The combo timeout itself is the game state's deadline
+        assert controller.next_deadline(game_state, time()) is None
+
+
+def test_next_deadline_mode_change():
+    mock_serial = Mock()
+    with freezegun.freeze_time("2020-05-17 10:12:34"):
+        game_state = GameState.start().copy(
+            current_combo=999,
+            recorded_wpms=[100],
+            time_of_last_key=time(),
+            combo_timeout=100,
+        )
+        controller = ScreenController(mock_serial)
+        controller.tick(game_state)
+        assert controller.next_deadline(game_state, time()) == (
+            controller.last_mode_change + controller.MODE_CHANGE_TIME
+        )
+
+
+def test_rendered_screen_sends_changed_rows():
+    mock_serial = Mock(baudrate=115200)
+    controller = RenderedScreenController(mock_serial, ASCII)
+    screen = ComboDisplayFirmware()
+    game_state = GameState.start(0.0).increment_by(1, now=0.0)
+    controller.tick(game_state, 0.0)
+    # The first frame covers the whole screen, as what's on it isn't known
+    first_frame = mock_serial.write.call_args.args[0]
+    for byte in first_frame:
+        screen.feed(byte)
+    assert screen.pixels == render_page("c", "1", 1.0)
+
+    game_state = game_state.increment_by(1, now=1.0)
+    controller.tick(game_state, 1.0)
+    assert controller.next_deadline(game_state, 1.0) is not None
+    frame = mock_serial.write.call_args.args[0]
+    # Just the digit
+    assert frame[:3] == b"R\x19\x07"
+    assert len(frame) < len(first_frame) / 4
+    for byte in frame:
+        screen.feed(byte)
+    assert screen.pixels == render_page("c", "2", 1.0)
+    assert screen.bad_frames == 0
+
+
+def test_rendered_screen_redraws_after_lost_frames():
+    controller = RenderedScreenController(Mock(baudrate=115200))
+    writer = controller.writer = Mock(frames_dropped=0)
+
+    def page_sent(combo: int, now: float) -> bytes:
+        writer.reset_mock()
+        game_state = GameState.start(0.0).increment_by(combo, now=0.0)
+        controller.tick(game_state, now)
+        return writer.submit.call_args.args[0]
+
+    # A rect's position and size, the first covers the whole screen
+    full_screen = page_sent(1, 0.0)[:5]
+    assert page_sent(2, 1.0)[:5] != full_screen
+    writer.frames_dropped = 1
+    assert page_sent(3, 2.0)[:5] != full_screen
+    assert page_sent(4, 3.0)[:5] == full_screen
+    assert page_sent(5, 4.0)[:5] != full_screen
+
+
+def test_rendered_screen_waits_for_the_link():
+    mock_serial = Mock(baudrate=9600)
+    controller = RenderedScreenController(mock_serial)
+    game_state = GameState.start(0.0).increment_by(1, now=0.0)
+    controller.tick(game_state, 0.0)
+    assert mock_serial.write.call_count == 1
+    redraw_at = controller.next_deadline(game_state.increment_by(1, now=0.0), 0.0)
+    assert redraw_at is not None and redraw_at > controller.REDRAW_INTERVAL
+
+    # Ticks for other controllers come sooner, the page waits for the link
+    for combo in range(2, 6):
+        game_state = game_state.increment_by(1, now=combo / 100)
+        controller.tick(game_state, combo / 100)
+    assert mock_serial.write.call_count == 1
+    assert not controller.timer_due(redraw_at - 0.01)
+    assert controller.timer_due(redraw_at)
+    controller.tick(game_state, redraw_at)
+    assert mock_serial.write.call_count == 2
+    assert controller.last_message.display_value == "5"
+    assert not controller.timer_due(redraw_at)
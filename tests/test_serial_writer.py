@@ -0,0 +1,118 @@
+import threading
+from typing import List
+from unittest.mock import Mock, call
+
+from pynput.keyboard import KeyCode
+
+from power_mode.main import GameState, ScreenController, StripController
+from power_mode.serial_writer import SerialWriter
+
+
+class BlockingSerial:
+    def __init__(self) -> None:
+        self.written: List[bytes] = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def write(self, frame: bytes) -> None:
+        self.started.set()
+        self.release.wait()
+        self.written.append(frame)
+
+
+def test_ordered_frames():
+    mock_serial = Mock()
+    writer = SerialWriter(mock_serial, "test", coalesce=False)
+    for i in range(5):
+        writer.submit(f"{i};".encode("utf-8"))
+    assert writer.drain(timeout=1)
+    assert mock_serial.write.call_args_list == [
+        call(f"{i};".encode("utf-8")) for i in range(5)
+    ]
+    assert writer.stats() == {
+        "queue_depth": 0,
+        "frames_written": 5,
+        "bytes_written": 10,
+        "frames_dropped": 0,
+        "write_errors": 0,
+    }
+    writer.stop()
+
+
+def test_coalescing_keeps_newest():
+    blocking_serial = BlockingSerial()
+    writer = SerialWriter(blocking_serial, "test", coalesce=True)
+    writer.submit(b"first")
+    assert blocking_serial.started.wait(timeout=1)
+    # The device is stuck on the first frame, everything else piles up
+    for i in range(5):
+        writer.submit(f"{i}".encode("utf-8"))
+    assert writer.queue_depth == 1
+    blocking_serial.release.set()
+    assert writer.drain(timeout=1)
+    assert blocking_serial.written == [b"first", b"4"]
+    assert writer.frames_dropped == 4
+    writer.stop()
+
+
+def test_ordered_queue_is_bounded():
+    blocking_serial = BlockingSerial()
+    writer = SerialWriter(blocking_serial, "test", coalesce=False, maxsize=3)
+    writer.submit(b"first")
+    assert blocking_serial.started.wait(timeout=1)
+    for i in range(5):
+        writer.submit(f"{i}".encode("utf-8"))
+    assert writer.queue_depth == 3
+    blocking_serial.release.set()
+    assert writer.drain(timeout=1)
+    assert blocking_serial.written == [b"first", b"2", b"3", b"4"]
+    assert writer.frames_dropped == 2
+    writer.stop()
+
+
+def test_write_errors_are_counted():
+    mock_serial = Mock()
+    mock_serial.write.side_effect = [OSError("unplugged"), None]
+    writer = SerialWriter(mock_serial, "test", coalesce=False)
+    writer.submit(b"1")
+    writer.submit(b"2")
+    assert writer.drain(timeout=1)
+    assert writer.write_errors == 1
+    assert writer.frames_written == 1
+    writer.stop()
+
+
+def test_controller_background_writer():
+    blocking_serial = BlockingSerial()
+    controller = ScreenController(blocking_serial)
+    writer = controller.start_background_writer()
+    game_state = GameState.start()
+    # Returns straight away even though the device is stuck
+    controller.tick(game_state)
+    assert blocking_serial.started.wait(timeout=1)
+    for _ in range(3):
+        game_state = game_state.increment_combo(KeyCode.from_char("a"))
+        controller.tick(game_state)
+    blocking_serial.release.set()
+    assert writer.drain(timeout=1)
+    assert blocking_serial.written == [b"e,0.0,0  0;", b"c,1.0,3;"]
+    writer.stop()
+
+
+def test_strip_pacing_moves_to_writer():
+    mock_serial = Mock()
+    controller = StripController(mock_serial)
+    writer = controller.start_background_writer()
+    assert writer.pacing == StripController.WRITE_PACING
+    assert not writer.coalesce
+    game_state = GameState.start().copy(current_combo=1)
+    for second in range(3):
+        controller.key_down(KeyCode.from_char("a"), game_state)
+        controller.tick(game_state, float(second))
+    assert writer.drain(timeout=1)
+    assert mock_serial.write.call_args_list == [
+        call(b"0,0;"),
+        call(b"1,0;"),
+        call(b"2,0;"),
+    ]
+    writer.stop()
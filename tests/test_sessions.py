@@ -0,0 +1,82 @@
+from unittest.mock import Mock
+
+import pytest
+from pynput.keyboard import KeyCode
+
+from power_mode.clock import VirtualClock
+from power_mode.main import BalloonFanController, BellController
+from power_mode.sessions import SessionManager
+
+KEY = KeyCode.from_char("a")
+
+
+@pytest.fixture
+def clock() -> VirtualClock:
+    return VirtualClock()
+
+
+def test_sessions_are_independent(clock: VirtualClock):
+    sessions = SessionManager(clock)
+    one = sessions.add_session("one", [BalloonFanController(Mock())])
+    two = sessions.add_session("two", [BalloonFanController(Mock())])
+    sessions.trigger_key_down("one", KEY)
+    sessions.trigger_key_down("one", KEY)
+    sessions.trigger_key_down("two", KEY)
+    assert one.game_state.current_combo == 2
+    assert two.game_state.current_combo == 1
+    # Not playing
+    sessions.trigger_key_down("three", KEY)
+
+
+def test_only_due_sessions_tick(clock: VirtualClock):
+    sessions = SessionManager(clock)
+    one_bells = BellController(Mock())
+    two_bells = BellController(Mock())
+    one = sessions.add_session("one", [one_bells])
+    two = sessions.add_session("two", [two_bells])
+    one.trigger_tick = Mock(wraps=one.trigger_tick)  # type: ignore
+    two.trigger_tick = Mock(wraps=two.trigger_tick)  # type: ignore
+
+    # Both start out needing a tick to set up their displays
+    assert sessions.next_deadline() == clock.now
+    sessions.trigger_tick()
+    assert one.trigger_tick.call_count == 1
+    assert two.trigger_tick.call_count == 1
+    assert sessions.next_deadline() is None
+
+    sessions.trigger_key_down("one", KEY)
+    clock.advance(0.05)
+    sessions.trigger_key_down("two", KEY)
+    # One's bell turns off first
+    assert sessions.next_deadline() == pytest.approx(clock.now + 0.05)
+    clock.advance(0.05)
+    sessions.trigger_tick()
+    assert one.trigger_tick.call_count == 2
+    assert two.trigger_tick.call_count == 1
+    assert one_bells.serial_connection.write.call_args.args == (b"0000",)
+    assert two_bells.serial_connection.write.call_args.args == (b"1000",)
+
+    # Then the combo timeouts, one's first
+    assert sessions.next_deadline() == pytest.approx(clock.now + 0.05)
+    clock.advance(0.05)
+    sessions.trigger_tick()
+    assert two_bells.serial_connection.write.call_args.args == (b"0000",)
+    assert sessions.next_deadline() == pytest.approx(clock.now + 9.9)
+
+
+def test_remove_session(clock: VirtualClock):
+    sessions = SessionManager(clock)
+    one = sessions.add_session("one", [BalloonFanController(Mock())])
+    assert sessions.remove_session("one") is one
+    assert sessions.next_deadline() is None
+    sessions.trigger_key_down("one", KEY)
+    assert one.game_state.current_combo == 0
+
+
+def test_stale_deadlines_are_dropped(clock: VirtualClock):
+    sessions = SessionManager(clock)
+    sessions.add_session("one", [BellController(Mock())])
+    for _ in range(1000):
+        sessions.trigger_key_down("one", KEY)
+        clock.advance(0.001)
+    assert len(sessions._deadlines) < 100
@@ -0,0 +1,207 @@
+from time import monotonic, sleep
+
+import serial
+
+from power_mode.controllers import BellController, ScreenController
+from power_mode.devices import DeviceSpec
+from power_mode.matrix import dirty_rects, render_page
+from power_mode.protocol import (
+    ACK,
+    ASCII,
+    BINARY,
+    FLOW_CONTROL,
+    READY,
+    BellMessage,
+    BellPulse,
+    ScreenMessage,
+    StripClear,
+    StripPixels,
+)
+from power_mode.simulator import (
+    BellsFirmware,
+    ComboDisplayFirmware,
+    SerialLine,
+    SimulatedDevice,
+    StripFirmware,
+    simulated_registry,
+)
+
+
+def feed(firmware, data: bytes) -> int:
+    return sum(firmware.feed(byte) for byte in data)
+
+
+def test_bells_firmware():
+    bells = BellsFirmware()
+    assert feed(bells, b"101") == 0
+    assert bells.relays == [False] * 4
+    assert feed(bells, b"0") == 1
+    assert bells.relays == [True, False, True, False]
+    assert feed(bells, BINARY.encode(BellMessage((False, True, False, True)))) == 1
+    assert bells.relays == [False, True, False, True]
+    # A bad checksum is thrown away
+    assert feed(bells, b"B\x0f\x00") == 0
+    assert bells.bad_frames == 1
+    assert bells.relays == [False, True, False, True]
+
+
+def test_strip_firmware():
+    strip = StripFirmware()
+    assert feed(strip, ASCII.encode(StripPixels(3, 3, 2))) == 1
+    assert feed(strip, BINARY.encode(StripPixels(140, 200, 5))) == 1
+    assert strip.pixels[3] == 2
+    assert strip.pixels[140:] == [5] * 4
+    assert strip.pixels.count(None) == 139
+    assert feed(strip, ASCII.encode(StripPixels(0, 9, 1))) == 1
+    assert strip.pixels[:10] == [1] * 10
+    assert feed(strip, ASCII.encode(StripClear())) == 1
+    assert strip.pixels == [None] * 144
+    feed(strip, b"999,1;")
+    assert strip.pixels == [None] * 144
+
+
+def test_combo_display_firmware():
+    screen = ComboDisplayFirmware()
+    assert (screen.mode, screen.value, screen.percent) == ("COMBO", "0", 1.0)
+    feed(screen, ASCII.encode(ScreenMessage("w", 5, 87)))
+    assert (screen.mode, screen.value, screen.percent) == ("WPM", "87", 0.5)
+    feed(screen, BINARY.encode(ScreenMessage("e", 10, 1200, 95)))
+    assert (screen.mode, screen.value, screen.percent) == ("MAXC MAXW", "1200  95", 1.0)
+    feed(screen, BINARY.encode(ScreenMessage("c", 3, 70000)))
+    assert (screen.mode, screen.value, screen.percent) == ("COMBO", "70000", 0.3)
+    assert screen.commands == 3
+
+
+def test_serial_line_paces_bytes():
+    line = SerialLine(BellsFirmware(), baudrate=9600, boot=False)
+    assert line.receive(b"1000", now=0.0) == 4 * 10 / 9600
+    assert line.firmware.relays == [True, False, False, False]
+    # Queued behind the first message on the wire
+    assert line.receive(b"0100", now=0.0) == 8 * 10 / 9600
+
+
+def test_serial_line_overflows_while_busy():
+    strip = StripFirmware()
+    line = SerialLine(strip, baudrate=1_000_000, boot=False)
+    clear = ASCII.encode(StripClear())
+    # Each show() takes longer than the next message takes to arrive, so the
+    # receive buffer fills and bytes get lost
+    for _ in range(100):
+        line.receive(clear, now=0.0)
+    line.run_until(1.0)
+    assert line.bytes_dropped > 0
+    assert strip.commands < 100
+    # Spaced out to let show() finish every message gets through
+    line = SerialLine(StripFirmware(), baudrate=1_000_000, boot=False)
+    for i in range(100):
+        line.receive(clear, now=i * 0.01)
+    line.run_until(2.0)
+    assert line.bytes_dropped == 0
+    assert line.firmware.commands == 100
+
+
+def test_serial_line_buffers_while_booting():
+    bells = BellsFirmware()
+    line = SerialLine(bells, baudrate=115200, now=0.0)
+    line.receive(b"1111" * 20, now=0.0)
+    line.run_until(1.0)
+    assert bells.commands == 0
+    line.run_until(2.0)
+    # Only the first 64 bytes fit
+    assert bells.commands == 16
+    assert line.bytes_dropped == 16
+
+
+def test_simulated_device_over_pty():
+    device = SimulatedDevice(BellsFirmware(), "sim-bells", baudrate=115200, boot=False)
+    try:
+        port = serial.Serial(device.device, baudrate=115200)
+        port.write(b"01101001")
+        deadline = monotonic() + 5
+        while not device.settled() and monotonic() < deadline:
+            sleep(0.01)
+        port.close()
+        stats = device.stats()
+        assert stats["commands"] == 2
+        assert stats["bytes_received"] == 8
+        assert device.firmware.relays == [True, False, False, True]
+    finally:
+        device.close()
+
+
+def test_combo_display_pages_and_host_frames_match():
+    screen = ComboDisplayFirmware()
+    feed(screen, ASCII.encode(ScreenMessage("w", 6, 87)))
+    page = bytearray(screen.pixels)
+    for rect in dirty_rects(None, render_page("c", "0", 1.0)):
+        feed(screen, BINARY.encode(rect))
+    assert screen.mode == "WPM"
+    assert screen.pixels == render_page("c", "0", 1.0)
+    for rect in dirty_rects(screen.pixels, page):
+        feed(screen, BINARY.encode(rect))
+    assert screen.pixels == page
+    assert screen.bad_frames == 0
+
+
+def test_firmware_answers_ready_query():
+    bells = BellsFirmware()
+    assert feed(bells, b"10?10") == 1
+    assert bells.relays == [True, False, True, False]
+    assert bells.output == READY
+    # Inside a binary frame it is just a byte
+    strip = StripFirmware()
+    feed(strip, BINARY.encode(StripPixels(0, ord("?"), 1)))
+    assert strip.output == b""
+
+
+def test_ready_byte_after_boot():
+    bells = BellsFirmware()
+    line = SerialLine(bells, baudrate=115200, now=0.0)
+    line.run_until(1.0)
+    assert bells.output == b""
+    line.run_until(bells.BOOT_TIME)
+    assert bells.output == READY
+
+
+def test_registry_waits_for_simulated_boot():
+    specs = [
+        DeviceSpec("bells", BellController),
+        DeviceSpec("screen", ScreenController),
+    ]
+    registry, devices = simulated_registry(specs, 115200, background_writers=False)
+    try:
+        start = monotonic()
+        controllers = registry.connect()
+        elapsed = monotonic() - start
+        assert len(controllers) == 2
+        # Both boot at once, so about one boot time, not two
+        assert BellsFirmware.BOOT_TIME <= elapsed + 0.1 < 2 * BellsFirmware.BOOT_TIME
+    finally:
+        registry.stop()
+        for device in devices:
+            device.close()
+
+
+def test_firmware_acks_frames_once_asked():
+    strip = StripFirmware()
+    feed(strip, ASCII.encode(StripClear()))
+    assert strip.output == b""
+    feed(strip, FLOW_CONTROL)
+    assert strip.output == FLOW_CONTROL + b"\x40\x00"
+    strip.output.clear()
+    feed(strip, ASCII.encode(StripPixels(0, 3, 1)))
+    # Bad frames are acknowledged too, their bytes are gone all the same
+    feed(strip, b"X\x00")
+    assert strip.output == ACK + ACK
+
+
+def test_bells_firmware_pulses():
+    bells = BellsFirmware()
+    assert feed(bells, BINARY.encode(BellPulse((False, True, False, False), 100))) == 1
+    assert bells.relays == [False, True, False, False]
+    assert bells.pulse_ms == [0, 100, 0, 0]
+    # Relays not in a pulse are left alone
+    feed(bells, BINARY.encode(BellPulse((True, False, False, False), 80)))
+    assert bells.relays == [True, True, False, False]
+    feed(bells, b"0000")
+    assert bells.pulse_ms == [0] * 4
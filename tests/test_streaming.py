@@ -0,0 +1,112 @@
+import asyncio
+from unittest.mock import Mock
+
+from pynput.keyboard import KeyCode
+
+from power_mode.clock import VirtualClock
+from power_mode.main import BellController, GameManager
+from power_mode.scheduler import AsyncTickScheduler
+
+
+def test_states_starts_with_current_state():
+    async def first_state():
+        game_manager = GameManager([])
+        game_manager.trigger_key_down(KeyCode.from_char("a"))
+        states = game_manager.states()
+        state = await states.__anext__()
+        await states.aclose()
+        return game_manager, state
+
+    game_manager, state = asyncio.run(first_state())
+    assert state.current_combo == 1
+    assert state == game_manager.game_state
+    assert state is not game_manager.game_state
+    assert game_manager._subscribers == ()
+
+
+def test_slow_consumer_gets_latest_state():
+    async def stream():
+        game_manager = GameManager([])
+        states = game_manager.states()
+        initial = await states.__anext__()
+        # Nobody reads while these happen, only the last one is kept
+        for _ in range(10):
+            game_manager.trigger_key_down(KeyCode.from_char("a"))
+        latest = await states.__anext__()
+        await states.aclose()
+        return initial, latest
+
+    initial, latest = asyncio.run(stream())
+    assert initial.current_combo == 0
+    assert latest.current_combo == 10
+
+
+def test_many_subscribers_with_bounded_queues():
+    async def stream():
+        game_manager = GameManager([])
+        short = game_manager.states(maxsize=1)
+        long = game_manager.states(maxsize=3)
+        await short.__anext__()
+        await long.__anext__()
+        for _ in range(5):
+            game_manager.trigger_key_down(KeyCode.from_char("a"))
+        short_combos = [(await short.__anext__()).current_combo]
+        long_combos = [(await long.__anext__()).current_combo for _ in range(3)]
+        await short.aclose()
+        await long.aclose()
+        return short_combos, long_combos
+
+    short_combos, long_combos = asyncio.run(stream())
+    assert short_combos == [5]
+    assert long_combos == [3, 4, 5]
+
+
+def test_streamed_states_outlive_the_next_word():
+    async def stream():
+        clock = VirtualClock()
+        game_manager = GameManager([], clock)
+        states = game_manager.states()
+        await states.__anext__()
+        for _ in range(34):
+            clock.advance(0.1)
+            game_manager.trigger_key_down(KeyCode.from_char("a"))
+        before = await states.__anext__()
+        # The 35th key records a WPM, then the combo times out
+        clock.advance(0.1)
+        game_manager.trigger_key_down(KeyCode.from_char("a"))
+        after = await states.__anext__()
+        clock.advance(11)
+        game_manager.trigger_tick()
+        await states.aclose()
+        return before, after
+
+    before, after = asyncio.run(stream())
+    assert (before.current_combo, after.current_combo) == (34, 35)
+    assert before == before
+    assert before != after
+    assert len(before.recorded_wpms) == 2
+    assert len(after.recorded_wpms) == 3
+    assert list(after.recorded_wpms[:2]) == list(before.recorded_wpms)
+    assert before.median_wpm == before.copy().median_wpm
+
+
+def test_async_tick_scheduler():
+    mock_serial = Mock()
+
+    async def play():
+        game_manager = GameManager([BellController(mock_serial)])
+        scheduler = AsyncTickScheduler(game_manager)
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.02)
+        scheduler.trigger_key_down(KeyCode.from_char("a"))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        return scheduler.ticks
+
+    # Start up tick and the bell turning off
+    assert asyncio.run(play()) == 2
+    assert [args for args, _ in mock_serial.write.call_args_list] == [
+        (b"0000",),
+        (b"1000",),
+        (b"0000",),
+    ]
@@ -4,13 +4,13 @@ from unittest.mock import Mock, call, patch
 import pytest
 from pynput.keyboard import KeyCode
 
-from power_mode.main import GameState, StripController
+from power_mode.main import AnimatedStripController, GameState, StripController
 
 
 @pytest.fixture
 def strip_controller() -> Generator[StripController, None, None]:
     with patch(
-        "power_mode.main.sleep",
+        "power_mode.controllers.sleep",
     ):
         yield StripController(Mock())
 
@@ -44,20 +44,63 @@ def test_tick(strip_controller: StripController):
 
 
 def test_key_down(strip_controller: StripController):
-    game_state = GameState.start()
+    game_state = GameState.start().copy(current_combo=1)
     mock_serial = cast(Mock, strip_controller.serial_connection)
     for index in range(StripController.NUM_PIXELS):
         strip_controller.key_down(KeyCode.from_char("a"), game_state)
+        # Nothing is sent until the next tick
+        assert len(mock_serial.write.call_args_list) == index
+        strip_controller.tick(game_state, float(index))
         assert len(mock_serial.write.call_args_list) == index + 1
         assert mock_serial.write.call_args == call(f"{index},0;".encode("utf-8"))
     # Next call should change the color
     strip_controller.key_down(KeyCode.from_char("a"), game_state)
+    strip_controller.tick(game_state, float(StripController.NUM_PIXELS))
     assert len(mock_serial.write.call_args_list) == StripController.NUM_PIXELS + 1
     current_color = strip_controller.color
     assert current_color != 0
     assert mock_serial.write.call_args == call(f"0,{current_color};".encode("utf-8"))
 
 
+def test_key_down_batches_until_tick(strip_controller: StripController):
+    game_state = GameState.start().copy(current_combo=1)
+    mock_serial = cast(Mock, strip_controller.serial_connection)
+    for _ in range(10):
+        strip_controller.key_down(KeyCode.from_char("a"), game_state)
+    strip_controller.tick(game_state, 1.0)
+    assert mock_serial.write.call_args_list == [call(b"0,0,9;")]
+
+    # A run that wraps round the strip changes color and needs two fills
+    strip_controller.index = StripController.NUM_PIXELS - 2
+    for _ in range(4):
+        strip_controller.key_down(KeyCode.from_char("a"), game_state)
+    # Too soon after the last flush, ticks for other controllers don't send
+    strip_controller.tick(game_state, 1.01)
+    assert len(mock_serial.write.call_args_list) == 1
+    assert not strip_controller.timer_due(1.01)
+    assert strip_controller.timer_due(1.0 + StripController.FLUSH_INTERVAL)
+    strip_controller.tick(game_state, 1.0 + StripController.FLUSH_INTERVAL)
+    current_color = strip_controller.color
+    assert mock_serial.write.call_args_list[1:] == [
+        call(b"142,0,143;"),
+        call(f"0,{current_color},1;".encode("utf-8")),
+    ]
+
+
+def test_next_deadline(strip_controller: StripController):
+    game_state = GameState.start().copy(current_combo=1)
+    assert strip_controller.next_deadline(game_state, 100.0) is None
+    strip_controller.key_down(KeyCode.from_char("a"), game_state)
+    assert strip_controller.next_deadline(game_state, 100.0) == 100.0
+    strip_controller.tick(game_state)
+    assert strip_controller.next_deadline(game_state, 100.0) is None
+    strip_controller.key_down(KeyCode.from_char("a"), game_state)
+    # Flushes are rate limited
+    assert strip_controller.next_deadline(game_state, 0.0) == (
+        strip_controller.last_flush + StripController.FLUSH_INTERVAL
+    )
+
+
 def test_colors(strip_controller: StripController):
     game_state = GameState.start()
     colors = []
@@ -70,3 +113,78 @@ def test_colors(strip_controller: StripController):
     for color in colors:
         assert last_color != color
         last_color = color
+
+
+def test_keys_down(strip_controller: StripController):
+    one_at_a_time = StripController(Mock())
+    one_at_a_time.colors = strip_controller.colors[:]
+    game_state = GameState.start()
+    for count in [3, 200, 1, 150]:
+        strip_controller.keys_down(count, game_state)
+        for _ in range(count):
+            one_at_a_time.key_down(KeyCode.from_char("a"), game_state)
+        assert strip_controller.pending_runs == one_at_a_time.pending_runs
+        assert strip_controller.index == one_at_a_time.index
+        assert strip_controller.color == one_at_a_time.color
+
+
+def test_animated_strip_sends_only_changes():
+    with patch("power_mode.controllers.sleep"):
+        strip_controller = AnimatedStripController(Mock())
+    mock_serial = cast(Mock, strip_controller.serial_connection)
+    strip_controller.color = 4
+    state = GameState.start(0.0)
+    # The first frame clears whatever was on the strip
+    strip_controller.tick(state, 0.0)
+    assert mock_serial.write.call_args_list == [call(b"0,e;")]
+    assert strip_controller.next_deadline(state, 0.0) is None
+
+    state = state.increment_by(3, now=1.0)
+    strip_controller.keys_down(3, state, 1.0)
+    assert strip_controller.next_deadline(state, 1.0) == 1.0
+    mock_serial.reset_mock()
+    strip_controller.tick(state, 1.0)
+    # The new pixels at the head of the trail
+    assert mock_serial.write.call_args_list == [call(b"0,3,2;")]
+    mock_serial.reset_mock()
+    strip_controller.tick(state, 1.001)
+    # Not due until the trail moves on, and no faster than the frame rate
+    assert mock_serial.write.call_args_list == []
+    deadline = strip_controller.next_deadline(state, 1.001)
+    assert deadline == pytest.approx(1.081)
+    strip_controller.tick(state, deadline)
+    assert mock_serial.write.call_args_list == [call(b"0,2,2;")]
+    mock_serial.reset_mock()
+
+    state = state.combo_stopped(now=11.0)
+    strip_controller.tick(state, 11.0)
+    assert mock_serial.write.call_args_list == [call(b"0,e;")]
+    assert strip_controller.index == 0
+    assert strip_controller.next_deadline(state, 11.0) is None
+
+
+def test_animated_strip_redraws_after_lost_frames():
+    strip_controller = AnimatedStripController(Mock())
+    writer = strip_controller.writer = Mock(frames_dropped=0)
+    state = GameState.start(0.0).increment_by(3, now=1.0)
+    strip_controller.keys_down(3, state, 1.0)
+    strip_controller.tick(state, 1.0)
+    assert strip_controller.shown is not None
+
+    def frames_sent(now: float) -> list:
+        writer.reset_mock()
+        strip_controller.keys_down(1, state, now)
+        strip_controller.tick(state, now)
+        return [args.args[0] for args in writer.submit.call_args_list]
+
+    # Only what changed while nothing is lost
+    assert frames_sent(2.0)[0] != b"0,e;"
+    writer.frames_dropped = 1
+    assert frames_sent(3.0)[0] != b"0,e;"
+    assert strip_controller.shown is None
+    assert frames_sent(4.0)[0] == b"0,e;"
+
+    strip_controller.connected = False
+    assert frames_sent(5.0) == []
+    strip_controller.connected = True
+    assert frames_sent(6.0)[0] == b"0,e;"
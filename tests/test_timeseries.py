@@ -0,0 +1,107 @@
+import tracemalloc
+from unittest.mock import Mock
+
+import pytest
+from pynput.keyboard import KeyCode
+
+from power_mode.clock import VirtualClock
+from power_mode.main import GameManager
+from power_mode.timeseries import Sample, WpmTimeSeries
+
+KEY = KeyCode.from_char("a")
+
+
+def test_samples_share_a_bucket():
+    series = WpmTimeSeries()
+    series.record(60, 5, at=10.2)
+    series.record(80, 10, at=10.7)
+    series.record(100, 15, at=11.1)
+    assert list(series.range(0, 100)) == [
+        Sample(10.0, 70.0, 10, 2),
+        Sample(11.0, 100.0, 15, 1),
+    ]
+    assert list(series.range(10.5, 100)) == [Sample(11.0, 100.0, 15, 1)]
+    assert list(series.range(0, 11)) == [Sample(10.0, 70.0, 10, 2)]
+
+
+def test_rolls_up():
+    series = WpmTimeSeries(levels=((1.0, 5), (10.0, 5)))
+    for second in range(25):
+        series.record(second, second, at=second)
+    # Only the last five closed seconds are kept at full resolution, plus the
+    # one still open
+    assert [sample.time for sample in series.range(0, 100, 1.0)] == [
+        19.0,
+        20.0,
+        21.0,
+        22.0,
+        23.0,
+        24.0,
+    ]
+    assert list(series.range(0, 100, 10.0)) == [
+        Sample(0.0, 4.5, 9, 10),
+        Sample(10.0, 14.5, 19, 10),
+        # Second 24 is still open at the level below
+        Sample(20.0, 21.5, 23, 4),
+    ]
+    # The finest level reaching back far enough
+    assert series.range(0, 100).__next__().time == 0.0
+    assert series.range(21, 100).__next__().time == 21.0
+    with pytest.raises(ValueError):
+        list(series.range(0, 100, 5.0))
+
+
+def test_oldest_coarse_buckets_dropped():
+    series = WpmTimeSeries(levels=((1.0, 2), (10.0, 2)))
+    for second in range(100):
+        series.record(50, 1, at=second)
+    assert [sample.time for sample in series.range(0, 1000, 10.0)] == [
+        70.0,
+        80.0,
+        90.0,
+    ]
+
+
+def test_memory_constant():
+    series = WpmTimeSeries()
+    for second in range(4000):
+        series.record(60, 1, at=second)
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        # A week of a sample a second
+        for second in range(4000, 4000 + 7 * 24 * 3600, 7):
+            series.record(60, 1, at=second)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert after - before < 1000
+
+
+def test_game_manager_records_wpm():
+    clock = VirtualClock()
+    manager = GameManager([Mock()], clock)
+    wall_clock = Mock(side_effect=lambda: 1000 + clock.now)
+    manager.track_wpm(WpmTimeSeries(wall_clock=wall_clock, clock=clock))
+    assert manager.wpm_series is not None
+    start = clock.now
+    for _ in range(30):
+        clock.advance(0.1)
+        manager.trigger_key_down(KEY)
+    samples = list(manager.wpm_series.range(0, float("inf")))
+    assert samples
+    # Read once for the offset, not per sample
+    assert wall_clock.call_count == 1
+    assert 1000 + start <= samples[0].time <= 1000 + clock.now
+    assert samples[-1].combo == 30
+    recorded_wpms = manager.game_state.recorded_wpms
+    assert sum(sample.samples for sample in samples) == len(recorded_wpms)
+    assert samples[-1].wpm == pytest.approx(sum(recorded_wpms[-2:]) / 2)
+
+
+def test_series_must_use_the_managers_clock():
+    clock = VirtualClock()
+    manager = GameManager([], clock)
+    assert manager.track_wpm().clock is clock
+    with pytest.raises(ValueError):
+        manager.track_wpm(WpmTimeSeries())